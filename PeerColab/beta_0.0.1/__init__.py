@@ -3,46 +3,260 @@ PeerColab
 
 Base python file for PeerColab Flask App
 
+Create the app with create_app(), which picks ProdConfig or DevConfig from
+the FLASK_ENV environment variable. Each process makes its own database
+manager, hashing pool and caches on first use, so a server that forks
+workers after creating the app never shares them across processes.
+
 Copyright Joan Chirinos, 2021.
 """
 
 import sys
 import os
+import csv
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import quote
 # import datetime
 
-from flask import (Flask, render_template, redirect, url_for, session, request,
-                   flash, current_app)
+from flask import (Flask, Blueprint, render_template, redirect, url_for,
+                   session, request, flash, current_app, jsonify, Response,
+                   stream_with_context, make_response)
 from markupsafe import Markup
+from werkzeug.local import LocalProxy
 
-from util import db, helpers
+from util import (cache, collab, connection, db, editlog, export, hashing,
+                  helpers, history, jobs, presence, profiling, pubsub,
+                  uploads)
 import config
 
-app = Flask(__name__)
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+views = Blueprint('views', __name__)
+
+
+class Services:
+
+    def __init__(self, app: Flask) -> None:
+        """
+        Initialize Services class, what one process of the app works with.
+
+        Nothing here is opened yet: connections, the hashing pool and
+        background threads start on first use.
+
+        Parameters
+        ----------
+        app : Flask
+            the app, whose config sizes everything.
+
+        Returns
+        -------
+        None
+
+        """
+        conf = app.config
+        data = os.path.dirname(conf['DATABASE_URI'])
+        self.hasher = hashing.Hasher(conf['SCRYPT_N'], conf['SCRYPT_R'],
+                                     conf['SCRYPT_P'], conf['HASH_WORKERS'],
+                                     conf['HASH_QUEUE_SIZE'],
+                                     conf['HASH_TIMEOUT'])
+        self.auth_cache = cache.TTLCache(conf['AUTH_CACHE_SIZE'],
+                                         conf['AUTH_CACHE_TTL'])
+        # Rendered row lists, keyed by the version counters they depend on
+        self.fragment_cache = cache.TTLCache(conf['FRAGMENT_CACHE_SIZE'],
+                                             conf['FRAGMENT_CACHE_TTL'])
+        self.edit_log = editlog.EditLog(
+            os.path.join(data, 'editlog'), conf['EDIT_LOG_SNAPSHOT_OPS'],
+            conf['EDIT_LOG_SNAPSHOT_BYTES'], conf['EDIT_LOG_FSYNC'],
+            conf['EDIT_LOG_COMPACT_SECONDS'])
+        self.upload_store = uploads.UploadStore(
+            os.path.join(data, 'uploads'), conf['UPLOAD_CHUNK_SIZE'])
+        # Workers are started by start_jobs, so commands don't run any
+        self.jobs = jobs.JobQueue(
+            connection.ConnectionManager(conf['DATABASE_URI']),
+            conf['JOB_LEASE_SECONDS'], conf['JOB_MAX_ATTEMPTS'],
+            conf['JOB_POLL_SECONDS'])
+        # Who is on which file, as told by this process's heartbeats
+        self.presence = presence.PresenceRegistry(
+            conf['PRESENCE_TTL'], conf['PRESENCE_TICK'],
+            conf['PRESENCE_COALESCE'])
+        # Changes published to this process's change feeds
+        self.events = pubsub.PubSub(conf['EVENT_QUEUE_SIZE'],
+                                    conf['EVENT_HISTORY_SIZE'],
+                                    conf['EVENT_MAX_TOPICS'],
+                                    conf['EVENT_MAX_STREAMS'])
+        self.dbm = db.DBManager(
+            conf['DATABASE_URI'],
+            os.path.join(app.root_path, 'static', 'table_definitions.sql'),
+            hasher=self.hasher, auth_cache=self.auth_cache,
+            edit_log=self.edit_log, uploads=self.upload_store,
+            jobs=self.jobs, events=self.events,
+            history=history.VersionHistory(
+                conf['HISTORY_KEYFRAME_INTERVAL'], conf['HISTORY_MAX_BYTES'],
+                conf['HISTORY_KEEP_VERSIONS'], conf['HISTORY_KEEP_SECONDS']))
+        if conf['PROFILE_REQUESTS']:
+            profiling.instrument(self.dbm)
+
+        # Files being edited live, logged and snapshotted through the
+        # DBManager
+        self.collab_hub = collab.CollabHub(
+            self.dbm.load_file, self.dbm.log_edit, self.dbm.save_snapshot,
+            conf['COLLAB_HISTORY_SIZE'], conf['COLLAB_MAX_CHARS'],
+            conf['COLLAB_IDLE_SECONDS'], conf['EVENT_MAX_STREAMS'],
+            os.path.join(data, 'collab.lock'))
+
+
+_services_lock = threading.Lock()
+
+
+def get_services(app: Optional[Flask] = None) -> Services:
+    '''
+    Get this process's services for the app, the current one by default,
+    making them on first use. A forked worker makes its own rather than
+    using its parent's.
+    '''
+    if app is None:
+        app = current_app._get_current_object()
+    made = app.extensions['peercolab']
+    pid = os.getpid()
+    if made['pid'] != pid:
+        with _services_lock:
+            if made['pid'] != pid:
+                made['services'] = Services(app)
+                made['pid'] = pid
+    return made['services']
+
+
+def warm(app: Flask) -> None:
+    '''
+    Make this process's services and open its database connection, so the
+    first request doesn't wait for them. Call it in each worker after it
+    forks, e.g. from gunicorn's post_fork hook. Also starts its job
+    workers.
+    '''
+    services = get_services(app)
+    services.dbm.connections.get()
+    services.jobs.start(app.config['JOB_WORKERS'])
+
+
+@views.before_app_first_request
+def start_jobs() -> None:
+    '''
+    Start this process's job workers, if warm() hasn't.
+    '''
+    get_services().jobs.start(current_app.config['JOB_WORKERS'])
+
+
+# This process's services for the current app, used as if they were globals
+dbm = LocalProxy(lambda: get_services().dbm)
+fragment_cache = LocalProxy(lambda: get_services().fragment_cache)
+collab_hub = LocalProxy(lambda: get_services().collab_hub)
+presence_registry = LocalProxy(lambda: get_services().presence)
+
+
+def create_app(config_object: Optional[type] = None,
+               overrides: Optional[Dict[str, Any]] = None) -> Flask:
+    '''
+    Create the app.
+
+    Uses config_object, or the config named by the FLASK_ENV environment
+    variable (development if unset), then overrides. Templates are compiled
+    and the URL map built here, before any fork, so workers share them; the
+    database and hashing pool wait for each process's first request, or for
+    warm().
+
+    Live editing must be served by a single process: its documents and
+    revisions are kept in memory. Behind several workers, the first to open
+    a document serves it until it exits, and the others answer the editor
+    and /collab routes with an error, so route /file/ and /collab/ to one
+    worker.
+    '''
+    app = Flask(__name__, root_path=ROOT)
+    if config_object is None:
+        config_object = config.CONFIGS[os.environ.get('FLASK_ENV',
+                                                      'development')]
+    app.config.from_object(config_object)
+    app.config.update(overrides or {})
 
-# Production Config
-# app.config.from_object(config.ProdConfig)
+    app.extensions['peercolab'] = {'pid': None, 'services': None}
+    if app.config['PROFILE_REQUESTS']:
+        def cache_stats() -> Dict[str, Dict[str, int]]:
+            services = get_services(app)
+            return {'auth': services.auth_cache.stats(),
+                    'fragment': services.fragment_cache.stats()}
 
-# Development Config
-app.config.from_object(config.DevConfig)
+        profiling.install(app, cache_stats)
+    app.register_blueprint(views)
 
-# Database Manager with correct databse path and table defns path
-with app.app_context():
-    cwd = os.getcwd()
-    dbm = db.DBManager(current_app.config['DATABASE_URI'],
-                       f'{cwd}/static/table_definitions.sql')
+    # Changes with the templates, so pages revalidated after a deploy
+    # re-render
+    templates = os.path.join(app.root_path, 'templates')
+    app.config['TEMPLATES_VERSION'] = str(max(
+        os.stat(os.path.join(templates, name)).st_mtime_ns
+        for name in os.listdir(templates)))
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    app.url_map.update()
 
+    return app
 
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
+
+def page_etag(email: str, versions: tuple) -> str:
+    '''
+    Get the ETag of a page that only changes with the given version
+    counters, or None if the page must be rendered anyway because a flashed
+    message is waiting to be shown on it.
+    '''
+    if session.get('_flashes'):
+        return None
+
+    key = '\n'.join((current_app.config['TEMPLATES_VERSION'], email,
+                     request.full_path, *map(str, versions)))
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def conditional(etag: str, render) -> Response:
+    '''
+    Answer with 304 if the client's copy has this ETag, otherwise with the
+    response render() makes. Either way the client must revalidate before
+    reusing the page, and only for this user.
+    '''
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = make_response(render())
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@views.app_errorhandler(hashing.HasherBusy)
+def hasher_busy(e):
+    '''
+    Too many people are logging in or registering at once.
+
+    Flashes a warning and redirects home.
+    '''
+    flash('Lots of people are logging in right now. '
+          'Please try again in a moment.', 'warning')
+    return redirect(url_for('.home'))
+
+
+@views.route('/', defaults={'path': ''})
+@views.route('/<path:path>')
 def catch_all(path):
     '''
     Catch-all route in case some typo happens or something
     '''
     flash(f'Invalid endpoint: /{path}', 'warning')
-    return redirect(url_for('home'))
+    return redirect(url_for('.home'))
 
 
-@app.route('/')
+@views.route('/')
 def home():
     '''
     Render the homepage.
@@ -50,11 +264,11 @@ def home():
     If user is logged in, redirect to their files.
     '''
     if 'email' in session:
-        return redirect(url_for('projects'))
+        return redirect(url_for('.projects'))
     return render_template('index.html')
 
 
-@app.route('/login')
+@views.route('/login')
 def login_page():
     '''
     Render the login page.
@@ -62,11 +276,11 @@ def login_page():
     If user is logged in, redirect to their files.
     '''
     if 'email' in session:
-        return redirect(url_for('projects'))
+        return redirect(url_for('.projects'))
     return render_template('login.html')
 
 
-@app.route('/register')
+@views.route('/register')
 def register_page():
     '''
     Render the registration page.
@@ -74,49 +288,120 @@ def register_page():
     If user is logged in, redirect to their files.
     '''
     if 'email' in session:
-        return redirect(url_for('projects'))
+        return redirect(url_for('.projects'))
     return render_template('register.html')
 
 
-@app.route('/projects')
+@views.route('/projects')
 def projects():
     '''
     Render main projects page.
     '''
     if 'email' not in session:
         flash('You must be logged in to view that page!', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('.home'))
     else:
         email = session['email']
-        ids = dbm.get_projects(email)
-        projects = list((dbm.get_project_name(id)[1],
-                         id,
-                         dbm.is_admin(email, id)) for id in ids)
-        projects = tuple(sorted(projects))
-        return render_template('projects.html', projects=projects)
+        versions = dbm.get_versions(email)
+        after = request.args.get('after')
 
+        def rows():
+            projects, next_after = dbm.get_project_listing(
+                email, after, current_app.config['PROJECTS_PER_PAGE'])
+            return Markup(render_template('projects_rows.html',
+                                          projects=projects,
+                                          after=next_after,
+                                          first='after' in request.args))
 
-@app.route('/project/<project_id>')
+        def render():
+            key = ('projects', email, versions[0], after,
+                   current_app.config['PROJECTS_PER_PAGE'])
+            return render_template('projects.html',
+                                   rows=fragment_cache.cached(key, rows),
+                                   teacher=dbm.is_teacher(email))
+
+        return conditional(page_etag(email, versions), render)
+
+
+@views.route('/project/<project_id>')
 def project(project_id):
     '''
     Render page for project with given id
     '''
     if 'email' not in session:
         flash('You must be logged in to view that page!', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('.home'))
     else:
         email = session['email']
-        if not dbm.is_member(email, project_id):
-            flash('You don\'t have permission to do that!', 'warning')
-            return redirect(url_for(projects))
+        versions = dbm.get_versions(email, project_id)
+        # Only members are ever sent this ETag, and losing membership bumps
+        # the viewer's version, so a match means they're still a member
+        etag = page_etag(email, versions)
+        if etag is not None and request.if_none_match.contains_weak(etag):
+            return conditional(etag, None)
+
+        # Members all see the same rows, so they share one cached copy
+        after = request.args.get('after')
+        key = ('project', project_id, versions[1], after,
+               current_app.config['FILES_PER_PAGE'])
+        hit, page = fragment_cache.get(key)
+        if not hit or not dbm.is_member(email, project_id):
+            member, project_name, files, next_after = dbm.get_project_page(
+                email, project_id, after, current_app.config['FILES_PER_PAGE'])
+            if not member:
+                flash(project_name, 'warning')
+                return redirect(url_for('.projects'))
+
+            page = project_name, Markup(render_template(
+                'project_rows.html', project_id=project_id, files=files,
+                after=next_after, first='after' in request.args))
+            fragment_cache.set(key, page)
+
+        project_name, rows = page
+        return conditional(etag, lambda: render_template(
+            'project.html', project_id=project_id,
+            project_name=project_name, rows=rows,
+            admin=dbm.is_admin(email, project_id)))
+
+
+@views.route('/search')
+def search():
+    '''
+    Search the files in every project the user is a member of.
+
+    Responds with JSON if the client prefers it, otherwise renders the
+    results page. JSON snippets are plain text, with matches giving the
+    [start, end] offsets of each match in them.
+    '''
+    if 'email' not in session:
+        flash('You must be logged in to view that page!', 'danger')
+        return redirect(url_for('.home'))
+    email = session['email']
+    query = request.args.get('q', '').strip()
+
+    results = dbm.search(email, query,
+                         current_app.config['SEARCH_RESULTS'])
 
-        project_name = dbm.get_project_name(project_id)
-        #files =
+    if request.accept_mimetypes.best == 'application/json':
+        rows = []
+        for file_id, file_name, project_id, project_name, snippet \
+                in results:
+            text, matches = db.split_snippet(snippet)
+            rows.append({'file_id': file_id, 'file_name': file_name,
+                         'project_id': project_id,
+                         'project_name': project_name, 'snippet': text,
+                         'matches': matches})
+        return jsonify(results=rows)
 
-        return render_template('project.html', **locals())
+    # Escape the text, then turn the match marks into highlights
+    results = [row[:4] + (Markup(str(Markup.escape(row[4]))
+                                 .replace(db.MATCH_START, '<mark>')
+                                 .replace(db.MATCH_END, '</mark>')),)
+               for row in results]
+    return render_template('search.html', query=query, results=results)
 
 
-@app.route('/authenticate', methods=['POST'])
+@views.route('/authenticate', methods=['POST'])
 def authenticate():
     '''
     Attempt to log user in.
@@ -130,13 +415,13 @@ def authenticate():
     if helpers.verify_auth_args(email, password)\
        and dbm.authenticate_user(email, password):
         session['email'] = email
-        return redirect(url_for('projects'))
+        return redirect(url_for('.projects'))
     else:
         flash('Incorrect username or password!', 'danger')
-        return redirect(url_for('login_page'))
+        return redirect(url_for('.login_page'))
 
 
-@app.route('/registerUser', methods=['POST'])
+@views.route('/registerUser', methods=['POST'])
 def register():
     '''
     Attempt to register user.
@@ -151,19 +436,19 @@ def register():
 
     if not helpers.verify_auth_args(first, last, email, password):
         flash('One or more fields is improperly formatted!', 'danger')
-        return redirect(url_for('register_page'))
+        return redirect(url_for('.register_page'))
     elif not dbm.register_user(email, password, first, last, 0):
         s = ('Email already in use! <a href="/login" class="alert-link">'
              + 'Log in?</a>')
         flash(Markup(s), 'danger')
-        return redirect(url_for('register_page'))
+        return redirect(url_for('.register_page'))
     else:
         session['email'] = email
         flash('Account creastion successful!', 'success')
-        return redirect(url_for('projects'))
+        return redirect(url_for('.projects'))
 
 
-@app.route('/logout')
+@views.route('/logout')
 def logout():
     '''
     Attempt to log user out.
@@ -172,10 +457,10 @@ def logout():
     '''
     if 'email' in session:
         session.pop('email')
-    return redirect(url_for('home'))
+    return redirect(url_for('.home'))
 
 
-@app.route('/create/project', methods=['POST'])
+@views.route('/create/project', methods=['POST'])
 def create_project():
     '''
     Attempt to create project.
@@ -184,7 +469,7 @@ def create_project():
     '''
     if 'email' not in session:
         flash('You need to be logged in to do that!', 'warning')
-        return redirect(url_for('home'))
+        return redirect(url_for('.home'))
     email = session['email']
     teacher = request.form['teacherEmail']
     name = request.form['projectName']
@@ -193,17 +478,17 @@ def create_project():
     if forclass:
         if not dbm.is_teacher(teacher):
             flash('Teacher\'s email is invalid!', 'danger')
-            return redirect(url_for('projects'))
+            return redirect(url_for('.projects'))
         project_id = dbm.create_project(teacher, name)
         dbm.add_member(email, project_id)
     else:
         dbm.create_project(email, name)
 
     flash('Successfully created new project!', 'success')
-    return redirect(url_for('projects'))
+    return redirect(url_for('.projects'))
 
 
-@app.route('/create/file/<project_id>', methods=['POST'])
+@views.route('/create/file/<project_id>', methods=['POST'])
 def create_file(project_id: str):
     '''
     Attempt to create file.
@@ -212,7 +497,7 @@ def create_file(project_id: str):
     '''
     if 'email' not in session:
         flash('You need to be logged in to do that!', 'warning')
-        return redirect(url_for('home'))
+        return redirect(url_for('.home'))
     email = session['email']
 
     name = request.form['fileName']
@@ -220,10 +505,145 @@ def create_file(project_id: str):
     dbm.create_file(email, project_id, name)
 
     flash('Successfully created new file!', 'success')
-    return redirect(url_for('projects'))
+    return redirect(url_for('.projects'))
 
 
-@app.route('/delete/<type>/<id>')
+@views.route('/import/members/<project_id>', methods=['POST'])
+def import_members(project_id: str):
+    '''
+    Attempt to add every member on an uploaded CSV roster to a project.
+
+    Responds with a per-row JSON report if the client prefers JSON.
+    Otherwise flashes a summary and redirects to project page.
+    '''
+    if 'email' not in session:
+        flash('You need to be logged in to do that!', 'warning')
+        return redirect(url_for('.home'))
+    email = session['email']
+    wants_json = request.accept_mimetypes.best == 'application/json'
+
+    error, roster = None, []
+    upload = request.files.get('roster')
+    if upload is None:
+        error = 'No roster was uploaded!'
+    else:
+        try:
+            roster = helpers.parse_roster(upload.stream)
+        except (UnicodeDecodeError, csv.Error):
+            error = 'The roster must be a UTF-8 CSV file.'
+    if len(roster) > current_app.config['ROSTER_MAX_ROWS']:
+        error = (f'Rosters can have at most '
+                 f'{current_app.config["ROSTER_MAX_ROWS"]} rows.')
+
+    if error is None:
+        ok, result = dbm.add_members(email, project_id,
+                                     [member for _, member in roster])
+        if not ok:
+            error = result
+
+    if error is not None:
+        if wants_json:
+            return jsonify(error=error), 400
+        flash(error, 'warning')
+        return redirect(url_for('.project', project_id=project_id))
+
+    rows = [{'line': line, 'email': member.strip(), 'status': status}
+            for (line, member), status in zip(roster, result)]
+    if wants_json:
+        return jsonify(rows=rows)
+
+    added = sum(row['status'].startswith('added') for row in rows)
+    flash(f'Added {added} of {len(rows)} members!', 'success')
+    skipped = [f'line {row["line"]} ({row["status"]})'
+               for row in rows if not row['status'].startswith('added')]
+    if skipped:
+        flash('Skipped ' + ', '.join(skipped[:10])
+              + (f' and {len(skipped) - 10} more.' if len(skipped) > 10
+                 else '.'), 'warning')
+    return redirect(url_for('.project', project_id=project_id))
+
+
+@views.route('/upload/start/<project_id>', methods=['POST'])
+def start_upload(project_id: str):
+    '''
+    Start a chunked upload of a new file, given its name and size as JSON.
+
+    Responds with the upload's id, chunk size and number of chunks. Each
+    chunk is then PUT to /upload/<upload_id>/<n>, and the upload finished
+    with a POST to /upload/<upload_id>/finish.
+    '''
+    if 'email' not in session:
+        return jsonify(error='You need to be logged in to do that!'), 401
+    email = session['email']
+
+    body = request.get_json(silent=True) or {}
+    name, size = body.get('name'), body.get('size')
+    if not isinstance(name, str) or not name.strip() \
+            or not isinstance(size, int):
+        return jsonify(error='A file name and size are needed.'), 400
+
+    dbm.expire_uploads(current_app.config['UPLOAD_MAX_AGE'])
+    ok, result = dbm.start_upload(email, project_id, name.strip(), size,
+                                  current_app.config['UPLOAD_QUOTA_BYTES'],
+                                  body.get('sha256'))
+    if not ok:
+        return jsonify(error=result), 400
+
+    return jsonify(dbm.get_upload(email, result)[1]), 201
+
+
+@views.route('/upload/<upload_id>')
+def upload_status(upload_id: str):
+    '''
+    Get an upload's progress as JSON, to resume it.
+    '''
+    if 'email' not in session:
+        return jsonify(error='You need to be logged in to do that!'), 401
+
+    ok, result = dbm.get_upload(session['email'], upload_id)
+    if not ok:
+        return jsonify(error=result), 404
+
+    return jsonify(result)
+
+
+@views.route('/upload/<upload_id>/<int:n>', methods=['PUT'])
+def upload_chunk(upload_id: str, n: int):
+    '''
+    Store chunk n of an upload from the raw request body.
+
+    The body is streamed to disk, never read into memory whole. If an
+    X-Chunk-SHA256 header is sent, the chunk must match it.
+    '''
+    if 'email' not in session:
+        return jsonify(error='You need to be logged in to do that!'), 401
+
+    ok, result = dbm.write_upload_chunk(session['email'], upload_id, n,
+                                        request.stream,
+                                        request.content_length or 0,
+                                        request.headers.get('X-Chunk-SHA256'))
+    if not ok:
+        return jsonify(error=result), 400
+
+    return jsonify(n=n, sha256=result)
+
+
+@views.route('/upload/<upload_id>/finish', methods=['POST'])
+def finish_upload(upload_id: str):
+    '''
+    Turn a fully received upload into a file.
+    '''
+    if 'email' not in session:
+        return jsonify(error='You need to be logged in to do that!'), 401
+
+    ok, result = dbm.finish_upload(session['email'], upload_id)
+    if not ok:
+        return jsonify(error=result), 400
+
+    return jsonify(file_id=result)
+
+
+@views.route('/delete/<type>/<id>')
 def delete(type: str, id: str):
     '''
     Attempt to delete project with given project_id.
@@ -232,34 +652,525 @@ def delete(type: str, id: str):
     '''
     if 'email' not in session:
         flash('You need to be logged in to do that!', 'warning')
-        return redirect(url_for('home'))
+        return redirect(url_for('.home'))
     email = session['email']
     result, error_msg = None, None
 
     if type == 'project':
         result, error_msg = dbm.delete_project(email, id)
     if type == 'file':
+        _, project_id = dbm.get_file_project(id)
         result, error_msg = dbm.delete_file(email, id)
+        if result:
+            collab_hub.forget(id)
 
     if result is None:
         flash('Invalid request!', 'warning')
     elif not result:
         flash(error_msg, 'warning')
     else:
-        flash('Project deleted successfully!', 'success')
+        flash(f'{type.capitalize()} deleted successfully!', 'success')
 
-    if type == 'project':
-        return redirect(url_for('projects'))
-    elif type == 'file':
-        return redirect(url_for('project', project_id=id))
+    if type == 'file' and result:
+        return redirect(url_for('.project', project_id=project_id))
+    return redirect(url_for('.projects'))
+
+
+def event_stream(topics, versions) -> Response:
+    '''
+    Stream what's published to topics as Server-Sent Events, until the
+    client leaves or EVENT_STREAM_SECONDS pass and it reconnects. The
+    stream holds a server thread the whole time.
+
+    Each event's data is a JSON object with a type. Changes made by other
+    processes reach their own hubs, not this one, so versions() is read
+    whenever the stream is idle for a keepalive: if the version counters
+    the topics' changes bump have moved, a changed event is sent. A resync
+    event means some changes were missed and ends the stream.
+    '''
+    last_id = request.headers.get('Last-Event-ID', '')
+    try:
+        subscription = dbm.events.subscribe(
+            topics, int(last_id) if last_id.isdigit() else None)
+    except pubsub.HubFull:
+        return (jsonify(error='Too many open feeds, try again soon.'), 503,
+                {'Retry-After': '30'})
+
+    keepalive = current_app.config['EVENT_KEEPALIVE_SECONDS']
+    end = time.monotonic() + current_app.config['EVENT_STREAM_SECONDS']
+
+    def events(seen):
+        try:
+            while time.monotonic() < end:
+                try:
+                    entries = subscription.get(keepalive)
+                except pubsub.Dropped:
+                    yield f'data: {pubsub.RESYNC}\n\n'
+                    return
+
+                if not entries:
+                    now = versions()
+                    if now == seen:
+                        yield ': keepalive\n\n'
+                    else:
+                        seen = now
+                        yield 'data: {"type": "changed"}\n\n'
+                    continue
+
+                for id, data in entries:
+                    yield f'id: {id}\ndata: {data}\n\n'
+                    if data == pubsub.RESYNC:
+                        return
+                seen = versions()
+        finally:
+            subscription.close()
+
+    return Response(stream_with_context(events(versions())),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
+
+
+@views.route('/events/projects')
+def projects_events():
+    '''
+    Stream changes to the user's projects as Server-Sent Events: projects
+    added and removed.
+    '''
+    if 'email' not in session:
+        return jsonify(error='Forbidden'), 403
+
+    email = session['email']
+    return event_stream([db.user_topic(email)],
+                        lambda: dbm.get_versions(email)[0])
+
+
+@views.route('/events/project/<project_id>')
+def project_events(project_id: str):
+    '''
+    Stream changes to a project as Server-Sent Events: files created and
+    deleted, members added, and the project being deleted.
+    '''
+    if 'email' not in session \
+            or not dbm.is_member(session['email'], project_id):
+        return jsonify(error='Forbidden'), 403
+
+    email = session['email']
+    return event_stream([db.project_topic(project_id)],
+                        lambda: dbm.get_versions(email, project_id)[1])
+
+
+@views.route('/jobs/<int:job_id>')
+def job_status(job_id: int):
+    '''
+    Get the status of a background job the user started, as JSON.
+    '''
+    if 'email' not in session:
+        return jsonify(error='Forbidden'), 403
+
+    status = dbm.jobs.status(job_id)
+    if status is None or status.pop('owner') != session['email']:
+        return jsonify(error='Not found'), 404
+    return jsonify(**status)
+
+
+def zip_response(name: str, entries) -> Response:
+    '''
+    Stream a ZIP archive of (path, size, chunks) entries as name.zip.
+    '''
+    filename = quote(f'{name}.zip')
+    return Response(stream_with_context(export.stream_zip(entries)),
+                    mimetype='application/zip',
+                    headers={'Content-Disposition':
+                             f"attachment; filename*=UTF-8''{filename}",
+                             'X-Accel-Buffering': 'no'})
+
+
+@views.route('/export/project/<project_id>')
+def export_project(project_id: str):
+    '''
+    Download every file in a project as a ZIP archive.
+
+    On failure, flashes error and redirects to projects page.
+    '''
+    if 'email' not in session:
+        flash('You need to be logged in to do that!', 'warning')
+        return redirect(url_for('.home'))
+    email = session['email']
+
+    member, project_name, files = dbm.get_project_export(email, project_id)
+    if not member:
+        flash(project_name, 'warning')
+        return redirect(url_for('.projects'))
+
+    # Each file is only read once the archive reaches it
+    entries = ((export.entry_name(project_name, name), size,
+                dbm.get_live_contents(file_id))
+               for name, file_id, size in files)
+    return zip_response(project_name, entries)
+
+
+@views.route('/export/class')
+def export_class():
+    '''
+    Download every file in every project a teacher runs as a ZIP archive.
+
+    On failure, flashes error and redirects to projects page.
+    '''
+    if 'email' not in session:
+        flash('You need to be logged in to do that!', 'warning')
+        return redirect(url_for('.home'))
+    email = session['email']
+
+    teacher, error_msg, files = dbm.get_class_export(email)
+    if not teacher:
+        flash(error_msg, 'warning')
+        return redirect(url_for('.projects'))
+
+    # Projects can share a name, so folders also get the start of the id
+    entries = ((export.entry_name(f'{project_name} ({project_id[:8]})',
+                                  name), size,
+                dbm.get_live_contents(file_id))
+               for project_id, project_name, name, file_id, size in files)
+    return zip_response('class', entries)
+
+
+@views.route('/dashboard')
+def dashboard():
+    '''
+    Render the activity of every project a teacher runs.
+
+    On failure, flashes error and redirects to projects page.
+    '''
+    if 'email' not in session:
+        flash('You need to be logged in to do that!', 'warning')
+        return redirect(url_for('.home'))
+
+    teacher, error_msg, projects = dbm.get_dashboard(session['email'])
+    if not teacher:
+        flash(error_msg, 'warning')
+        return redirect(url_for('.projects'))
+
+    return render_template('dashboard.html', projects=projects)
+
+
+@views.route('/dashboard/<project_id>')
+def project_dashboard(project_id: str):
+    '''
+    Render the activity of each student in a project a teacher runs.
+
+    On failure, flashes error and redirects to the dashboard.
+    '''
+    if 'email' not in session:
+        flash('You need to be logged in to do that!', 'warning')
+        return redirect(url_for('.home'))
+
+    ok, project_name, students = dbm.get_project_stats(session['email'],
+                                                       project_id)
+    if not ok:
+        flash(project_name, 'warning')
+        return redirect(url_for('.dashboard'))
+
+    return render_template('dashboard.html', project_id=project_id,
+                           project_name=project_name, students=students)
+
+
+def file_access(file_id: str) -> str:
+    '''
+    Get the project of a file the logged in user may edit.
+
+    Returns None if not logged in, the file doesn't exist, or the user isn't
+    a member of its project.
+    '''
+    if 'email' not in session:
+        return None
+    exists, project_id = dbm.get_file_project(file_id)
+    if not exists or not dbm.is_member(session['email'], project_id):
+        return None
+    return project_id
+
+
+@views.route('/file/<file_id>')
+def file(file_id: str):
+    '''
+    Render the collaborative editor for file with given id.
+    '''
+    project_id = file_access(file_id)
+    if project_id is None:
+        flash('You don\'t have permission to do that!', 'warning')
+        return redirect(url_for('.projects'))
+
+    try:
+        rev, text = collab_hub.document(file_id).snapshot()
+    except UnicodeDecodeError:
+        flash('Only text files can be opened in the editor.', 'warning')
+        return redirect(url_for('.project', project_id=project_id))
+    except FileNotFoundError:
+        flash('This file could not be read.', 'warning')
+        return redirect(url_for('.project', project_id=project_id))
+    except collab.ServedElsewhere:
+        flash('Live editing is unavailable on this server.', 'warning')
+        return redirect(url_for('.project', project_id=project_id))
+
+    _, file_name = dbm.get_file_name(file_id)
+    return render_template('file.html', file_id=file_id, file_name=file_name,
+                           project_id=project_id, rev=rev, text=text,
+                           heartbeat=current_app.config['PRESENCE_HEARTBEAT'])
+
+
+@views.route('/history/<file_id>')
+def file_history(file_id: str):
+    '''
+    Render the versions kept of file with given id.
+    '''
+    if 'email' not in session:
+        flash('You need to be logged in to do that!', 'warning')
+        return redirect(url_for('.home'))
+
+    ok, versions = dbm.get_file_versions(session['email'], file_id)
+    if not ok:
+        flash(versions, 'warning')
+        return redirect(url_for('.projects'))
+
+    _, file_name = dbm.get_file_name(file_id)
+    return render_template('history.html', file_id=file_id,
+                           file_name=file_name, versions=versions)
+
+
+@views.route('/history/<file_id>/<int:version>')
+def file_version(file_id: str, version: int):
+    '''
+    Get a version of file with given id, as text if it is UTF-8 and as a
+    download otherwise.
+    '''
+    if 'email' not in session:
+        return jsonify(error='Forbidden'), 403
+
+    ok, contents = dbm.get_file_version(session['email'], file_id, version)
+    if not ok:
+        return jsonify(error=contents), 404
+
+    try:
+        contents.decode()
+    except UnicodeDecodeError:
+        _, file_name = dbm.get_file_name(file_id)
+        return Response(contents, mimetype='application/octet-stream',
+                        headers={'Content-Disposition': 'attachment; '
+                                 f"filename*=UTF-8''{quote(file_name)}"})
+    return Response(contents, mimetype='text/plain')
+
+
+@views.route('/history/<file_id>/<int:version>/restore', methods=['POST'])
+def restore_version(file_id: str, version: int):
+    '''
+    Make a version of file with given id its current contents. Restoring
+    is itself a new version, so it can be undone the same way.
+
+    Redirects to the file, or its history on failure.
+    '''
+    if 'email' not in session:
+        flash('You need to be logged in to do that!', 'warning')
+        return redirect(url_for('.home'))
+    email = session['email']
+
+    ok, contents = dbm.get_file_version(email, file_id, version)
+    if not ok:
+        flash(contents, 'warning')
+        return redirect(url_for('.file_history', file_id=file_id))
+
+    try:
+        # Through the live document, so open editors get it as an edit
+        # rather than later overwriting it with their own snapshot
+        collab_hub.replace(file_id, contents.decode(), email)
+    except (UnicodeDecodeError, ValueError):
+        # Binary or too long to edit live, so never open in an editor
+        dbm.write_file(email, file_id, contents)
+        collab_hub.forget(file_id)
+    except FileNotFoundError:
+        flash('This file could not be read.', 'warning')
+        return redirect(url_for('.file_history', file_id=file_id))
+    except collab.ServedElsewhere:
+        flash('Live editing is unavailable on this server.', 'warning')
+        return redirect(url_for('.file_history', file_id=file_id))
+
+    flash(f'Restored version {version}.', 'success')
+    return redirect(url_for('.file', file_id=file_id))
+
+
+@views.route('/presence/<file_id>', methods=['POST'])
+def presence_heartbeat(file_id: str):
+    '''
+    Heartbeat from the user on a file. Takes {state}, one of viewing,
+    editing or left, and returns who is on the file as
+    {ttl, here: [{email, state}, ...]}.
+    '''
+    project_id = file_access(file_id)
+    if project_id is None:
+        return jsonify(error='Forbidden'), 403
+
+    # sendBeacon can't set a JSON content type
+    state = (request.get_json(force=True, silent=True) or {}).get('state')
+    if state == 'left':
+        presence_registry.leave(file_id, session['email'])
+    elif state in presence.STATES:
+        presence_registry.heartbeat(project_id, file_id, session['email'],
+                                    state)
+    else:
+        return jsonify(error='state must be viewing, editing or left.'), 400
+
+    return jsonify(ttl=current_app.config['PRESENCE_TTL'],
+                   here=[{'email': email, 'state': state} for email, state
+                         in presence_registry.file(file_id)])
+
+
+@views.route('/presence/project/<project_id>')
+def project_presence(project_id: str):
+    '''
+    Get who is on each file of a project as
+    {files: {file_id: [{email, state}, ...], ...}}.
+    '''
+    if 'email' not in session \
+            or not dbm.is_member(session['email'], project_id):
+        return jsonify(error='Forbidden'), 403
+
+    return jsonify(files={
+        file_id: [{'email': email, 'state': state} for email, state in here]
+        for file_id, here in presence_registry.project(project_id).items()})
+
+
+@views.route('/collab/<file_id>', methods=['GET', 'POST'])
+def collab_document(file_id: str):
+    '''
+    Get the live document, or submit an edit to it.
+
+    GET returns {rev, text}. POST takes {rev, client, ops} and returns the
+    edit as applied, {rev, ops}, or 409 if the client must reload.
+    '''
+    if file_access(file_id) is None:
+        return jsonify(error='Forbidden'), 403
+
+    try:
+        if request.method == 'GET':
+            rev, text = collab_hub.document(file_id).snapshot()
+            return jsonify(rev=rev, text=text)
+
+        body = request.get_json(silent=True) or {}
+        if type(body.get('rev')) is not int \
+                or not isinstance(body.get('client'), str):
+            raise ValueError('rev and client are required.')
+        ops = collab.validate(body.get('ops'))
+        rev, ops = collab_hub.submit(file_id, body['rev'], body['client'],
+                                     ops, session['email'])
+        return jsonify(rev=rev, ops=ops)
+    except collab.ResyncRequired as e:
+        return jsonify(error=str(e)), 409
+    except UnicodeDecodeError:
+        return jsonify(error='Only text files can be edited.'), 415
+    except FileNotFoundError:
+        return jsonify(error='This file could not be read.'), 500
+    except collab.ServedElsewhere as e:
+        return jsonify(error=str(e)), 503
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+
+@views.route('/collab/<file_id>/events')
+def collab_events(file_id: str):
+    '''
+    Stream edits to the document as Server-Sent Events.
+
+    Starts after the Last-Event-ID header, or the rev query parameter. Sends
+    a resync event and ends if the client has to reload, and otherwise ends
+    after EVENT_STREAM_SECONDS for the client to reconnect.
+    '''
+    if file_access(file_id) is None:
+        return jsonify(error='Forbidden'), 403
+
+    rev = request.headers.get('Last-Event-ID', request.args.get('rev', ''))
+    if not rev.isdigit():
+        return jsonify(error='rev is required.'), 400
+
+    try:
+        doc = collab_hub.document(file_id)
+    except UnicodeDecodeError:
+        return jsonify(error='Only text files can be edited.'), 415
+    except FileNotFoundError:
+        return jsonify(error='This file could not be read.'), 500
+    except collab.ServedElsewhere as e:
+        return jsonify(error=str(e)), 503
+
+    try:
+        collab_hub.open_stream()
+    except collab.HubFull:
+        return (jsonify(error='Too many open feeds, try again soon.'), 503,
+                {'Retry-After': '30'})
+
+    keepalive = current_app.config['EVENT_KEEPALIVE_SECONDS']
+    end = time.monotonic() + current_app.config['EVENT_STREAM_SECONDS']
+
+    def events(rev):
+        try:
+            while time.monotonic() < end:
+                try:
+                    entries = doc.changes_since(rev, timeout=keepalive)
+                except collab.ResyncRequired:
+                    yield 'event: resync\ndata: {}\n\n'
+                    return
+
+                if not entries:
+                    yield ': keepalive\n\n'
+                for rev, client, ops in entries:
+                    data = json.dumps({'rev': rev, 'client': client,
+                                       'ops': ops})
+                    yield f'id: {rev}\ndata: {data}\n\n'
+        finally:
+            collab_hub.close_stream()
+
+    return Response(stream_with_context(events(int(rev))),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
 
 
 if __name__ == '__main__':
+    app = create_app()
     if len(sys.argv) == 1:
         app.run()
     else:
+        dbm = get_services(app).dbm
         if sys.argv[1] == 'create_db':
             dbm.create_db()
+        elif sys.argv[1] == 'migrate':
+            if not dbm.migrate():
+                print('Database is up to date.')
+        elif sys.argv[1] == 'register_users':
+            # register_users <accounts.csv> <credentials.csv>
+            with open(sys.argv[2], newline='') as f:
+                accounts = helpers.parse_accounts(f)
+            start = time.perf_counter()
+            statuses = dbm.register_users(accounts)
+            elapsed = time.perf_counter() - start
+            with open(sys.argv[3], 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(('email', 'password', 'status'))
+                for (email, password, *_), status in zip(accounts, statuses):
+                    writer.writerow((email, password if status == 'registered'
+                                     else '', status))
+            registered = statuses.count('registered')
+            print(f'Registered {registered} of {len(accounts)} users in '
+                  f'{elapsed:.1f}s ({registered / elapsed:,.1f} users/s).')
+            print(f'Passwords written to {sys.argv[3]}.')
+        elif sys.argv[1] == 'run_jobs':
+            # Run every job that's due, e.g. while no server is running
+            print(f'Ran {dbm.jobs.run_all()} jobs.')
+        elif sys.argv[1] == 'reindex':
+            print(f'Indexed {dbm.rebuild_search_index()} files.')
+        elif sys.argv[1] == 'rebuild_stats':
+            # Repair the dashboard's counters should they drift
+            print(f'Repaired {dbm.rebuild_stats()} counters.')
+        elif sys.argv[1] == 'prune_history':
+            # Apply the retention policy to files not written since it changed
+            print(f'Pruned {dbm.prune_history()} versions.')
         elif sys.argv[1] == 'test_suite':
             dbm.create_db()
             dbm.register_user('jchirinos3201@gmail.com', 'password', 'Joan',
@@ -0,0 +1,8 @@
+"""
+PeerColab
+
+Benchmarks for the PeerColab Flask App. Run from the app directory, e.g.
+`python -m bench.connections`
+
+Copyright Joan Chirinos, 2021.
+"""
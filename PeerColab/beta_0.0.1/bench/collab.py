@@ -0,0 +1,196 @@
+"""
+PeerColab
+
+Headless harness for the collaborative editing engine
+
+Checks that concurrent edit streams converge and measures how many edits a
+document accepts per second. Exits non-zero if any check fails.
+
+Usage: python -m bench.collab [editors] [edits per editor]
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from typing import List, Tuple
+import random
+import string
+import sys
+import threading
+import time
+
+from util import collab
+
+
+def random_edit(rng: random.Random, text: str) -> List[collab.Op]:
+    """
+    Make a small random edit against a document.
+
+    Parameters
+    ----------
+    rng : random.Random
+        the random source.
+    text : str
+        the document.
+
+    Returns
+    -------
+    List[collab.Op]
+        one to three operations, each made against the result of the last.
+
+    """
+    ops = []
+    for _ in range(rng.randint(1, 3)):
+        if text and rng.random() < 0.4:
+            pos = rng.randrange(len(text))
+            op = {'op': 'del', 'pos': pos,
+                  'len': rng.randint(1, min(5, len(text) - pos))}
+        else:
+            op = {'op': 'ins', 'pos': rng.randint(0, len(text)),
+                  'text': ''.join(rng.choices(string.ascii_letters,
+                                              k=rng.randint(1, 5)))}
+        text = collab.apply(text, [op])
+        ops.append(op)
+    return ops
+
+
+def check_transform(trials: int, seed: int = 0) -> int:
+    """
+    Check that transformed edits commute, returning the number of failures.
+
+    For concurrent edits a and b, applying a then b' must give the same
+    document as applying b then a'.
+    """
+    rng = random.Random(seed)
+    failures = 0
+    for _ in range(trials):
+        text = ''.join(rng.choices('abcdef', k=rng.randint(0, 12)))
+        a, b = random_edit(rng, text), random_edit(rng, text)
+        a2, b2 = collab.transform(a, b, rng.random() < 0.5)
+        if collab.apply(collab.apply(text, a), b2) \
+                != collab.apply(collab.apply(text, b), a2):
+            failures += 1
+    return failures
+
+
+def sync(client: collab.Client, doc: collab.Document) -> int:
+    """
+    Send the client's pending edit, if any, and apply what it missed.
+
+    A client that fell out of the document's history reloads it, dropping
+    its unsent edits, as the editor does. Returns 1 if that happened.
+    """
+    try:
+        outgoing = client.to_send()
+        if outgoing is not None:
+            doc.submit(outgoing[0], client.client_id, outgoing[1])
+        for entry in doc.changes_since(client.rev):
+            client.receive(entry)
+        return 0
+    except collab.ResyncRequired:
+        client.__init__(client.client_id, *doc.snapshot())
+        return 1
+
+
+def converged(clients: List[collab.Client], doc: collab.Document) -> bool:
+    """Drain every client, then check they all match the document."""
+    while any(c.inflight is not None or c.buffer for c in clients):
+        for client in clients:
+            sync(client, doc)
+    for client in clients:
+        sync(client, doc)
+    return all(client.text == doc.text for client in clients)
+
+
+def replay(editors: int, edits: int, seed: int = 0) -> bool:
+    """
+    Interleave editors' edits and deliveries in a seeded random order.
+
+    Deterministic for a given seed, so a failure can be replayed. The
+    history is big enough that nobody has to reload.
+    """
+    rng = random.Random(seed)
+    doc = collab.Document('starter code\n', history_size=editors * edits)
+    clients = [collab.Client(f'c{i}', 0, doc.text) for i in range(editors)]
+    remaining = [edits] * editors
+
+    while any(remaining):
+        i = rng.randrange(editors)
+        client = clients[i]
+        if remaining[i] and rng.random() < 0.6:
+            client.edit(random_edit(rng, client.text))
+            remaining[i] -= 1
+        outgoing = client.to_send() if rng.random() < 0.5 else None
+        if outgoing is not None:
+            doc.submit(outgoing[0], client.client_id, outgoing[1])
+        if rng.random() < 0.5:
+            for entry in doc.changes_since(client.rev):
+                client.receive(entry)
+
+    return converged(clients, doc)
+
+
+def throughput(editors: int, edits: int, history_size: int,
+               seed: int = 0) -> Tuple[float, float, int]:
+    """
+    Run one thread per editor against a shared document.
+
+    Returns (edits accepted per second including every client's own work,
+    mean seconds the server spent accepting an edit, number of reloads),
+    after checking convergence and that the history stayed within its bound.
+    """
+    doc = collab.Document('starter code\n', history_size=history_size)
+    submit, spent = doc.submit, []
+
+    def timed_submit(*args):
+        start = time.perf_counter()
+        try:
+            return submit(*args)
+        finally:
+            spent.append(time.perf_counter() - start)
+
+    doc.submit = timed_submit
+    clients = [collab.Client(f'c{i}', 0, doc.text) for i in range(editors)]
+    resyncs = [0] * editors
+
+    def work(i: int, rng: random.Random) -> None:
+        for _ in range(edits):
+            clients[i].edit(random_edit(rng, clients[i].text))
+            resyncs[i] += sync(clients[i], doc)
+            if len(doc.history) > history_size:
+                raise AssertionError('History outgrew its bound.')
+
+    threads = [threading.Thread(target=work, args=(i, random.Random(seed + i)))
+               for i in range(editors)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ok = converged(clients, doc)
+    elapsed = time.perf_counter() - start
+
+    if not ok:
+        raise AssertionError('Threaded editors did not converge.')
+    return doc.rev / elapsed, sum(spent) / len(spent), sum(resyncs)
+
+
+def main(editors: int, edits: int) -> int:
+    failures = check_transform(20000)
+    print(f'transform: {failures} failures in 20000 random pairs')
+
+    seeds_ok = sum(replay(editors, edits // 4, seed) for seed in range(20))
+    print(f'replay: {seeds_ok}/20 seeded interleavings of {editors} editors '
+          'converged')
+
+    for history_size in (editors * edits, editors):
+        rate, cost, resyncs = throughput(editors, edits, history_size)
+        print(f'threads: {editors} editors, history {history_size}, '
+              f'converged with {resyncs} reloads, {rate:,.0f} edits/s '
+              f'end to end, {cost * 1e6:,.0f} us/edit on the server')
+
+    return 0 if failures == 0 and seeds_ok == 20 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 30,
+                  int(sys.argv[2]) if len(sys.argv) > 2 else 200))
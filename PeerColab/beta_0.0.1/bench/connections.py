@@ -0,0 +1,130 @@
+"""
+PeerColab
+
+Benchmark comparing a connection per query against ConnectionManager
+
+Usage: python -m bench.connections [queries]
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from typing import Callable
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+import sqlite3
+
+from util.connection import ConnectionManager
+
+SCHEMA = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                      'static', 'table_definitions.sql')
+
+
+def seed(filename: str, users: int = 500, projects: int = 200) -> None:
+    """
+    Fill a fresh database with users, projects and memberships.
+
+    Parameters
+    ----------
+    filename : str
+        the database filename.
+    users : int
+        number of users.
+    projects : int
+        number of projects.
+
+    Returns
+    -------
+    None
+
+    """
+    db = sqlite3.connect(filename)
+    with open(SCHEMA) as f:
+        for defn in f.readlines():
+            if defn.strip() != '':
+                db.execute(defn)
+    for p in range(projects):
+        db.execute('INSERT INTO projects(project_id, name) VALUES(?,?)',
+                   (f'p{p}', f'name {p}'))
+    for u in range(users):
+        db.execute('INSERT INTO members(project_id, email) VALUES(?,?)',
+                   (f'p{u % projects}', f'user{u}@example.com'))
+    db.commit()
+    db.close()
+
+
+def naive_query(filename: str, email: str, project_id: str) -> bool:
+    """Run is_member the way DBManager used to, with a fresh connection."""
+    db = sqlite3.connect(filename)
+    c = db.cursor()
+    c.execute('SELECT email FROM members WHERE email=? AND project_id=?',
+              (email, project_id))
+    member = c.fetchone()
+    db.close()
+    return member is not None
+
+
+def managed_query(manager: ConnectionManager, email: str,
+                  project_id: str) -> bool:
+    """Run is_member through ConnectionManager."""
+    with manager.cursor() as c:
+        c.execute('SELECT email FROM members WHERE email=? AND project_id=?',
+                  (email, project_id))
+        return c.fetchone() is not None
+
+
+def naive_write(filename: str, project_id: str) -> None:
+    """Insert a row the way DBManager used to."""
+    db = sqlite3.connect(filename)
+    db.execute('INSERT INTO files VALUES(?,?,?)',
+               (str(uuid.uuid4()), 'f', project_id))
+    db.commit()
+    db.close()
+
+
+def managed_write(manager: ConnectionManager, project_id: str) -> None:
+    """Insert a row through ConnectionManager."""
+    with manager.cursor() as c:
+        c.execute('INSERT INTO files VALUES(?,?,?)',
+                  (str(uuid.uuid4()), 'f', project_id))
+
+
+def rate(fn: Callable[[int], object], n: int) -> float:
+    """Return calls per second of fn over n calls."""
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return n / (time.perf_counter() - start)
+
+
+def main(n: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'bench.db')
+        seed(filename)
+        manager = ConnectionManager(filename)
+
+        def member_args(i):
+            return f'user{i % 500}@example.com', f'p{i % 200}'
+
+        # The naive runs go first, since the manager switches the file to WAL
+        results = (
+            ('read, connect per query',
+             rate(lambda i: naive_query(filename, *member_args(i)), n)),
+            ('write, connect per query',
+             rate(lambda i: naive_write(filename, f'p{i % 200}'), n // 10)),
+            ('read, ConnectionManager',
+             rate(lambda i: managed_query(manager, *member_args(i)), n)),
+            ('write, ConnectionManager',
+             rate(lambda i: managed_write(manager, f'p{i % 200}'), n // 10)),
+        )
+        manager.close()
+
+    for label, qps in results:
+        print(f'{label:<28}{qps:>12,.0f} queries/s')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
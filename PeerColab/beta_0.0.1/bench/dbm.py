@@ -0,0 +1,528 @@
+"""
+PeerColab
+
+Micro-benchmark suite timing every DBManager method at several scales
+
+Each scale is a database filled by bench.generate. Every public DBManager
+method is called with arguments drawn from it over several rounds, and the
+median and 95th percentile of each method's best round are reported.
+Methods that change the database set up what they need (a project to
+delete, an upload to finish) before the clock starts.
+
+The authorization cache is turned off, so is_teacher, is_admin and
+is_member are timed against the database, and passwords are hashed at a
+tiny scrypt cost, so authenticate_user and register_user time the
+queries rather than the hash.
+
+Results can be written as JSON and compared against a stored baseline.
+A method regresses when its median is more than --threshold times the
+baseline's and slower by more than --floor microseconds, which keeps noise
+in very fast methods from being flagged. Exits non-zero on regressions.
+Timings only compare on the same machine, so the stored baseline records
+where it was made; refresh it with --save-baseline after an intended change
+or on a new machine.
+
+Usage: python -m bench.dbm [--scales small,medium,large] [--out FILE]
+                           [--baseline FILE] [--save-baseline]
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from typing import Any, Callable, Dict, List
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from util.cache import TTLCache
+from util.db import DBManager
+from util.hashing import Hasher
+
+from .generate import PASSWORD, SCHEMA, Dataset, generate
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'dbm_baseline.json')
+# (users, projects, files, fan-out)
+SCALES = {'small': (200, 40, 400, 10),
+          'medium': (1000, 200, 2000, 30),
+          'large': (5000, 1000, 10000, 30)}
+CONTENTS = b'def main():\n    print("hello")\n' * 64
+
+# A case sets up one call and returns it, so only the call is timed
+Case = Callable[[DBManager, Dataset, random.Random], Callable[[], Any]]
+CASES: Dict[str, Case] = {}
+# Cases slow enough to run only a few times
+SLOW = {'rebuild_search_index': 3, 'collect_garbage': 10,
+        'prune_history': 10, 'rebuild_stats': 10}
+
+
+def case(function: Case) -> Case:
+    """Register a case under the name of the method it times."""
+    CASES[function.__name__] = function
+    return function
+
+
+def new_name(rng: random.Random, prefix: str) -> str:
+    """A name not used before."""
+    return f'{prefix}{rng.getrandbits(64):016x}'
+
+
+@case
+def register_user(dbm, data, rng):
+    return lambda: dbm.register_user(new_name(rng, 'new') + '@school.example',
+                                     PASSWORD, 'First', 'Last', 0)
+
+
+@case
+def register_users(dbm, data, rng):
+    users = [(new_name(rng, 'new') + '@school.example', PASSWORD, 'First',
+              'Last', 0) for _ in range(20)]
+    return lambda: dbm.register_users(users)
+
+
+@case
+def authenticate_user(dbm, data, rng):
+    return lambda: dbm.authenticate_user(rng.choice(data.users), PASSWORD)
+
+
+@case
+def is_teacher(dbm, data, rng):
+    return lambda: dbm.is_teacher(rng.choice(data.users))
+
+
+@case
+def is_admin(dbm, data, rng):
+    project_id, admin, _ = rng.choice(data.projects)
+    return lambda: dbm.is_admin(admin, project_id)
+
+
+@case
+def is_member(dbm, data, rng):
+    project_id, _, members = rng.choice(data.projects)
+    return lambda: dbm.is_member(rng.choice(members), project_id)
+
+
+@case
+def get_versions(dbm, data, rng):
+    project_id, _, members = rng.choice(data.projects)
+    return lambda: dbm.get_versions(rng.choice(members), project_id)
+
+
+@case
+def get_projects(dbm, data, rng):
+    return lambda: dbm.get_projects(rng.choice(data.students))
+
+
+@case
+def get_project_listing(dbm, data, rng):
+    return lambda: dbm.get_project_listing(rng.choice(data.users))
+
+
+@case
+def get_project_page(dbm, data, rng):
+    project_id, _, members = rng.choice(data.projects)
+    return lambda: dbm.get_project_page(rng.choice(members), project_id)
+
+
+@case
+def get_project_name(dbm, data, rng):
+    return lambda: dbm.get_project_name(rng.choice(data.projects)[0])
+
+
+@case
+def get_project_export(dbm, data, rng):
+    project_id, admin, _ = rng.choice(data.projects)
+    return lambda: dbm.get_project_export(admin, project_id)
+
+
+@case
+def get_class_export(dbm, data, rng):
+    return lambda: dbm.get_class_export(rng.choice(data.teachers))
+
+
+@case
+def get_dashboard(dbm, data, rng):
+    return lambda: dbm.get_dashboard(rng.choice(data.teachers))
+
+
+@case
+def get_project_stats(dbm, data, rng):
+    project_id, admin, _ = rng.choice(data.projects)
+    return lambda: dbm.get_project_stats(admin, project_id)
+
+
+@case
+def get_files(dbm, data, rng):
+    project_id, admin, _ = rng.choice(data.projects)
+    return lambda: dbm.get_files(admin, project_id)
+
+
+@case
+def get_file_project(dbm, data, rng):
+    return lambda: dbm.get_file_project(rng.choice(data.files)[0])
+
+
+@case
+def get_file_name(dbm, data, rng):
+    return lambda: dbm.get_file_name(rng.choice(data.files)[0])
+
+
+@case
+def read_file(dbm, data, rng):
+    file_id, project_id, _ = rng.choice(data.files)
+    _, admin, _ = project(data, project_id)
+    return lambda: dbm.read_file(admin, file_id)
+
+
+@case
+def get_file_contents(dbm, data, rng):
+    return lambda: dbm.get_file_contents(rng.choice(data.files)[0])
+
+
+@case
+def get_live_contents(dbm, data, rng):
+    return lambda: dbm.get_live_contents(rng.choice(data.files)[0])
+
+
+@case
+def load_file(dbm, data, rng):
+    return lambda: dbm.load_file(rng.choice(data.files)[0])
+
+
+@case
+def log_edit(dbm, data, rng):
+    file_id = rng.choice(data.files)[0]
+    rev, _ = dbm.load_file(file_id)
+    return lambda: dbm.log_edit(file_id, rev + 1,
+                                [{'op': 'ins', 'pos': 0, 'text': '#'}])
+
+
+@case
+def save_snapshot(dbm, data, rng):
+    file_id = rng.choice(data.files)[0]
+    rev, text = dbm.load_file(file_id)
+    return lambda: dbm.save_snapshot(file_id, rev + 1, text + '\n')
+
+
+@case
+def get_file_versions(dbm, data, rng):
+    file_id, project_id, _ = rng.choice(data.files)
+    _, admin, _ = project(data, project_id)
+    return lambda: dbm.get_file_versions(admin, file_id)
+
+
+@case
+def get_file_version(dbm, data, rng):
+    file_id, project_id, _ = rng.choice(data.files)
+    _, admin, _ = project(data, project_id)
+    _, versions = dbm.get_file_versions(admin, file_id)
+    return lambda: dbm.get_file_version(admin, file_id, versions[0][0])
+
+
+@case
+def prune_history(dbm, data, rng):
+    return lambda: dbm.prune_history()
+
+
+@case
+def search(dbm, data, rng):
+    return lambda: dbm.search(rng.choice(data.students), 'student print')
+
+
+@case
+def create_project(dbm, data, rng):
+    return lambda: dbm.create_project(rng.choice(data.teachers),
+                                      new_name(rng, 'Project '))
+
+
+@case
+def add_member(dbm, data, rng):
+    project_id = rng.choice(data.projects)[0]
+    return lambda: dbm.add_member(rng.choice(data.students), project_id)
+
+
+@case
+def add_members(dbm, data, rng):
+    project_id, admin, _ = rng.choice(data.projects)
+    emails = rng.sample(data.students, 30)
+    return lambda: dbm.add_members(admin, project_id, emails)
+
+
+@case
+def delete_project(dbm, data, rng):
+    teacher = rng.choice(data.teachers)
+    project_id = dbm.create_project(teacher, new_name(rng, 'Doomed '))
+    for i in range(5):
+        dbm.create_file(teacher, project_id, f'file{i}.py', CONTENTS)
+    return lambda: dbm.delete_project(teacher, project_id)
+
+
+@case
+def forget_project(dbm, data, rng):
+    return lambda: dbm.forget_project(rng.choice(data.projects)[0])
+
+
+@case
+def create_file(dbm, data, rng):
+    project_id, admin, _ = rng.choice(data.projects)
+    return lambda: dbm.create_file(admin, project_id,
+                                   new_name(rng, 'new') + '.py', CONTENTS)
+
+
+@case
+def write_file(dbm, data, rng):
+    file_id, project_id, _ = rng.choice(data.files)
+    _, admin, _ = project(data, project_id)
+    contents = CONTENTS + new_name(rng, '# ').encode()
+    return lambda: dbm.write_file(admin, file_id, contents)
+
+
+@case
+def save_file_contents(dbm, data, rng):
+    file_id = rng.choice(data.files)[0]
+    contents = CONTENTS + new_name(rng, '# ').encode()
+    return lambda: dbm.save_file_contents(file_id, contents)
+
+
+@case
+def delete_file(dbm, data, rng):
+    project_id, admin, _ = rng.choice(data.projects)
+    name = new_name(rng, 'doomed') + '.py'
+    dbm.create_file(admin, project_id, name, CONTENTS)
+    with dbm.connections.cursor() as c:
+        c.execute('SELECT file_id FROM files WHERE project_id=? AND name=?',
+                  (project_id, name))
+
+        file_id = c.fetchone()[0]
+    return lambda: dbm.delete_file(admin, file_id)
+
+
+@case
+def start_upload(dbm, data, rng):
+    project_id, admin, _ = rng.choice(data.projects)
+    return lambda: dbm.start_upload(admin, project_id,
+                                    new_name(rng, 'up') + '.bin',
+                                    len(CONTENTS), 2 ** 40)
+
+
+def started_upload(dbm, data, rng):
+    """Start an upload of CONTENTS, returning (admin, upload_id)."""
+    project_id, admin, _ = rng.choice(data.projects)
+    _, upload_id = dbm.start_upload(admin, project_id,
+                                    new_name(rng, 'up') + '.bin',
+                                    len(CONTENTS), 2 ** 40)
+    return admin, upload_id
+
+
+@case
+def get_upload(dbm, data, rng):
+    admin, upload_id = started_upload(dbm, data, rng)
+    return lambda: dbm.get_upload(admin, upload_id)
+
+
+@case
+def write_upload_chunk(dbm, data, rng):
+    admin, upload_id = started_upload(dbm, data, rng)
+    return lambda: dbm.write_upload_chunk(admin, upload_id, 0,
+                                          io.BytesIO(CONTENTS),
+                                          len(CONTENTS))
+
+
+@case
+def finish_upload(dbm, data, rng):
+    admin, upload_id = started_upload(dbm, data, rng)
+    dbm.write_upload_chunk(admin, upload_id, 0, io.BytesIO(CONTENTS),
+                           len(CONTENTS))
+    return lambda: dbm.finish_upload(admin, upload_id)
+
+
+@case
+def expire_uploads(dbm, data, rng):
+    return lambda: dbm.expire_uploads(24 * 60 * 60)
+
+
+@case
+def collect_garbage(dbm, data, rng):
+    return lambda: dbm.collect_garbage()
+
+
+@case
+def rebuild_stats(dbm, data, rng):
+    return lambda: dbm.rebuild_stats()
+
+
+@case
+def rebuild_search_index(dbm, data, rng):
+    return lambda: dbm.rebuild_search_index()
+
+
+@case
+def migrate(dbm, data, rng):
+    return lambda: dbm.migrate()
+
+
+def project(data: Dataset, project_id: str):
+    """Find a project in data by id."""
+    return next(x for x in data.projects if x[0] == project_id)
+
+
+def time_case(dbm: DBManager, data: Dataset, name: str, runs: int,
+              rng: random.Random) -> List[float]:
+    """Time runs calls of one case, returning the sorted seconds."""
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(min(runs, SLOW.get(name, runs))):
+            call = CASES[name](dbm, data, rng)
+            start = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - start)
+    return sorted(timings)
+
+
+def run_scale(scale: str, runs: int, rounds: int
+              ) -> Dict[str, Dict[str, float]]:
+    """Generate a database at a scale and time every case against it."""
+    users, projects, files, fanout = SCALES[scale]
+    with tempfile.TemporaryDirectory() as directory:
+        dbm = DBManager(os.path.join(directory, 'bench.db'), SCHEMA,
+                        hasher=Hasher(2 ** 4, 1, 1),
+                        auth_cache=TTLCache(0, 0))
+        with contextlib.redirect_stdout(io.StringIO()):
+            dbm.create_db()
+
+        start = time.perf_counter()
+        data = generate(dbm, users, projects, files, fanout)
+        print(f'{scale}: {users:,} users, {projects:,} projects, '
+              f'{files:,} files, fan-out {fanout}, generated in '
+              f'{time.perf_counter() - start:.1f}s')
+
+        # Every case is timed once per round, and the round with the lowest
+        # median kept, so a burst of disk or CPU contention partway through
+        # doesn't land on whichever case happened to be running
+        rngs = {name: random.Random(name) for name in CASES}
+        best = {}
+        for _ in range(rounds):
+            for name in CASES:
+                timings = time_case(dbm, data, name, runs, rngs[name])
+                if (name not in best or statistics.median(timings)
+                        < statistics.median(best[name])):
+                    best[name] = timings
+
+        results = {}
+        for name, timings in best.items():
+            results[name] = {
+                'median_us': round(statistics.median(timings) * 1e6, 1),
+                'p95_us': round(timings[int(len(timings) * 0.95)] * 1e6, 1),
+                'runs': len(timings)}
+            print(f'  {name:22} median {results[name]["median_us"]:10,.1f} '
+                  f'us  p95 {results[name]["p95_us"]:10,.1f} us')
+
+    return results
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any],
+            threshold: float, floor: float) -> List[str]:
+    """
+    Find methods slower than in the baseline.
+
+    Parameters
+    ----------
+    results : Dict[str, Any]
+        results of this run.
+    baseline : Dict[str, Any]
+        results of an earlier run.
+    threshold : float
+        ratio of medians past which a method has regressed.
+    floor : float
+        microseconds a method must also have slowed by.
+
+    Returns
+    -------
+    List[str]
+        a line describing each regression.
+
+    """
+    regressions = []
+    for scale, methods in results['results'].items():
+        for name, now in methods.items():
+            then = baseline['results'].get(scale, {}).get(name)
+            if then is None:
+                continue
+            if (now['median_us'] > then['median_us'] * threshold
+                    and now['median_us'] - then['median_us'] > floor):
+                regressions.append(
+                    f'{scale}/{name}: median {then["median_us"]:,.1f} us -> '
+                    f'{now["median_us"]:,.1f} us '
+                    f'({now["median_us"] / then["median_us"]:.1f}x)')
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description='Time every DBManager method at several scales.')
+    parser.add_argument('--scales', default=','.join(SCALES),
+                        help='comma separated scales to run')
+    parser.add_argument('--runs', type=int, default=30,
+                        help='calls timed per method in each round')
+    parser.add_argument('--rounds', type=int, default=3,
+                        help='rounds over every method, the best kept')
+    parser.add_argument('--out', help='file to write JSON results to')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='JSON results to compare against')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store these results as the baseline')
+    parser.add_argument('--threshold', type=float, default=2,
+                        help='slowdown ratio counted as a regression')
+    parser.add_argument('--floor', type=float, default=250,
+                        help='microseconds of slowdown always ignored')
+    args = parser.parse_args()
+
+    scales = args.scales.split(',')
+    unknown = set(scales) - set(SCALES)
+    if unknown:
+        parser.error(f'unknown scales: {", ".join(sorted(unknown))}')
+
+    results = {'meta': {'python': platform.python_version(),
+                        'sqlite': sqlite3.sqlite_version,
+                        'machine': platform.machine(),
+                        'cpus': os.cpu_count(),
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+               'scales': {scale: dict(zip(('users', 'projects', 'files',
+                                           'fanout'), SCALES[scale]))
+                          for scale in scales},
+               'results': {scale: run_scale(scale, args.runs, args.rounds)
+                           for scale in scales}}
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Saved baseline to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline} to compare against.')
+        return 0
+
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.threshold,
+                              args.floor)
+    for line in regressions:
+        print(f'REGRESSION {line}')
+    if not regressions:
+        print(f'No regressions against {args.baseline}')
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+PeerColab
+
+Crash-recovery checks and write volume of the live edit log
+
+Simulates crashes at each step of logging and snapshotting a file, then
+checks that reloading gives back every acknowledged edit. Also compares the
+bytes written per edit against saving the whole file every few edits.
+Exits non-zero if any check fails.
+
+Usage: python -m bench.editlog [edits]
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from typing import List, Tuple
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+
+from util import collab
+from util.db import DBManager
+from util.editlog import EditLog
+
+from .collab import random_edit
+
+SCHEMA = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                      'static', 'table_definitions.sql')
+
+
+def open_db(directory: str, snapshot_ops: int = 50) -> DBManager:
+    """Open (creating on first use) a database in directory, as a restart."""
+    filename = os.path.join(directory, 'bench.db')
+    fresh = not os.path.exists(filename)
+    dbm = DBManager(filename, SCHEMA,
+                    edit_log=EditLog(os.path.join(directory, 'editlog'),
+                                     snapshot_ops, fsync=False,
+                                     compact_seconds=3600))
+    if fresh:
+        with contextlib.redirect_stdout(io.StringIO()):
+            dbm.create_db()
+    return dbm
+
+
+def new_file(dbm: DBManager, text: str) -> str:
+    """Create a file holding text, returning its id."""
+    project_id = dbm.create_project('bench@example.com', 'bench')
+    dbm.create_file('bench@example.com', project_id, 'a.py', text.encode())
+    return dbm.get_project_page('bench@example.com', project_id)[2][0][1]
+
+
+def edit(hub: collab.CollabHub, file_id: str, edits: int,
+         rng: random.Random) -> List[Tuple[int, str]]:
+    """Make edits through hub, returning (revision, text) after each."""
+    states = []
+    for _ in range(edits):
+        rev, text = hub.document(file_id).snapshot()
+        hub.submit(file_id, rev, 'bench', random_edit(rng, text))
+        states.append(hub.document(file_id).snapshot())
+    return states
+
+
+def hub_for(dbm: DBManager) -> collab.CollabHub:
+    """Make a hub persisting through dbm."""
+    return collab.CollabHub(dbm.load_file, dbm.log_edit, dbm.save_snapshot)
+
+
+def check(name: str, expected: Tuple[int, str], got: Tuple[int, str]) -> bool:
+    """Print and return whether a reload gave back the expected state."""
+    ok = expected == got
+    print(f'{name}: {"ok" if ok else "FAILED"} (expected revision '
+          f'{expected[0]}, reloaded revision {got[0]})')
+    return ok
+
+
+def last_segment(dbm: DBManager, file_id: str) -> str:
+    """Get the path of a file's newest log segment."""
+    return dbm.edit_log._segments(file_id)[-1][1]
+
+
+def recovery(edits: int) -> bool:
+    """Run each crash scenario against a fresh database."""
+    rng = random.Random(0)
+    results = []
+
+    # Crash with no snapshot since the file was created: the log alone
+    # must rebuild the text
+    with tempfile.TemporaryDirectory() as directory:
+        dbm = open_db(directory, snapshot_ops=edits * 2)
+        file_id = new_file(dbm, 'starter code\n')
+        states = edit(hub_for(dbm), file_id, edits, rng)
+        results.append(check('no snapshot', states[-1],
+                             open_db(directory).load_file(file_id)))
+
+    # Crash part way through appending the last edit: it was never
+    # acknowledged, so the edit before it is what comes back
+    with tempfile.TemporaryDirectory() as directory:
+        dbm = open_db(directory)
+        file_id = new_file(dbm, 'starter code\n')
+        states = edit(hub_for(dbm), file_id, edits, rng)
+        path = last_segment(dbm, file_id)
+        os.truncate(path, os.path.getsize(path) - 3)
+        dbm = open_db(directory)
+        results.append(check('torn append', states[-2],
+                             dbm.load_file(file_id)))
+
+        # ...and editing carries on cleanly after the cut
+        more = edit(hub_for(dbm), file_id, 5, rng)
+        results.append(check('append after torn tail', more[-1],
+                             open_db(directory).load_file(file_id)))
+
+    # Garbage after the last record, e.g. a sector that was never written
+    with tempfile.TemporaryDirectory() as directory:
+        dbm = open_db(directory)
+        file_id = new_file(dbm, 'starter code\n')
+        states = edit(hub_for(dbm), file_id, edits, rng)
+        with open(last_segment(dbm, file_id), 'ab') as f:
+            f.write(os.urandom(64))
+        results.append(check('corrupt tail', states[-1],
+                             open_db(directory).load_file(file_id)))
+
+    # Crash after a snapshot committed but before the log learned of it:
+    # the covered records are still there and must be skipped
+    with tempfile.TemporaryDirectory() as directory:
+        dbm = open_db(directory)
+        file_id = new_file(dbm, 'starter code\n')
+        dbm.edit_log.snapshotted = lambda file_id, rev: None
+        states = edit(hub_for(dbm), file_id, edits, rng)
+        results.append(check('snapshot without compaction', states[-1],
+                             open_db(directory).load_file(file_id)))
+
+    # Crash while storing a snapshot, before its transaction committed: the
+    # previous snapshot and the whole log are used
+    with tempfile.TemporaryDirectory() as directory:
+        dbm = open_db(directory)
+        file_id = new_file(dbm, 'starter code\n')
+        dbm.save_snapshot = lambda file_id, rev, text, editors: \
+            dbm.blobs.put_all(text.encode())
+        states = edit(hub_for(dbm), file_id, edits, rng)
+        results.append(check('torn snapshot', states[-1],
+                             open_db(directory).load_file(file_id)))
+
+    # Compaction only deletes what a snapshot covers
+    with tempfile.TemporaryDirectory() as directory:
+        dbm = open_db(directory)
+        file_id = new_file(dbm, 'starter code\n')
+        states = edit(hub_for(dbm), file_id, edits, rng)
+        before = len(dbm.edit_log._segments(file_id))
+        dbm.edit_log.compact()
+        after = len(dbm.edit_log._segments(file_id))
+        print(f'compaction: {before} segments down to {after}')
+        results.append(after <= 1)
+        results.append(check('after compaction', states[-1],
+                             open_db(directory).load_file(file_id)))
+
+    return all(results)
+
+
+def volume(edits: int, size: int = 20000, save_every: int = 50) -> None:
+    """Compare bytes written by the log against frequent full saves."""
+    rng = random.Random(1)
+    text = ''.join(rng.choices('abcdefghij \n', k=size))
+
+    with tempfile.TemporaryDirectory() as directory:
+        dbm = open_db(directory, snapshot_ops=500)
+        file_id = new_file(dbm, text)
+        states = edit(hub_for(dbm), file_id, edits, rng)
+
+        # Nothing is compacted during the run, so every record is on disk
+        logged = sum(os.path.getsize(path)
+                     for _, path in dbm.edit_log._segments(file_id))
+        final = len(states[-1][1].encode())
+        log_bytes = logged + (edits // 500) * final
+        full_bytes = (edits // save_every) * final
+
+    print(f'volume: {edits} edits to a {size:,} byte file wrote '
+          f'{log_bytes / edits:,.0f} bytes/edit with the log, '
+          f'{full_bytes / edits:,.0f} bytes/edit saving every '
+          f'{save_every} edits')
+
+
+def main(edits: int) -> int:
+    ok = recovery(edits)
+    volume(edits * 10)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 120))
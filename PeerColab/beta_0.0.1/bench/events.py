@@ -0,0 +1,84 @@
+"""
+PeerColab
+
+Benchmark for the change feed hub
+
+Subscribes thousands of idle feeds spread over projects, as a school's
+open tabs would be, then times publishing to one project and to one busy
+project every feed is on. One subscriber on the busy project never reads;
+it must be dropped once its queue fills while publishing stays as fast.
+Also reports the memory each idle subscription takes. Exits non-zero if
+the slow subscriber isn't dropped or anyone else is.
+
+Usage: python -m bench.events [subscribers]
+
+Copyright Joan Chirinos, 2021.
+"""
+
+import statistics
+import sys
+import time
+import tracemalloc
+
+from util.pubsub import Dropped, PubSub
+
+PROJECTS = 500
+QUEUE = 256
+
+
+def time_publish(hub: PubSub, topic: str, count: int) -> float:
+    """Median seconds to publish one event to topic."""
+    timings = []
+    for i in range(count):
+        start = time.perf_counter()
+        hub.publish(topic, {'type': 'file_created', 'file_id': str(i),
+                            'name': f'file{i}.py'})
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main(subscribers: int) -> int:
+    hub = PubSub(queue_size=QUEUE, max_subscribers=subscribers + 2)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    feeds = [hub.subscribe([f'project:{i % PROJECTS}', 'project:busy'])
+             for i in range(subscribers)]
+    per_feed = (tracemalloc.get_traced_memory()[0] - before) / subscribers
+    tracemalloc.stop()
+    slow = hub.subscribe(['project:busy'])
+
+    quiet = time_publish(hub, 'project:1', 200)
+    for feed in feeds:
+        feed.get(0)
+    print(f'{subscribers:,} idle feeds, {per_feed:,.0f} bytes each. '
+          f'Publishing to a project with {subscribers // PROJECTS} feeds: '
+          f'{quiet * 1e6:,.1f} us')
+
+    ok = True
+    for round in range(3):
+        busy = time_publish(hub, 'project:busy', QUEUE // 2)
+        # Everyone but the slow feed keeps up
+        for feed in feeds:
+            try:
+                feed.get(0)
+            except Dropped:
+                ok = False
+        print(f'Publishing to all {subscribers + 1:,} feeds, round '
+              f'{round + 1}: {busy * 1000:,.2f} ms each, '
+              f'{hub.stats()["dropped"]} dropped')
+
+    try:
+        slow.get(0)
+        print('The slow feed was not dropped.')
+        ok = False
+    except Dropped:
+        pass
+
+    for feed in feeds:
+        feed.close()
+    return 0 if ok and hub.stats()['subscribers'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
@@ -0,0 +1,72 @@
+"""
+PeerColab
+
+Benchmark for streaming a project out as a ZIP archive
+
+Reports the time to the first byte, throughput, and the most memory Python
+held while streaming, which should stay near one chunk however big the
+project is.
+
+Usage: python -m bench.export [files] [MiB per file]
+
+Copyright Joan Chirinos, 2021.
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from util import export
+from util.db import DBManager
+
+SCHEMA = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                      'static', 'table_definitions.sql')
+EMAIL = 'student@example.com'
+
+
+def main(files: int, mib: int) -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        dbm = DBManager(os.path.join(directory, 'bench.db'), SCHEMA)
+        with contextlib.redirect_stdout(io.StringIO()):
+            dbm.create_db()
+
+        project_id = dbm.create_project(EMAIL, 'bench')
+        # Half random, half repetitive, like a mix of data and source files
+        half = mib * 2 ** 19
+        for i in range(files):
+            contents = os.urandom(half) + b'x = 1\n' * (half // 6)
+            dbm.create_file(EMAIL, project_id, f'file{i}.dat', contents)
+        del contents
+
+        _, name, listing = dbm.get_project_export(EMAIL, project_id)
+        entries = ((export.entry_name(name, file_name), size,
+                    dbm.get_live_contents(file_id))
+                   for file_name, file_id, size in listing)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        first, total = None, 0
+        for piece in export.stream_zip(entries):
+            if first is None:
+                first = time.perf_counter() - start
+            total += len(piece)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    print(f'{files} files of {mib} MiB: first byte after '
+          f'{first * 1000:.1f} ms, '
+          f'{total / 2 ** 20:,.1f} MiB archive at '
+          f'{files * mib / elapsed:,.1f} MiB/s, peak {peak / 2 ** 20:.2f} MiB '
+          'held by Python')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 4,
+                  int(sys.argv[2]) if len(sys.argv) > 2 else 16))
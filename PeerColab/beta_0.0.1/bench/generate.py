@@ -0,0 +1,189 @@
+"""
+PeerColab
+
+Deterministic generator of school-sized data for benchmarks
+
+Makes N users, one in every TEACHER_EVERY of them a teacher, M projects each
+administered by a teacher with a fan-out of student members, and K small
+files spread over the projects. The same arguments and seed always make the
+same emails, project ids, memberships and contents.
+
+Every user has the password PASSWORD. It is hashed once and the hash shared,
+so generating thousands of users doesn't take thousands of scrypt hashes.
+
+Run on its own to seed a database for trying the app at scale:
+
+Usage: python -m bench.generate <database> [users] [projects] [files]
+                                [fan-out] [seed]
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from typing import List, Tuple
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+import uuid
+
+from util.db import DBManager
+from util.hashing import format_params
+
+SCHEMA = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                      'static', 'table_definitions.sql')
+PASSWORD = 'correct horse battery staple'
+TEACHER_EVERY = 25
+WORDS = ('def', 'return', 'import', 'class', 'self', 'for', 'in', 'if',
+         'else', 'print', 'list', 'value', 'count', 'total', 'student')
+
+
+class Dataset:
+
+    def __init__(self, teachers: List[str], students: List[str],
+                 projects: List[Tuple[str, str, List[str]]],
+                 files: List[Tuple[str, str, str]]) -> None:
+        """
+        Initialize Dataset class, a record of what generate made.
+
+        Parameters
+        ----------
+        teachers : List[str]
+            teacher emails.
+        students : List[str]
+            student emails.
+        projects : List[Tuple[str, str, List[str]]]
+            [(project_id, admin email, [member email, ...]), ...], the admin
+            being a member too.
+        files : List[Tuple[str, str, str]]
+            [(file_id, project_id, name), ...]
+
+        Returns
+        -------
+        None
+
+        """
+        self.teachers = teachers
+        self.students = students
+        self.projects = projects
+        self.files = files
+
+    @property
+    def users(self) -> List[str]:
+        """Every email, teachers first."""
+        return self.teachers + self.students
+
+
+def make_uuid(rng: random.Random) -> str:
+    """A random UUID drawn from rng, so it's the same every run."""
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def generate(dbm: DBManager, users: int, projects: int, files: int,
+             fanout: int, seed: int = 0) -> Dataset:
+    """
+    Fill an empty database.
+
+    Users and projects are written directly, in bulk. Files go through
+    DBManager.create_file, so their contents, chunks and search index are
+    stored as the app would store them.
+
+    Parameters
+    ----------
+    dbm : DBManager
+        the database, already created.
+    users : int
+        number of users, at least one of them a teacher.
+    projects : int
+        number of projects.
+    files : int
+        number of files.
+    fanout : int
+        students in each project besides its admin.
+    seed : int
+        the random seed.
+
+    Returns
+    -------
+    Dataset
+        what was made.
+
+    """
+    rng = random.Random(seed)
+
+    emails = [f'user{i:06}@school.example' for i in range(users)]
+    teachers = emails[::TEACHER_EVERY]
+    students = [x for i, x in enumerate(emails) if i % TEACHER_EVERY]
+
+    salt = make_uuid(rng)
+    hash = dbm.hasher.hash(PASSWORD, salt)
+    params = format_params(dbm.hasher.params)
+
+    made = []
+    for i in range(projects):
+        admin = teachers[i % len(teachers)]
+        members = rng.sample(students, min(fanout, len(students)))
+        made.append((make_uuid(rng), admin, [admin] + members))
+
+    with dbm.connections.cursor() as c:
+        c.executemany('INSERT INTO users'
+                      '(email, hash, salt, first, last, is_teacher, '
+                      ' hash_params) '
+                      'VALUES(?,?,?,?,?,?,?)',
+                      ((email, hash, salt, 'First', f'Last{i}',
+                        int(i % TEACHER_EVERY == 0), params)
+                       for i, email in enumerate(emails)))
+        c.executemany('INSERT INTO projects(project_id, name) VALUES(?,?)',
+                      ((project_id, f'Project {i:05}')
+                       for i, (project_id, _, _) in enumerate(made)))
+        c.executemany('INSERT INTO admins VALUES(?,?)',
+                      ((project_id, admin)
+                       for project_id, admin, _ in made))
+        c.executemany('INSERT INTO members(project_id, email) VALUES(?,?)',
+                      ((project_id, email)
+                       for project_id, _, members in made
+                       for email in members))
+
+    for i in range(files):
+        project_id, admin, _ = made[rng.randrange(len(made))]
+        name = f'file{i:06}.py'
+        lines = (' '.join(rng.choices(WORDS, k=8)) for _ in range(20))
+        dbm.create_file(admin, project_id, name, '\n'.join(lines).encode())
+
+    with dbm.connections.cursor() as c:
+        c.execute('SELECT file_id, project_id, name FROM files '
+                  'ORDER BY name')
+
+        made_files = c.fetchall()
+
+    return Dataset(teachers, students, made, made_files)
+
+
+def main(filename: str, users: int, projects: int, files: int, fanout: int,
+         seed: int) -> int:
+    if os.path.exists(filename):
+        print(f'{filename} already exists.')
+        return 1
+
+    dbm = DBManager(filename, SCHEMA)
+    with contextlib.redirect_stdout(io.StringIO()):
+        dbm.create_db()
+
+    start = time.perf_counter()
+    data = generate(dbm, users, projects, files, fanout, seed)
+    print(f'{len(data.users):,} users ({len(data.teachers):,} teachers), '
+          f'{len(data.projects):,} projects, {len(data.files):,} files in '
+          f'{time.perf_counter() - start:.1f}s. Every password is '
+          f'"{PASSWORD}".')
+
+    return 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    defaults = (1000, 200, 2000, 30, 0)
+    args = [int(x) for x in sys.argv[2:]]
+    sys.exit(main(sys.argv[1], *(args + list(defaults[len(args):]))))
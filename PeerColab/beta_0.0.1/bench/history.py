@@ -0,0 +1,173 @@
+"""
+PeerColab
+
+Benchmark for file version history
+
+Writes a student's source file hundreds of times, each version changing a
+few lines, under several keyframe intervals. Reports storage amplification,
+the bytes stored for the whole history over the size of the file, next to
+what keeping every version whole would take, and how long restoring a
+version takes. Then rewrites a file of LARGE lines heavily, reporting how
+long each write and its diff take. Exits non-zero if any version doesn't
+restore exactly.
+
+Usage: python -m bench.history [versions]
+
+Copyright Joan Chirinos, 2021.
+"""
+
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from util.db import DBManager
+from util.hashing import Hasher
+from util.history import VersionHistory, diff
+
+SCHEMA = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                      'static', 'table_definitions.sql')
+STUDENT = 'student@school.example'
+INTERVALS = (1, 10, 20, 50)
+LINES = 400
+LARGE = 20000
+
+
+def edits(count: int) -> list:
+    """A file's versions, each a few lines away from the one before."""
+    rng = random.Random(0)
+    lines = [f'    total += values[{i}] * {rng.randrange(100)}\n'
+             for i in range(LINES)]
+    versions = []
+    for _ in range(count):
+        for _ in range(rng.randint(1, 5)):
+            i = rng.randrange(len(lines))
+            change = rng.random()
+            if change < 0.6:
+                lines[i] = f'    total -= values[{i}] // {rng.randrange(9)}\n'
+            elif change < 0.8 or len(lines) < LINES // 2:
+                lines.insert(i, f'    # step {rng.randrange(1000)}\n')
+            else:
+                del lines[i]
+        versions.append(''.join(lines).encode())
+    return versions
+
+
+def rewrites() -> list:
+    """A large file's versions, each rewriting much of the one before."""
+    rng = random.Random(0)
+    lines = [f'    total += values[{i}] * {rng.randrange(100)}\n'
+             for i in range(LARGE)]
+    versions = [('Whole file', lines)]
+    versions.append(('Every other line replaced',
+                     [f'    total -= values[{i}] // {rng.randrange(9)}\n'
+                      if i % 2 else line for i, line in enumerate(lines)]))
+    versions.append(('Every other line deleted', versions[-1][1][::2]))
+    versions.append(('Half deleted', versions[-1][1][:LARGE // 4]))
+    versions.append(('Half inserted', versions[-1][1] + lines[:LARGE // 4]))
+    shuffled = list(versions[-1][1])
+    rng.shuffle(shuffled)
+    versions.append(('Lines shuffled', shuffled))
+    return [(name, ''.join(x).encode()) for name, x in versions]
+
+
+def setup(path: str, history: VersionHistory) -> tuple:
+    """Make a database with one student's project and empty file."""
+    dbm = DBManager(path, SCHEMA, hasher=Hasher(2 ** 4, 1, 1),
+                    history=history)
+    with contextlib.redirect_stdout(io.StringIO()):
+        dbm.create_db()
+    dbm.register_user(STUDENT, 'password', 'Stu', 'Dent', 0)
+    project_id = dbm.create_project(STUDENT, 'Homework')
+    dbm.create_file(STUDENT, project_id, 'homework.py')
+    file_id, = dbm.get_files(STUDENT, project_id)
+    return dbm, file_id
+
+
+def run(directory: str, interval: int, versions: list) -> bool:
+    """Store versions under one keyframe interval and restore them all."""
+    dbm, file_id = setup(os.path.join(directory, f'bench{interval}.db'),
+                         VersionHistory(interval,
+                                        keep_versions=len(versions)))
+
+    start = time.perf_counter()
+    for contents in versions:
+        dbm.write_file(STUDENT, file_id, contents)
+    write = (time.perf_counter() - start) / len(versions)
+
+    with dbm.connections.cursor() as c:
+        c.execute('SELECT SUM(LENGTH(data)) FROM file_versions')
+
+        stored = c.fetchone()[0]
+
+    ok, timings = True, []
+    # Version 1 is the empty file the versions start from
+    for version, contents in enumerate(versions, 2):
+        start = time.perf_counter()
+        _, restored = dbm.get_file_version(STUDENT, file_id, version)
+        timings.append(time.perf_counter() - start)
+        ok = ok and restored == contents
+
+    timings.sort()
+    print(f'{interval:>8} {stored / len(versions[-1]):>13.2f}x '
+          f'{stored:>12,} {write * 1000:>9.2f} '
+          f'{statistics.median(timings) * 1000:>12.2f} '
+          f'{timings[-1] * 1000:>9.2f}')
+    return ok
+
+
+def run_large(directory: str) -> bool:
+    """Store heavy rewrites of a large file and restore them all."""
+    dbm, file_id = setup(os.path.join(directory, 'large.db'),
+                         VersionHistory())
+
+    ok, old = True, b''
+    for version, (name, contents) in enumerate(rewrites(), 2):
+        start = time.perf_counter()
+        delta = diff(old, contents)
+        diffing = time.perf_counter() - start
+
+        start = time.perf_counter()
+        dbm.write_file(STUDENT, file_id, contents)
+        write = time.perf_counter() - start
+
+        _, restored = dbm.get_file_version(STUDENT, file_id, version)
+        ok = ok and restored == contents
+        old = contents
+
+        print(f'{name:<26} {len(contents):>9,} {len(delta):>11,} '
+              f'{diffing * 1000:>8.1f} {write * 1000:>9.1f}')
+    return ok
+
+
+def main(count: int) -> int:
+    versions = edits(count)
+    whole = sum(len(x) for x in versions)
+    print(f'{count} versions of a {len(versions[-1]):,} byte file, '
+          f'{whole:,} bytes kept whole, '
+          f'{whole / len(versions[-1]):.0f}x its size.')
+    print('Interval Amplification Stored bytes  Write ms  '
+          'Restore p50 Worst ms')
+
+    ok = True
+    with tempfile.TemporaryDirectory() as directory:
+        for interval in INTERVALS:
+            ok = run(directory, interval, versions) and ok
+
+        print()
+        print(f'Rewrites of a {LARGE:,} line file')
+        print('Change                         Bytes Delta bytes  Diff ms  '
+              'Write ms')
+        ok = run_large(directory) and ok
+
+    if not ok:
+        print('Some versions did not restore exactly.')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
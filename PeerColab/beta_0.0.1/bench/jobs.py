@@ -0,0 +1,68 @@
+"""
+PeerColab
+
+Benchmark for deleting a large project
+
+Makes a project of a class's worth of files and deletes it, timing the
+request's part, which only tombstones the project, apart from the
+purge_project job that removes the files afterwards. The job's time is
+about what the request used to take when it deleted everything itself.
+Exits non-zero if the request's part isn't at least ten times faster.
+
+Usage: python -m bench.jobs [files]
+
+Copyright Joan Chirinos, 2021.
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+from util.db import DBManager
+from util.hashing import Hasher
+
+SCHEMA = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                      'static', 'table_definitions.sql')
+TEACHER = 'teacher@school.example'
+
+
+def main(files: int) -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        dbm = DBManager(os.path.join(directory, 'bench.db'), SCHEMA,
+                        hasher=Hasher(2 ** 4, 1, 1))
+        with contextlib.redirect_stdout(io.StringIO()):
+            dbm.create_db()
+        dbm.register_user(TEACHER, 'password', 'Teach', 'Er', 1)
+        project_id = dbm.create_project(TEACHER, 'Big class')
+        dbm.add_members(TEACHER, project_id,
+                        [f'student{i}@school.example' for i in range(30)])
+        for i in range(files):
+            dbm.create_file(TEACHER, project_id, f'student{i}.py',
+                            f'print({i})\n'.encode() * 200)
+
+        start = time.perf_counter()
+        deleted, error = dbm.delete_project(TEACHER, project_id)
+        request = time.perf_counter() - start
+        if not deleted:
+            print(error)
+            return 1
+
+        start = time.perf_counter()
+        ran = dbm.jobs.run_all()
+        purge = time.perf_counter() - start
+        left = dbm.get_files(TEACHER, project_id)
+
+    print(f'Deleting a project of {files} files: {request * 1000:.1f} ms '
+          f'in the request, {purge * 1000:.1f} ms in {ran} job.')
+    if left:
+        print(f'{len(left)} files were left behind.')
+        return 1
+
+    return 0 if request * 10 <= purge else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -0,0 +1,315 @@
+"""
+PeerColab
+
+Classroom load generator for the Flask app
+
+Seeds a temporary database with bench.generate, then has simulated users
+arrive at a given rate and each go through a journey the way a student
+does at the start of class:
+
+    register (a fraction of them) or log in at /authenticate
+    GET /projects, creating a project first if they have none
+    GET /project/<id> for one of their projects
+    create a file there, then delete it
+
+At most --concurrency journeys run at once; users arriving while all are
+busy wait their turn, as they would for a server's worker threads. Requests
+go through Flask's test client, or with --server over HTTP to a server
+started on localhost. Throughput and p50/p95/p99 latency are reported per
+route. Logins pay the app's real scrypt cost, so they dominate unless the
+hashing pool is sized for the class.
+
+Usage: python -m bench.load [--users N] [--rate R] [--concurrency C]
+                            [--register F] [--server] [--json FILE]
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import argparse
+import collections
+import contextlib
+import http.cookiejar
+import importlib.util
+import io
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from .generate import PASSWORD, generate
+
+APP = os.path.join(os.path.dirname(os.path.dirname(__file__)), '__init__.py')
+PROJECT_LINK = re.compile(r'href="/project/([^"?]+)"')
+FILE_DELETE = re.compile(r'data-delete-name="([^"]*)" '
+                         r'data-delete-href="/delete/file/([^"]+)"')
+
+
+def import_app():
+    """Import the app's module, whose directory isn't a package name."""
+    spec = importlib.util.spec_from_file_location('peercolab_app', APP)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_app(directory: str):
+    """Create the app with its database in directory, and its services."""
+    peercolab = import_app()
+    app = peercolab.create_app(overrides={
+        'DATABASE_URI': os.path.join(directory, 'load.db'),
+        'SECRET_KEY': os.urandom(16).hex()})
+    return app, peercolab.get_services(app)
+
+
+class Stats:
+
+    def __init__(self) -> None:
+        """
+        Initialize Stats class, collecting latencies from many threads.
+
+        Returns
+        -------
+        None
+
+        """
+        self.latencies = collections.defaultdict(list)
+        self.statuses = collections.defaultdict(collections.Counter)
+        self.errors = collections.Counter()
+        self.failures = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, route: str, seconds: float, status: int,
+               ok: bool) -> None:
+        """Record one request to route."""
+        with self._lock:
+            self.latencies[route].append(seconds)
+            self.statuses[route][status] += 1
+            if not ok:
+                self.errors[route] += 1
+
+    def failed(self, reason: str) -> None:
+        """Record a journey that stopped early."""
+        with self._lock:
+            self.failures[reason] += 1
+
+
+class TestClientSession:
+    """One user's session, through Flask's test client."""
+
+    def __init__(self, app) -> None:
+        self.client = app.test_client()
+
+    def request(self, method: str, path: str,
+                form: Optional[Dict[str, str]] = None
+                ) -> Tuple[int, str, str]:
+        response = self.client.open(path, method=method, data=form)
+        return (response.status_code, response.get_data(as_text=True),
+                response.headers.get('Location', ''))
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Hand redirects back, so each request is timed on its own."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPSession:
+    """One user's session, over HTTP with its own cookies."""
+
+    def __init__(self, base: str) -> None:
+        self.base = base
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirect())
+
+    def request(self, method: str, path: str,
+                form: Optional[Dict[str, str]] = None
+                ) -> Tuple[int, str, str]:
+        data = urllib.parse.urlencode(form).encode() if form else None
+        request = urllib.request.Request(self.base + path, data=data,
+                                         method=method)
+        try:
+            with self.opener.open(request) as response:
+                return (response.status, response.read().decode(),
+                        response.headers.get('Location', ''))
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode(), e.headers.get('Location', '')
+
+
+def journey(session, stats: Stats, email: str, register: bool,
+            rng: random.Random) -> None:
+    """Run one user's journey, recording every request."""
+
+    def call(route: str, method: str, path: str,
+             form: Optional[Dict[str, str]] = None,
+             redirect: Optional[str] = None) -> str:
+        start = time.perf_counter()
+        status, body, location = session.request(method, path, form)
+        elapsed = time.perf_counter() - start
+        if redirect is None:
+            ok = status == 200
+        else:
+            ok = status == 302 and location.endswith(redirect)
+        stats.record(route, elapsed, status, ok)
+        if not ok:
+            raise RuntimeError(f'{route} answered {status} {location}')
+        return body
+
+    if register:
+        call('POST /registerUser', 'POST', '/registerUser',
+             {'first': 'New', 'last': 'Student', 'email': email,
+              'password': PASSWORD}, '/projects')
+    else:
+        call('POST /authenticate', 'POST', '/authenticate',
+             {'email': email, 'password': PASSWORD}, '/projects')
+
+    projects = PROJECT_LINK.findall(call('GET /projects', 'GET',
+                                         '/projects'))
+    if not projects:
+        call('POST /create/project', 'POST', '/create/project',
+             {'projectName': 'My project', 'teacherEmail': ''},
+             '/projects')
+        projects = PROJECT_LINK.findall(call('GET /projects', 'GET',
+                                             '/projects'))
+    project_id = rng.choice(projects)
+
+    call('GET /project/<id>', 'GET', f'/project/{project_id}')
+
+    # Named to sort first, so it's on the project page's first page
+    name = f'0load-{rng.getrandbits(64):016x}.py'
+    call('POST /create/file/<id>', 'POST', f'/create/file/{project_id}',
+         {'fileName': name}, '/projects')
+    page = call('GET /project/<id>', 'GET', f'/project/{project_id}')
+    file_id = dict(FILE_DELETE.findall(page))[name]
+    call('GET /delete/file/<id>', 'GET', f'/delete/file/{file_id}',
+         redirect=f'/project/{project_id}')
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description='Drive the app with simulated classroom journeys.')
+    parser.add_argument('--users', type=int, default=200,
+                        help='journeys to run')
+    parser.add_argument('--rate', type=float, default=20,
+                        help='users arriving per second, 0 for all at once')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='most journeys running at once')
+    parser.add_argument('--register', type=float, default=0.1,
+                        help='fraction of users registering, not logging in')
+    parser.add_argument('--class-size', type=int, default=1000,
+                        help='users seeded in the database, with a fifth '
+                        'as many projects and as many files')
+    parser.add_argument('--server', action='store_true',
+                        help='go over HTTP to a server on localhost')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--json', help='file to write results to')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        app, services = load_app(directory)
+        dbm = services.dbm
+        with contextlib.redirect_stdout(io.StringIO()):
+            dbm.create_db()
+        users = args.class_size
+        data = generate(dbm, users, users // 5, users, 30, args.seed)
+
+        server = None
+        if args.server:
+            from werkzeug.serving import make_server
+
+            logging.getLogger('werkzeug').setLevel(logging.ERROR)
+            app.config['SERVER_NAME'] = None
+            server = make_server('127.0.0.1', 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever,
+                             daemon=True).start()
+            base = f'http://127.0.0.1:{server.server_port}'
+
+            def new_session():
+                return HTTPSession(base)
+        else:
+            def new_session():
+                return TestClientSession(app)
+
+        stats = Stats()
+
+        def run(email: str, register: bool, seed: int) -> None:
+            try:
+                journey(new_session(), stats, email, register,
+                        random.Random(seed))
+            except Exception as e:
+                stats.failed(str(e))
+
+        start = time.perf_counter()
+        arrival = 0.0
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for i in range(args.users):
+                if args.rate:
+                    arrival += rng.expovariate(args.rate)
+                    time.sleep(max(0.0, start + arrival
+                                   - time.perf_counter()))
+                register = rng.random() < args.register
+                email = (f'load{i:06}@school.example' if register
+                         else rng.choice(data.students))
+                pool.submit(run, email, register, rng.getrandbits(32))
+        elapsed = time.perf_counter() - start
+
+        if server is not None:
+            server.shutdown()
+        dbm.hasher.shutdown()
+
+    total = sum(len(x) for x in stats.latencies.values())
+    print(f'{args.users} journeys ({args.register:.0%} registering), '
+          f'{args.concurrency} at once, arriving at '
+          f'{args.rate or "unlimited"}/s, '
+          f'{"HTTP" if args.server else "test client"}: {total} requests '
+          f'in {elapsed:.1f}s, {total / elapsed:,.1f} requests/s, '
+          f'{args.users / elapsed:,.1f} journeys/s')
+    print(f'{"route":24} {"count":>6} {"errors":>6} {"req/s":>7} '
+          f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+
+    routes = {}
+    for route, latencies in sorted(stats.latencies.items()):
+        ordered = sorted(latencies)
+        routes[route] = {
+            'count': len(ordered), 'errors': stats.errors[route],
+            'statuses': dict(stats.statuses[route]),
+            'per_second': len(ordered) / elapsed,
+            'p50_ms': percentile(ordered, 50) * 1000,
+            'p95_ms': percentile(ordered, 95) * 1000,
+            'p99_ms': percentile(ordered, 99) * 1000}
+        r = routes[route]
+        print(f'{route:24} {r["count"]:6} {r["errors"]:6} '
+              f'{r["per_second"]:7.1f} {r["p50_ms"]:8.1f} '
+              f'{r["p95_ms"]:8.1f} {r["p99_ms"]:8.1f}')
+    for failure, count in stats.failures.most_common():
+        print(f'{count} journeys failed: {failure}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'options': vars(args), 'seconds': elapsed,
+                       'requests': total, 'routes': routes,
+                       'failures': dict(stats.failures)}, f, indent=2)
+
+    return 1 if stats.failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
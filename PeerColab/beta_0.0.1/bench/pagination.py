@@ -0,0 +1,86 @@
+"""
+PeerColab
+
+Benchmark for paging through the projects page
+
+Times reading the first page and a page deep into the listing for users in
+more and more projects. Both should stay flat as the count grows, bar the
+index getting a level deeper. Exits non-zero if the largest user's pages
+take more than three times as long as the smallest's.
+
+Usage: python -m bench.pagination [most projects]
+
+Copyright Joan Chirinos, 2021.
+"""
+
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from util.db import DBManager
+
+SCHEMA = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                      'static', 'table_definitions.sql')
+PAGE = 50
+
+
+def fill(dbm: DBManager, email: str, projects: int) -> None:
+    """Make email the admin of projects projects."""
+    with dbm.connections.cursor() as c:
+        c.executemany('INSERT INTO projects(project_id, name) VALUES(?,?)',
+                      ((f'{email}/{p}', f'project {p:06}')
+                       for p in range(projects)))
+        c.executemany('INSERT INTO admins VALUES(?,?)',
+                      ((f'{email}/{p}', email) for p in range(projects)))
+        c.executemany('INSERT INTO members(project_id, email) VALUES(?,?)',
+                      ((f'{email}/{p}', email) for p in range(projects)))
+
+
+def time_page(dbm: DBManager, email: str, after: str) -> float:
+    """Median seconds to read the page after a cursor."""
+    timings = []
+    for _ in range(50):
+        start = time.perf_counter()
+        dbm.get_project_listing(email, after, PAGE)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main(most: int) -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        dbm = DBManager(os.path.join(directory, 'bench.db'), SCHEMA)
+        with contextlib.redirect_stdout(io.StringIO()):
+            dbm.create_db()
+
+        counts = []
+        count = 100
+        while count <= most:
+            counts.append(count)
+            count *= 10
+
+        medians = []
+        for count in counts:
+            email = f'user{count}@example.com'
+            fill(dbm, email, count)
+
+            # Walk to the middle of the listing for a deep cursor
+            after, pages = None, 0
+            while pages < count // PAGE // 2:
+                after = dbm.get_project_listing(email, after, PAGE)[1]
+                pages += 1
+
+            first = time_page(dbm, email, None)
+            deep = time_page(dbm, email, after)
+            medians.append(max(first, deep))
+            print(f'{count:7,} projects: first page {first * 1000:.2f} ms, '
+                  f'page {pages + 1} {deep * 1000:.2f} ms')
+
+    return 0 if medians[-1] < medians[0] * 3 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
@@ -0,0 +1,111 @@
+"""
+PeerColab
+
+Benchmark for the presence registry
+
+Simulates a school's worth of clients, each on one file of a project and
+heartbeating every PRESENCE_HEARTBEAT seconds, on a virtual clock so
+minutes of heartbeats take seconds to run. Reports the time a heartbeat
+takes, how many were absorbed by coalescing, and the memory each client
+takes. A tenth of the clients then go quiet, and must all be gone once the
+TTL has passed while everyone else stays. Exits non-zero if not.
+
+Usage: python -m bench.presence [clients]
+
+Copyright Joan Chirinos, 2021.
+"""
+
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+from config import Config
+from util.presence import STATES, PresenceRegistry
+
+PROJECTS = 300
+FILES = 20
+SECONDS = 120
+
+
+class Clock:
+
+    def __init__(self) -> None:
+        """
+        Initialize Clock class, a clock that only moves when told to.
+
+        Returns
+        -------
+        None
+
+        """
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def heartbeat_all(registry: PresenceRegistry, clock: Clock, clients: list,
+                  seconds: float) -> list:
+    """
+    Heartbeat clients in turn for seconds, each every PRESENCE_HEARTBEAT.
+    Returns the seconds each heartbeat took.
+    """
+    interval = Config.PRESENCE_HEARTBEAT
+    start = clock.now
+    timings = []
+    for round in range(int(seconds // interval)):
+        for i, client in enumerate(clients):
+            clock.now = start + interval * (round + i / len(clients))
+            begin = time.perf_counter()
+            registry.heartbeat(*client)
+            timings.append(time.perf_counter() - begin)
+    clock.now = start + seconds
+    return timings
+
+
+def main(count: int) -> int:
+    rng = random.Random(0)
+    clock = Clock()
+    registry = PresenceRegistry(Config.PRESENCE_TTL, Config.PRESENCE_TICK,
+                                Config.PRESENCE_COALESCE, clock)
+    clients = []
+    for i in range(count):
+        project = rng.randrange(PROJECTS)
+        clients.append((f'p{project}', f'p{project}f{rng.randrange(FILES)}',
+                        f'student{i}@school.example', rng.choice(STATES)))
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    heartbeat_all(registry, clock, clients, Config.PRESENCE_HEARTBEAT)
+    per_client = (tracemalloc.get_traced_memory()[0] - before) / count
+    tracemalloc.stop()
+
+    timings = heartbeat_all(registry, clock, clients, SECONDS)
+    stats = registry.stats()
+    timings.sort()
+    print(f'{count:,} clients on {stats["files"]:,} files, '
+          f'{per_client:,.0f} bytes each. Heartbeat: '
+          f'{statistics.median(timings) * 1e6:,.1f} us median, '
+          f'{timings[len(timings) * 99 // 100] * 1e6:,.1f} us p99, '
+          f'{len(timings) / sum(timings):,.0f} per second.')
+    print(f'{stats["heartbeats"]:,} heartbeats, '
+          f'{1 - stats["renewals"] / stats["heartbeats"]:.0%} absorbed '
+          f'by coalescing.')
+
+    ok = stats['users'] == count
+    quiet = count // 10
+    heartbeat_all(registry, clock, clients[quiet:], Config.PRESENCE_TTL)
+    start = time.perf_counter()
+    stats = registry.stats()
+    sweep = time.perf_counter() - start
+    print(f'{quiet:,} clients went quiet, {stats["expired"]:,} expired '
+          f'{Config.PRESENCE_TTL} s later, swept in {sweep * 1000:,.2f} ms.')
+
+    ok = ok and stats['expired'] == quiet and stats['users'] == count - quiet
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000))
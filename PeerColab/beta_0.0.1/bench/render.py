@@ -0,0 +1,87 @@
+"""
+PeerColab
+
+Benchmark for rendering the projects page and the project page
+
+Renders both pages with 10, 100 and 1000 rows, once rendering the rows
+and once reusing them from the fragment cache as the routes do, and
+reports the time and the size of the page. Exits non-zero if reusing the
+rows isn't at least five times faster at 1000 rows.
+
+Usage: python -m bench.render
+
+Copyright Joan Chirinos, 2021.
+"""
+
+import os
+import statistics
+import sys
+import time
+import uuid
+
+from flask import Flask, render_template
+from markupsafe import Markup
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                         'templates')
+COUNTS = (10, 100, 1000)
+
+
+def median_time(render) -> float:
+    """Median seconds render() takes."""
+    timings = []
+    for _ in range(30):
+        start = time.perf_counter()
+        render()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main() -> int:
+    app = Flask(__name__, template_folder=TEMPLATES)
+    ok = True
+
+    with app.test_request_context():
+        for page in ('projects', 'project'):
+            for count in COUNTS:
+                ids = [str(uuid.uuid4()) for _ in range(count)]
+                if page == 'projects':
+                    def rows():
+                        return Markup(render_template(
+                            'projects_rows.html', after=None, first=False,
+                            projects=[(f'project {i}', x, True)
+                                      for i, x in enumerate(ids)]))
+
+                    def render(rows):
+                        return render_template('projects.html', rows=rows,
+                                               teacher=True)
+                else:
+                    def rows():
+                        return Markup(render_template(
+                            'project_rows.html', project_id=ids[0],
+                            after=None, first=False,
+                            files=[(f'file{i}.py', x)
+                                   for i, x in enumerate(ids)]))
+
+                    def render(rows):
+                        return render_template('project.html',
+                                               project_id=ids[0],
+                                               project_name='bench',
+                                               rows=rows, admin=True)
+
+                cached = rows()
+                size = len(render(cached).encode())
+                miss = median_time(lambda: render(rows()))
+                hit = median_time(lambda: render(cached))
+                print(f'{page:8} {count:5} rows: {size / 1024:7.1f} KiB, '
+                      f'{miss * 1000:6.2f} ms rendering rows, '
+                      f'{hit * 1000:5.2f} ms with cached rows')
+
+                if count == COUNTS[-1]:
+                    ok = ok and hit * 5 <= miss
+
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
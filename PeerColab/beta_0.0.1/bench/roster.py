@@ -0,0 +1,67 @@
+"""
+PeerColab
+
+Benchmark comparing a bulk roster import against one add_member per row
+
+Usage: python -m bench.roster [rows]
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from typing import List
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+from util.db import DBManager
+
+SCHEMA = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                      'static', 'table_definitions.sql')
+TEACHER = 'teacher@example.com'
+
+
+def roster(rows: int) -> List[str]:
+    """Make a roster with some repeated, invalid and existing rows."""
+    emails = [f'student{i}@example.com' for i in range(rows)]
+    for i in range(0, rows, 50):
+        emails[i] = emails[i - 1] if i else 'not an email'
+    return emails
+
+
+def main(rows: int) -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        dbm = DBManager(os.path.join(directory, 'bench.db'), SCHEMA)
+        with contextlib.redirect_stdout(io.StringIO()):
+            dbm.create_db()
+
+        emails = roster(rows)
+
+        project_id = dbm.create_project(TEACHER, 'one at a time')
+        start = time.perf_counter()
+        for email in emails:
+            dbm.add_member(email, project_id)
+        single = time.perf_counter() - start
+
+        project_id = dbm.create_project(TEACHER, 'bulk')
+        # Half the class is already in the project
+        dbm.add_members(TEACHER, project_id, emails[::2])
+        start = time.perf_counter()
+        ok, statuses = dbm.add_members(TEACHER, project_id, emails)
+        bulk = time.perf_counter() - start
+
+    counts = {}
+    for status in statuses:
+        counts[status] = counts.get(status, 0) + 1
+    print(f'{rows} rows: add_member per row {single * 1000:,.1f} ms, '
+          f'add_members {bulk * 1000:,.1f} ms')
+    print('report: ' + ', '.join(f'{n} {status}'
+                                 for status, n in sorted(counts.items())))
+
+    return 0 if ok and bulk < 1 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
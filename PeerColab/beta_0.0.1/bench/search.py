@@ -0,0 +1,95 @@
+"""
+PeerColab
+
+Benchmark for full-text search over many files
+
+Fills the search index with generated source files spread over many
+projects, then times searches by a user who is a member of a few of them.
+
+Usage: python -m bench.search [files]
+
+Copyright Joan Chirinos, 2021.
+"""
+
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from util.db import DBManager
+
+SCHEMA = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                      'static', 'table_definitions.sql')
+EMAIL = 'student@example.com'
+FILES_PER_PROJECT = 20
+
+
+def fill(dbm: DBManager, files: int, rng: random.Random) -> None:
+    """Index generated files without storing their contents."""
+    words = [''.join(rng.choices('abcdefghijklmnopqrstuvwxyz',
+                                 k=rng.randint(3, 9)))
+             for _ in range(20000)]
+    # Word frequencies fall off like in real text
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    projects = files // FILES_PER_PROJECT
+
+    with dbm.connections.cursor() as c:
+        c.executemany('INSERT INTO projects(project_id, name) VALUES(?,?)',
+                      ((f'p{p}', f'project {p}') for p in range(projects)))
+        # The user is in one project in every hundred
+        c.executemany('INSERT INTO members(project_id, email) VALUES(?,?)',
+                      ((f'p{p}', EMAIL) for p in range(0, projects, 100)))
+        c.executemany('INSERT INTO files(file_id, name, project_id) '
+                      'VALUES(?,?,?)',
+                      ((f'f{f}', f'file{f}.py', f'p{f // FILES_PER_PROJECT}')
+                       for f in range(files)))
+        c.executemany('INSERT INTO file_text(file_id, project_id, name, body) '
+                      'VALUES(?,?,?,?)',
+                      ((f'f{f}', f'p{f // FILES_PER_PROJECT}', f'file{f}.py',
+                        ' '.join(rng.choices(words, weights, k=300)))
+                       for f in range(files)))
+
+    return words
+
+
+def main(files: int) -> int:
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        dbm = DBManager(os.path.join(directory, 'bench.db'), SCHEMA)
+        with contextlib.redirect_stdout(io.StringIO()):
+            dbm.create_db()
+
+        start = time.perf_counter()
+        words = fill(dbm, files, rng)
+        print(f'indexed {files:,} files in {time.perf_counter() - start:.1f}s')
+
+        cases = {'common word': [words[0]],
+                 'mid word': [words[200]],
+                 'rare word': [words[15000]],
+                 'two words': [words[5], words[300]],
+                 'file name': ['file20000']}
+
+        worst = 0
+        for name, query in cases.items():
+            timings = []
+            for _ in range(30):
+                start = time.perf_counter()
+                results = dbm.search(EMAIL, ' '.join(query))
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            p95 = timings[int(len(timings) * 0.95)]
+            worst = max(worst, p95)
+            print(f'{name:12} {len(results):3} results, median '
+                  f'{statistics.median(timings) * 1000:6.1f} ms, '
+                  f'p95 {p95 * 1000:6.1f} ms')
+
+    return 0 if worst < 0.05 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
@@ -0,0 +1,99 @@
+"""
+PeerColab
+
+Benchmark for how long a fresh worker takes to answer its first request
+
+Seeds a small database, then starts new Python processes that each import
+the app, create it with create_app, and answer a logged-in GET /projects
+through the test client. Reports the median time to the end of the import,
+of create_app, of the first request and of a second one, all counted from
+before the interpreter started. With --warm, warm() runs before the first
+request, as a pre-fork server's post_fork hook would.
+
+Usage: python -m bench.startup [--runs N] [--warm]
+
+Copyright Joan Chirinos, 2021.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from .generate import generate
+from .load import load_app
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+PHASES = ('import', 'create_app', 'warm', 'first request', 'second request')
+
+# Run in the new process: argv is the database, a user's email, the time
+# the process was started and whether to warm up
+WORKER = '''
+import importlib.util, json, sys, time
+database, email, started, warm = sys.argv[1:]
+marks = {}
+def mark(phase):
+    marks[phase] = time.time() - float(started)
+spec = importlib.util.spec_from_file_location('peercolab_app', '__init__.py')
+peercolab = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(peercolab)
+mark('import')
+app = peercolab.create_app(overrides={'DATABASE_URI': database,
+                                      'SECRET_KEY': 'bench'})
+mark('create_app')
+if warm == '1':
+    peercolab.warm(app)
+mark('warm')
+client = app.test_client()
+with client.session_transaction() as session:
+    session['email'] = email
+for phase in ('first request', 'second request'):
+    assert client.get('/projects').status_code == 200
+    mark(phase)
+print(json.dumps(marks))
+'''
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description='Time a fresh process up to its first request.')
+    parser.add_argument('--runs', type=int, default=10,
+                        help='processes to start')
+    parser.add_argument('--warm', action='store_true',
+                        help='call warm() before the first request')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        _, services = load_app(directory)
+        with contextlib.redirect_stdout(io.StringIO()):
+            services.dbm.create_db()
+        data = generate(services.dbm, 200, 40, 200, 10)
+        services.dbm.connections.close()
+
+        timings = {phase: [] for phase in PHASES}
+        for _ in range(args.runs):
+            started = time.time()
+            out = subprocess.run(
+                [sys.executable, '-c', WORKER,
+                 os.path.join(directory, 'load.db'), data.students[0],
+                 repr(started), '1' if args.warm else '0'],
+                cwd=ROOT, check=True, capture_output=True, text=True).stdout
+            for phase, seconds in json.loads(out).items():
+                timings[phase].append(seconds)
+
+    print(f'{args.runs} processes{", warmed" if args.warm else ""}, '
+          'median ms since start:')
+    for phase in PHASES:
+        print(f'{phase:15} {statistics.median(timings[phase]) * 1000:8.1f}')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
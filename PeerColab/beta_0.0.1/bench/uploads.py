@@ -0,0 +1,111 @@
+"""
+PeerColab
+
+Benchmark for chunked uploads of large files
+
+Uploads a generated file chunk by chunk, drops a chunk part way through as
+a lost connection would, resumes, and finishes. Reports throughput and the
+most memory Python held, which should stay near one piece however big the
+file is. Exits non-zero if the stored file doesn't match.
+
+Usage: python -m bench.uploads [MiB]
+
+Copyright Joan Chirinos, 2021.
+"""
+
+import contextlib
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from util.db import DBManager
+
+SCHEMA = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                      'static', 'table_definitions.sql')
+EMAIL = 'student@example.com'
+
+
+class Generated(io.RawIOBase):
+    """A reproducible stream of bytes, standing in for a request body."""
+
+    def __init__(self, seed: int, length: int, cut: int = -1) -> None:
+        self.seed = seed
+        self.remaining = length
+        self.cut = cut
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if self.cut == 0:
+            return b''
+        size = min(size, self.remaining, 2 ** 16)
+        self.seed += 1
+        self.remaining -= size
+        self.cut -= 1
+        block = hashlib.sha256(str(self.seed).encode()).digest()
+        return (block * (size // 32 + 1))[:size]
+
+
+def main(mib: int) -> int:
+    size = mib * 2 ** 20 + 12345
+
+    with tempfile.TemporaryDirectory() as directory:
+        dbm = DBManager(os.path.join(directory, 'bench.db'), SCHEMA)
+        with contextlib.redirect_stdout(io.StringIO()):
+            dbm.create_db()
+        project_id = dbm.create_project(EMAIL, 'bench')
+
+        tracemalloc.start()
+        start = time.perf_counter()
+
+        _, upload_id = dbm.start_upload(EMAIL, project_id, 'data.bin', size,
+                                        2 ** 40)
+        _, upload = dbm.get_upload(EMAIL, upload_id)
+        chunk_size, chunks = upload['chunk_size'], upload['chunks']
+
+        def send(n: int, cut: int = -1) -> bool:
+            length = min(chunk_size, size - n * chunk_size)
+            return dbm.write_upload_chunk(EMAIL, upload_id, n,
+                                          Generated(n * 10 ** 6, length, cut),
+                                          length)[0]
+
+        # The connection drops during the middle chunk...
+        for n in range(chunks):
+            send(n, cut=5 if n == chunks // 2 else -1)
+        # ...so the client asks what arrived and sends the rest
+        _, upload = dbm.get_upload(EMAIL, upload_id)
+        missing = set(range(chunks)) - set(upload['received'])
+        for n in missing:
+            send(n)
+
+        ok, file_id = dbm.finish_upload(EMAIL, upload_id)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        expected = hashlib.sha256()
+        for n in range(chunks):
+            stream = Generated(n * 10 ** 6,
+                               min(chunk_size, size - n * chunk_size))
+            for piece in iter(lambda: stream.read(2 ** 16), b''):
+                expected.update(piece)
+        stored = hashlib.sha256()
+        for chunk in dbm.get_file_contents(file_id):
+            stored.update(chunk)
+        ok = ok and stored.digest() == expected.digest()
+
+    print(f'{mib} MiB in {chunks} chunks, {len(missing)} resent after a '
+          f'dropped connection: {mib / elapsed:,.1f} MiB/s, peak '
+          f'{peak / 2 ** 20:.2f} MiB held by Python, '
+          f'{"matches" if ok else "DOES NOT MATCH"}')
+
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
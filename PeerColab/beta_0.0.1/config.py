@@ -12,13 +12,94 @@ class Config:
     # SESSION_COOKIE_NAME = environ.get('SESSION_COOKIE_NAME')
     STATIC_FOLDER = 'static'
     TEMPLATES_FOLDER = 'templates'
+    # scrypt cost. Changing it upgrades each stored hash on its next login.
+    SCRYPT_N = 2 ** 14
+    SCRYPT_R = 8
+    SCRYPT_P = 1
+    # Processes hashing passwords, and how many more hashes may queue for
+    # them before logins wait up to HASH_TIMEOUT seconds and then fail.
+    HASH_WORKERS = 2
+    HASH_QUEUE_SIZE = 16
+    HASH_TIMEOUT = 5
+    # is_teacher/is_admin/is_member results cached per process. Changes made
+    # by another process are only seen once an entry is AUTH_CACHE_TTL old.
+    AUTH_CACHE_SIZE = 4096
+    AUTH_CACHE_TTL = 30
+    # Live editing: edits kept per document for late clients, longest
+    # document, and idle seconds before unloading.
+    COLLAB_HISTORY_SIZE = 500
+    COLLAB_MAX_CHARS = 1000000
+    COLLAB_IDLE_SECONDS = 300
+    # Live edits are logged as they arrive; the full text is snapshotted
+    # after this many edits or logged bytes, and covered log segments are
+    # deleted every EDIT_LOG_COMPACT_SECONDS.
+    EDIT_LOG_SNAPSHOT_OPS = 500
+    EDIT_LOG_SNAPSHOT_BYTES = 256 * 1024
+    EDIT_LOG_FSYNC = True
+    EDIT_LOG_COMPACT_SECONDS = 30
+    # Version history: versions per keyframe, largest file kept, and
+    # versions kept per file, plus any newer than HISTORY_KEEP_SECONDS.
+    HISTORY_KEYFRAME_INTERVAL = 20
+    HISTORY_MAX_BYTES = 1024 * 1024
+    HISTORY_KEEP_VERSIONS = 50
+    HISTORY_KEEP_SECONDS = 30 * 24 * 60 * 60
+    # Most rows accepted in one uploaded class roster.
+    ROSTER_MAX_ROWS = 2000
+    # Chunked uploads: bytes per chunk, bytes each user's files and uploads
+    # may add up to, and seconds before an unfinished upload is deleted.
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+    UPLOAD_QUOTA_BYTES = 1024 * 1024 * 1024
+    UPLOAD_MAX_AGE = 24 * 60 * 60
+    # Most results shown for a search.
+    SEARCH_RESULTS = 20
+    # Projects on each page of the projects page, and files on each page
+    # of a project.
+    PROJECTS_PER_PAGE = 50
+    FILES_PER_PAGE = 100
+    # Rendered row lists of those pages kept per process. Entries are keyed
+    # by version, so they never go stale; the TTL only frees memory.
+    FRAGMENT_CACHE_SIZE = 1024
+    FRAGMENT_CACHE_TTL = 600
+    # Background job worker threads per process, seconds a job may run
+    # without reporting progress before another worker takes it over, tries
+    # before a job fails, and how often idle workers look for new jobs.
+    JOB_WORKERS = 1
+    JOB_LEASE_SECONDS = 60
+    JOB_MAX_ATTEMPTS = 5
+    JOB_POLL_SECONDS = 1
+    # Change feeds: events a subscriber may fall behind by before it's
+    # dropped, events kept per topic and topics kept for reconnecting
+    # subscribers, most feeds open per process (change feeds and live edit
+    # streams are each capped at it), seconds between keepalives, and
+    # seconds before a feed ends and its client reconnects. Every open feed
+    # holds a server thread, idle or not, so the cap should fit the
+    # server's threads; feeds past it are refused with 503.
+    EVENT_QUEUE_SIZE = 256
+    EVENT_HISTORY_SIZE = 64
+    EVENT_MAX_TOPICS = 10000
+    EVENT_MAX_STREAMS = 1000
+    EVENT_KEEPALIVE_SECONDS = 15
+    EVENT_STREAM_SECONDS = 300
+    # Presence: seconds a heartbeat keeps a user on a file, resolution of
+    # its expiry, seconds within which repeated heartbeats are absorbed, and
+    # seconds between each page's heartbeats, which must be less than
+    # PRESENCE_TTL - PRESENCE_COALESCE.
+    PRESENCE_TTL = 30
+    PRESENCE_TICK = 1
+    PRESENCE_COALESCE = 10
+    PRESENCE_HEARTBEAT = 10
+    # Profile every request: Server-Timing headers, a JSON log line each,
+    # and Prometheus totals at /_metrics for this machine. Off unless the
+    # PROFILE_REQUESTS environment variable is 1.
+    PROFILE_REQUESTS = environ.get('PROFILE_REQUESTS') == '1'
 
 
 class ProdConfig(Config):
     FLASK_ENV = 'production'
     DEBUG = False
     TESTING = False
-    DATABASE_URI = path.join(basedir, environ.get('PROD_DATABASE_URI'))
+    DATABASE_URI = path.join(basedir, environ.get('PROD_DATABASE_URI',
+                                                  'data/prod.db'))
     SERVER_NAME = "NEED NAME HERE"
 
 
@@ -26,7 +107,12 @@ class DevConfig(Config):
     FLASK_ENV = 'development'
     DEBUG = True
     TESTING = True
-    DATABASE_URI = path.join(basedir, environ.get('DEV_DATABASE_URI'))
+    DATABASE_URI = path.join(basedir, environ.get('DEV_DATABASE_URI',
+                                                  'data/dev.db'))
     SERVER_NAME = "dev.peercolab:5000"
 
+
+# Configs by the FLASK_ENV they're for, chosen from by create_app
+CONFIGS = {'production': ProdConfig, 'development': DevConfig}
+
 # Source: https://hackersandslackers.com/configure-flask-applications
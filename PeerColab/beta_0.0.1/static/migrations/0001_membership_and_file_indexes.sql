@@ -0,0 +1,24 @@
+-- Indexes for the membership and file lookups every page makes.
+-- Duplicate rows are dropped first (keeping the oldest) so the unique
+-- indexes can be built on existing databases.
+
+DELETE FROM members WHERE rowid NOT IN (
+    SELECT MIN(rowid) FROM members GROUP BY project_id, email);
+
+DELETE FROM files WHERE rowid NOT IN (
+    SELECT MIN(rowid) FROM files GROUP BY project_id, name);
+
+-- is_member, create_file's permission check
+CREATE UNIQUE INDEX IF NOT EXISTS members_project_email
+    ON members(project_id, email);
+
+-- get_projects, get_project_listing
+CREATE INDEX IF NOT EXISTS members_email_project
+    ON members(email, project_id);
+
+-- create_file's duplicate check, get_files, get_project_page
+CREATE UNIQUE INDEX IF NOT EXISTS files_project_name
+    ON files(project_id, name);
+
+CREATE INDEX IF NOT EXISTS admins_email
+    ON admins(email);
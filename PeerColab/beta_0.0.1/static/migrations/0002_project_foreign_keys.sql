@@ -0,0 +1,43 @@
+-- Make members, admins and files reference projects, cascading deletes.
+-- SQLite cannot add a foreign key to an existing table, so each table is
+-- rebuilt in place. Rows pointing at projects that no longer exist are
+-- dropped first.
+
+DELETE FROM members WHERE NOT EXISTS (
+    SELECT 1 FROM projects WHERE projects.project_id=members.project_id);
+DELETE FROM admins WHERE NOT EXISTS (
+    SELECT 1 FROM projects WHERE projects.project_id=admins.project_id);
+DELETE FROM files WHERE NOT EXISTS (
+    SELECT 1 FROM projects WHERE projects.project_id=files.project_id);
+
+CREATE TABLE members_new(
+    project_id TEXT NOT NULL
+        REFERENCES projects(project_id) ON DELETE CASCADE,
+    email TEXT);
+INSERT INTO members_new(project_id, email)
+    SELECT project_id, email FROM members;
+DROP TABLE members;
+ALTER TABLE members_new RENAME TO members;
+CREATE UNIQUE INDEX members_project_email ON members(project_id, email);
+CREATE INDEX members_email_project ON members(email, project_id);
+
+CREATE TABLE admins_new(
+    project_id TEXT PRIMARY KEY
+        REFERENCES projects(project_id) ON DELETE CASCADE,
+    email TEXT);
+INSERT INTO admins_new(project_id, email)
+    SELECT project_id, email FROM admins;
+DROP TABLE admins;
+ALTER TABLE admins_new RENAME TO admins;
+CREATE INDEX admins_email ON admins(email);
+
+CREATE TABLE files_new(
+    file_id TEXT PRIMARY KEY,
+    name TEXT,
+    project_id TEXT NOT NULL
+        REFERENCES projects(project_id) ON DELETE CASCADE);
+INSERT INTO files_new(file_id, name, project_id)
+    SELECT file_id, name, project_id FROM files;
+DROP TABLE files;
+ALTER TABLE files_new RENAME TO files;
+CREATE UNIQUE INDEX files_project_name ON files(project_id, name);
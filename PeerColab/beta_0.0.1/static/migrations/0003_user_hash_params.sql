@@ -0,0 +1,5 @@
+-- Record the scrypt (N, r, p) each password hash was made with, as 'N:r:p',
+-- so hashes can be upgraded when the configured cost changes. NULL means
+-- py-scrypt's defaults, which every earlier hash used.
+
+ALTER TABLE users ADD COLUMN hash_params TEXT;
@@ -0,0 +1,27 @@
+-- File contents live in the blob store as content-addressed chunks.
+-- chunks.refcount counts file_chunks rows pointing at each chunk and is kept
+-- up to date by triggers, including when files are removed by a cascade.
+-- Chunks left with refcount 0 are deleted by DBManager.collect_garbage.
+
+CREATE TABLE chunks(
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refcount INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID;
+
+CREATE INDEX chunks_unreferenced ON chunks(refcount) WHERE refcount <= 0;
+
+CREATE TABLE file_chunks(
+    file_id TEXT NOT NULL REFERENCES files(file_id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    hash TEXT NOT NULL REFERENCES chunks(hash),
+    PRIMARY KEY(file_id, seq)) WITHOUT ROWID;
+
+CREATE TRIGGER file_chunks_ref AFTER INSERT ON file_chunks BEGIN
+    UPDATE chunks SET refcount=refcount + 1 WHERE hash=NEW.hash;
+END;
+
+CREATE TRIGGER file_chunks_unref AFTER DELETE ON file_chunks BEGIN
+    UPDATE chunks SET refcount=refcount - 1 WHERE hash=OLD.hash;
+END;
+
+ALTER TABLE files ADD COLUMN size INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,4 @@
+-- The revision of the live document each file's stored contents are a
+-- snapshot of. Edits after it are replayed from the file's edit log.
+
+ALTER TABLE files ADD COLUMN rev INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,21 @@
+-- Chunked uploads in progress, and who created each file, so a user's
+-- uploads can be held to a byte quota. Files created before this migration
+-- count against nobody. Received chunks are kept on disk by UploadStore;
+-- a row here is what makes them an upload.
+
+ALTER TABLE files ADD COLUMN created_by TEXT;
+
+CREATE INDEX files_created_by ON files(created_by);
+
+CREATE TABLE uploads(
+    upload_id TEXT PRIMARY KEY,
+    email TEXT NOT NULL,
+    project_id TEXT NOT NULL
+        REFERENCES projects(project_id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    sha256 TEXT,
+    created_at REAL NOT NULL);
+
+CREATE INDEX uploads_email ON uploads(email);
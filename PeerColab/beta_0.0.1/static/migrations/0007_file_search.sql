@@ -0,0 +1,35 @@
+-- Full-text search over file names and contents. file_text holds the text
+-- that is indexed, which DBManager keeps up to date as contents change;
+-- file_search is an FTS5 index over it, kept in step by the triggers.
+-- project_id is indexed too, so a search can be narrowed to the searcher's
+-- projects inside the index rather than after ranking every match.
+-- Files that already exist are indexed by `python __init__.py reindex`.
+
+CREATE TABLE file_text(
+    id INTEGER PRIMARY KEY,
+    file_id TEXT NOT NULL UNIQUE REFERENCES files(file_id) ON DELETE CASCADE,
+    project_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    body TEXT NOT NULL);
+
+CREATE INDEX file_text_project ON file_text(project_id);
+
+CREATE VIRTUAL TABLE file_search USING fts5(
+    name, body, project_id, content='file_text', content_rowid='id');
+
+CREATE TRIGGER file_text_insert AFTER INSERT ON file_text BEGIN
+    INSERT INTO file_search(rowid, name, body, project_id)
+    VALUES(NEW.id, NEW.name, NEW.body, NEW.project_id);
+END;
+
+CREATE TRIGGER file_text_delete AFTER DELETE ON file_text BEGIN
+    INSERT INTO file_search(file_search, rowid, name, body, project_id)
+    VALUES('delete', OLD.id, OLD.name, OLD.body, OLD.project_id);
+END;
+
+CREATE TRIGGER file_text_update AFTER UPDATE ON file_text BEGIN
+    INSERT INTO file_search(file_search, rowid, name, body, project_id)
+    VALUES('delete', OLD.id, OLD.name, OLD.body, OLD.project_id);
+    INSERT INTO file_search(rowid, name, body, project_id)
+    VALUES(NEW.id, NEW.name, NEW.body, NEW.project_id);
+END;
@@ -0,0 +1,22 @@
+-- Each membership carries a copy of its project's name, so a user's
+-- projects can be read a page at a time in name order straight from an
+-- index, however many projects they are in. The triggers keep the copy in
+-- step with projects.
+
+ALTER TABLE members ADD COLUMN project_name TEXT;
+
+UPDATE members SET project_name=(
+    SELECT name FROM projects WHERE projects.project_id=members.project_id);
+
+CREATE INDEX members_email_name ON members(email, project_name, project_id);
+
+CREATE TRIGGER members_project_name AFTER INSERT ON members BEGIN
+    UPDATE members SET project_name=(
+        SELECT name FROM projects WHERE project_id=NEW.project_id)
+    WHERE rowid=NEW.rowid;
+END;
+
+CREATE TRIGGER projects_rename AFTER UPDATE OF name ON projects BEGIN
+    UPDATE members SET project_name=NEW.name
+    WHERE project_id=NEW.project_id;
+END;
@@ -0,0 +1,92 @@
+-- Version counters for what the projects page and the project page show.
+-- A user's version goes up whenever their list of projects, which of them
+-- they administer, or whether they are a teacher changes. A project's goes
+-- up whenever its name, its files or its admin changes. The triggers bump
+-- them in the same transaction as the change, so pages can be revalidated
+-- from these tables alone. Counters only ever go up, and are kept after a
+-- project is deleted; deleting it deletes its memberships, which bumps
+-- every member's version.
+
+CREATE TABLE user_versions(
+    email TEXT PRIMARY KEY,
+    version INTEGER NOT NULL) WITHOUT ROWID;
+
+CREATE TABLE project_versions(
+    project_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL) WITHOUT ROWID;
+
+CREATE TRIGGER members_insert_version AFTER INSERT ON members BEGIN
+    INSERT INTO user_versions VALUES(NEW.email, 1)
+    ON CONFLICT(email) DO UPDATE SET version=version+1;
+END;
+
+CREATE TRIGGER members_delete_version AFTER DELETE ON members BEGIN
+    INSERT INTO user_versions VALUES(OLD.email, 1)
+    ON CONFLICT(email) DO UPDATE SET version=version+1;
+END;
+
+CREATE TRIGGER members_rename_version AFTER UPDATE OF project_name ON members
+BEGIN
+    INSERT INTO user_versions VALUES(NEW.email, 1)
+    ON CONFLICT(email) DO UPDATE SET version=version+1;
+END;
+
+CREATE TRIGGER admins_insert_version AFTER INSERT ON admins BEGIN
+    INSERT INTO user_versions VALUES(NEW.email, 1)
+    ON CONFLICT(email) DO UPDATE SET version=version+1;
+    INSERT INTO project_versions VALUES(NEW.project_id, 1)
+    ON CONFLICT(project_id) DO UPDATE SET version=version+1;
+END;
+
+CREATE TRIGGER admins_delete_version AFTER DELETE ON admins BEGIN
+    INSERT INTO user_versions VALUES(OLD.email, 1)
+    ON CONFLICT(email) DO UPDATE SET version=version+1;
+    INSERT INTO project_versions VALUES(OLD.project_id, 1)
+    ON CONFLICT(project_id) DO UPDATE SET version=version+1;
+END;
+
+CREATE TRIGGER admins_update_version AFTER UPDATE ON admins BEGIN
+    INSERT INTO user_versions VALUES(OLD.email, 1)
+    ON CONFLICT(email) DO UPDATE SET version=version+1;
+    INSERT INTO user_versions VALUES(NEW.email, 1)
+    ON CONFLICT(email) DO UPDATE SET version=version+1;
+    INSERT INTO project_versions VALUES(NEW.project_id, 1)
+    ON CONFLICT(project_id) DO UPDATE SET version=version+1;
+END;
+
+CREATE TRIGGER users_teacher_version AFTER UPDATE OF is_teacher ON users
+BEGIN
+    INSERT INTO user_versions VALUES(NEW.email, 1)
+    ON CONFLICT(email) DO UPDATE SET version=version+1;
+END;
+
+CREATE TRIGGER projects_insert_version AFTER INSERT ON projects BEGIN
+    INSERT INTO project_versions VALUES(NEW.project_id, 1)
+    ON CONFLICT(project_id) DO UPDATE SET version=version+1;
+END;
+
+CREATE TRIGGER projects_update_version AFTER UPDATE OF name ON projects BEGIN
+    INSERT INTO project_versions VALUES(NEW.project_id, 1)
+    ON CONFLICT(project_id) DO UPDATE SET version=version+1;
+END;
+
+CREATE TRIGGER files_insert_version AFTER INSERT ON files BEGIN
+    INSERT INTO project_versions VALUES(NEW.project_id, 1)
+    ON CONFLICT(project_id) DO UPDATE SET version=version+1;
+END;
+
+CREATE TRIGGER files_delete_version AFTER DELETE ON files BEGIN
+    INSERT INTO project_versions VALUES(OLD.project_id, 1)
+    ON CONFLICT(project_id) DO UPDATE SET version=version+1;
+END;
+
+CREATE TRIGGER files_update_version AFTER UPDATE OF name, project_id ON files
+BEGIN
+    INSERT INTO project_versions VALUES(OLD.project_id, 1)
+    ON CONFLICT(project_id) DO UPDATE SET version=version+1;
+    INSERT INTO project_versions VALUES(NEW.project_id, 1)
+    ON CONFLICT(project_id) DO UPDATE SET version=version+1;
+END;
+
+INSERT INTO user_versions SELECT email, 1 FROM users WHERE email IS NOT NULL;
+INSERT INTO project_versions SELECT project_id, 1 FROM projects;
@@ -0,0 +1,32 @@
+-- Background jobs, run by JobQueue worker threads in every app process.
+-- A job is due while queued or running with run_after in the past: a
+-- running job's run_after is the end of its lease, so a job whose worker
+-- died is picked up again once the lease runs out. idempotency_key makes
+-- enqueueing the same work twice return the first job.
+--
+-- A deleted project is tombstoned with deleted_at and loses its members at
+-- once; its files are removed in batches by a purge_project job, which
+-- deletes the project row last.
+
+CREATE TABLE jobs(
+    job_id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    args TEXT NOT NULL,
+    owner TEXT,
+    idempotency_key TEXT UNIQUE,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL);
+
+CREATE INDEX jobs_due ON jobs(run_after)
+    WHERE state IN ('queued', 'running');
+CREATE INDEX jobs_finished ON jobs(updated_at)
+    WHERE state IN ('done', 'failed');
+
+ALTER TABLE projects ADD COLUMN deleted_at REAL;
@@ -0,0 +1,19 @@
+-- Version history of file contents, written by DBManager in the same
+-- transaction as each change. A row's data is either a keyframe, the whole
+-- contents compressed, or a compressed delta against the version before it.
+-- keyframe is the version of the keyframe a row's delta chain starts from,
+-- its own version for a keyframe, so any version is rebuilt from the rows
+-- between its keyframe and itself. Retention deletes whole chains only.
+--
+-- History starts with the first change after this migration; a file's
+-- contents from before it are not kept.
+
+CREATE TABLE file_versions(
+    file_id TEXT NOT NULL REFERENCES files(file_id) ON DELETE CASCADE,
+    version INTEGER NOT NULL,
+    keyframe INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    created_by TEXT,
+    PRIMARY KEY(file_id, version));
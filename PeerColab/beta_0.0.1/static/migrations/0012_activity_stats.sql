@@ -0,0 +1,83 @@
+-- Counters behind the teacher dashboard, so it reads one row per project
+-- and one per student rather than aggregating members and files on every
+-- view. members, files and bytes are kept by the triggers below in the
+-- same transaction as the change, cascades included. edits and
+-- last_active are added by DBManager in the transaction that saves the
+-- edits; nothing else records them, so DBManager.rebuild_stats recomputes
+-- every other counter and keeps those. A member's files are the files
+-- they created.
+
+CREATE TABLE project_stats(
+    project_id TEXT PRIMARY KEY
+        REFERENCES projects(project_id) ON DELETE CASCADE,
+    members INTEGER NOT NULL DEFAULT 0,
+    files INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    edits INTEGER NOT NULL DEFAULT 0,
+    last_active REAL) WITHOUT ROWID;
+
+CREATE TABLE member_stats(
+    project_id TEXT NOT NULL
+        REFERENCES projects(project_id) ON DELETE CASCADE,
+    email TEXT NOT NULL,
+    files INTEGER NOT NULL DEFAULT 0,
+    edits INTEGER NOT NULL DEFAULT 0,
+    last_active REAL,
+    PRIMARY KEY(project_id, email)) WITHOUT ROWID;
+
+CREATE TRIGGER projects_insert_stats AFTER INSERT ON projects BEGIN
+    INSERT INTO project_stats(project_id) VALUES(NEW.project_id);
+END;
+
+CREATE TRIGGER members_insert_stats AFTER INSERT ON members BEGIN
+    UPDATE project_stats SET members=members+1
+    WHERE project_id=NEW.project_id;
+    INSERT INTO member_stats(project_id, email)
+    SELECT NEW.project_id, NEW.email WHERE NEW.email IS NOT NULL
+    ON CONFLICT(project_id, email) DO NOTHING;
+END;
+
+CREATE TRIGGER members_delete_stats AFTER DELETE ON members BEGIN
+    UPDATE project_stats SET members=members-1
+    WHERE project_id=OLD.project_id;
+END;
+
+CREATE TRIGGER files_insert_stats AFTER INSERT ON files BEGIN
+    UPDATE project_stats SET files=files+1, bytes=bytes+NEW.size
+    WHERE project_id=NEW.project_id;
+    INSERT INTO member_stats(project_id, email, files)
+    SELECT NEW.project_id, NEW.created_by, 1
+    WHERE NEW.created_by IS NOT NULL
+    ON CONFLICT(project_id, email) DO UPDATE SET files=files+1;
+END;
+
+CREATE TRIGGER files_delete_stats AFTER DELETE ON files BEGIN
+    UPDATE project_stats SET files=files-1, bytes=bytes-OLD.size
+    WHERE project_id=OLD.project_id;
+    UPDATE member_stats SET files=files-1
+    WHERE project_id=OLD.project_id AND email=OLD.created_by;
+END;
+
+CREATE TRIGGER files_size_stats AFTER UPDATE OF size ON files BEGIN
+    UPDATE project_stats SET bytes=bytes-OLD.size+NEW.size
+    WHERE project_id=NEW.project_id;
+END;
+
+INSERT INTO project_stats(project_id, members, files, bytes)
+SELECT project_id,
+       (SELECT count(*) FROM members
+        WHERE members.project_id=projects.project_id),
+       (SELECT count(*) FROM files
+        WHERE files.project_id=projects.project_id),
+       (SELECT COALESCE(SUM(size), 0) FROM files
+        WHERE files.project_id=projects.project_id)
+FROM projects;
+
+INSERT INTO member_stats(project_id, email)
+SELECT project_id, email FROM members WHERE email IS NOT NULL
+ON CONFLICT(project_id, email) DO NOTHING;
+
+INSERT INTO member_stats(project_id, email, files)
+SELECT project_id, created_by, count(*) FROM files
+WHERE created_by IS NOT NULL GROUP BY project_id, created_by
+ON CONFLICT(project_id, email) DO UPDATE SET files=excluded.files;
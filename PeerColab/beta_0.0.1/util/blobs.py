@@ -0,0 +1,210 @@
+"""
+PeerColab
+
+Python file facilitating content-addressed storage of file contents
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from typing import Iterable, Iterator, List, Set, Tuple
+import hashlib
+import mmap
+import os
+import tempfile
+
+
+class BlobStore:
+
+    def __init__(self, root: str, chunk_size: int = 64 * 1024) -> None:
+        """
+        Initialize BlobStore class.
+
+        Contents are split into fixed-size chunks stored once per distinct
+        sha256, at root/<first two hex digits>/<rest of the hex digest>.
+        The store only deals with chunk files; which files reference which
+        chunks, and how many times, is tracked by the caller.
+
+        Parameters
+        ----------
+        root : str
+            directory holding the chunks.
+        chunk_size : int
+            bytes per chunk.
+
+        Returns
+        -------
+        None
+
+        """
+        self.root = root
+        self.chunk_size = chunk_size
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        """
+        Get the path of a chunk.
+
+        Parameters
+        ----------
+        digest : str
+            the chunk's sha256 hex digest.
+
+        Returns
+        -------
+        str
+            the path.
+
+        """
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def split(self, data: bytes) -> Iterator[memoryview]:
+        """
+        Split contents into chunks without copying them.
+
+        Parameters
+        ----------
+        data : bytes
+            the contents, or any other bytes-like object.
+
+        Yields
+        ------
+        memoryview
+            each chunk.
+
+        """
+        view = memoryview(data)
+        for start in range(0, len(view), self.chunk_size):
+            yield view[start:start + self.chunk_size]
+
+    def exists(self, digest: str) -> bool:
+        """Check if a chunk is on disk."""
+        return os.path.exists(self.path(digest))
+
+    def put(self, chunk: bytes) -> Tuple[str, int]:
+        """
+        Store a chunk unless an identical one already is.
+
+        The chunk is written to a temporary file and renamed into place, so a
+        chunk file is either complete or absent, never partial.
+
+        Parameters
+        ----------
+        chunk : bytes
+            the chunk, or any other bytes-like object.
+
+        Returns
+        -------
+        Tuple[str, int]
+            (sha256 hex digest, size).
+
+        """
+        digest = hashlib.sha256(chunk).hexdigest()
+        path = self.path(digest)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(chunk)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+        return digest, len(chunk)
+
+    def put_all(self, data: bytes) -> List[Tuple[str, int]]:
+        """
+        Split contents into chunks and store each one.
+
+        Parameters
+        ----------
+        data : bytes
+            the contents, or any other bytes-like object.
+
+        Returns
+        -------
+        List[Tuple[str, int]]
+            [(sha256 hex digest, size), ...] in order.
+
+        """
+        return [self.put(chunk) for chunk in self.split(data)]
+
+    def open(self, digest: str) -> memoryview:
+        """
+        Map a chunk into memory.
+
+        Parameters
+        ----------
+        digest : str
+            the chunk's sha256 hex digest.
+
+        Returns
+        -------
+        memoryview
+            a read-only view of the chunk, backed by the page cache.
+
+        """
+        with open(self.path(digest), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b'')
+            return memoryview(mmap.mmap(f.fileno(), 0,
+                                        access=mmap.ACCESS_READ))
+
+    def read(self, digests: Iterable[str]) -> Iterator[memoryview]:
+        """
+        Map chunks into memory one at a time.
+
+        Parameters
+        ----------
+        digests : Iterable[str]
+            the chunks' sha256 hex digests, in order.
+
+        Yields
+        ------
+        memoryview
+            each chunk.
+
+        """
+        for digest in digests:
+            yield self.open(digest)
+
+    def remove(self, digests: Iterable[str]) -> None:
+        """
+        Delete chunks from disk, ignoring ones already gone.
+
+        Parameters
+        ----------
+        digests : Iterable[str]
+            the chunks' sha256 hex digests.
+
+        Returns
+        -------
+        None
+
+        """
+        for digest in digests:
+            try:
+                os.unlink(self.path(digest))
+            except FileNotFoundError:
+                pass
+
+    def all_digests(self) -> Set[str]:
+        """
+        List every chunk on disk.
+
+        Returns
+        -------
+        Set[str]
+            the chunks' sha256 hex digests.
+
+        """
+        digests = set()
+        for prefix in os.listdir(self.root):
+            directory = os.path.join(self.root, prefix)
+            if len(prefix) == 2 and os.path.isdir(directory):
+                digests.update(prefix + rest for rest in os.listdir(directory))
+        return digests
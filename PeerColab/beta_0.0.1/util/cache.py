@@ -0,0 +1,200 @@
+"""
+PeerColab
+
+Python file facilitating small in-process caches
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import threading
+import time
+
+
+class TTLCache:
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        """
+        Initialize TTLCache class.
+
+        A thread-safe LRU cache whose entries also expire ttl seconds after
+        they are set. The cache is per process, so anything changed by
+        another process is only picked up once the entry expires.
+
+        generation counts the calls to discard, discard_if and clear. A
+        caller computing a value from data that may be invalidated meanwhile
+        reads it first and passes it to set, so a value computed before an
+        invalidation is never stored after it.
+
+        Parameters
+        ----------
+        maxsize : int
+            most entries to hold before evicting the least recently used.
+        ttl : float
+            seconds an entry stays valid.
+
+        Returns
+        -------
+        None
+
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Look up a key.
+
+        Parameters
+        ----------
+        key : Hashable
+            the key.
+
+        Returns
+        -------
+        Tuple[bool, Any]
+            (True, value) on a hit.
+            (False, None) if the key is missing or expired.
+
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return False, None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def set(self, key: Hashable, value: Any,
+            generation: Optional[int] = None) -> bool:
+        """
+        Store a value, evicting the least recently used entry if full.
+
+        Parameters
+        ----------
+        key : Hashable
+            the key.
+        value : Any
+            the value.
+        generation : Optional[int]
+            the generation read before computing the value. Nothing is
+            stored if anything was invalidated since.
+
+        Returns
+        -------
+        bool
+            True if the value was stored.
+
+        """
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def cached(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Get a key, computing and storing it on a miss.
+
+        Parameters
+        ----------
+        key : Hashable
+            the key.
+        compute : Callable[[], Any]
+            called to get the value on a miss.
+
+        Returns
+        -------
+        Any
+            the value.
+
+        """
+        generation = self.generation
+        hit, value = self.get(key)
+        if not hit:
+            value = compute()
+            self.set(key, value, generation)
+        return value
+
+    def discard(self, key: Hashable) -> None:
+        """
+        Drop a key if present.
+
+        Parameters
+        ----------
+        key : Hashable
+            the key.
+
+        Returns
+        -------
+        None
+
+        """
+        with self._lock:
+            self.generation += 1
+            self._data.pop(key, None)
+
+    def discard_if(self, predicate: Callable[[Hashable], bool]) -> None:
+        """
+        Drop every key the predicate holds for.
+
+        Parameters
+        ----------
+        predicate : Callable[[Hashable], bool]
+            called with each key.
+
+        Returns
+        -------
+        None
+
+        """
+        with self._lock:
+            self.generation += 1
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        """
+        Drop every entry.
+
+        Returns
+        -------
+        None
+
+        """
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get hit/miss counters for sizing the cache.
+
+        Returns
+        -------
+        Dict[str, int]
+            hits, misses, evictions, current size and maxsize.
+
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'size': len(self._data),
+                    'maxsize': self.maxsize}
@@ -0,0 +1,767 @@
+"""
+PeerColab
+
+Python file facilitating real-time collaborative editing
+
+Documents are plain text edited with operational transformation. An edit is
+a list of operations applied in order:
+
+    {'op': 'ins', 'pos': int, 'text': str}
+    {'op': 'del', 'pos': int, 'len': int}
+
+Positions count Unicode code points. Clients send edits made against the
+revision they last saw; the server transforms them past anything accepted
+since, applies them, and gives them the next revision number. Each client
+runs Client's state machine: at most one edit in flight, later local edits
+buffered, and incoming edits transformed past both.
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from collections import Counter, deque
+from itertools import islice
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import fcntl
+import functools
+import os
+import threading
+import time
+
+Op = Dict[str, Any]
+Entry = Tuple[int, str, List[Op]]
+
+
+class ResyncRequired(Exception):
+    """Raised when a revision is no longer (or not yet) in a history."""
+
+
+class HubFull(Exception):
+    """Raised when a hub already has as many edit streams as it allows."""
+
+
+class ServedElsewhere(Exception):
+    """Raised when another process is serving live editing."""
+
+
+def validate(ops: Any, max_ops: int = 64, max_text: int = 65536) -> List[Op]:
+    """
+    Check that an edit received from a client is well formed.
+
+    Parameters
+    ----------
+    ops : Any
+        the decoded edit.
+    max_ops : int
+        most operations allowed in one edit.
+    max_text : int
+        most characters one edit may insert.
+
+    Returns
+    -------
+    List[Op]
+        the edit, with zero-length operations dropped.
+
+    Raises
+    ------
+    ValueError
+        if the edit is malformed or too big.
+
+    """
+    if not isinstance(ops, list) or len(ops) > max_ops:
+        raise ValueError('An edit must be a list of at most '
+                         f'{max_ops} operations.')
+
+    clean, inserted = [], 0
+    for op in ops:
+        if not isinstance(op, dict) or type(op.get('pos')) is not int \
+                or op['pos'] < 0:
+            raise ValueError('Every operation needs a non-negative pos.')
+
+        if op.get('op') == 'ins' and isinstance(op.get('text'), str):
+            inserted += len(op['text'])
+            if op['text']:
+                clean.append({'op': 'ins', 'pos': op['pos'],
+                              'text': op['text']})
+        elif op.get('op') == 'del' and type(op.get('len')) is int \
+                and op['len'] >= 0:
+            if op['len']:
+                clean.append({'op': 'del', 'pos': op['pos'],
+                              'len': op['len']})
+        else:
+            raise ValueError('Unknown operation.')
+
+    if inserted > max_text:
+        raise ValueError(f'An edit may insert at most {max_text} characters.')
+
+    return clean
+
+
+def apply(text: str, ops: List[Op]) -> str:
+    """
+    Apply an edit to a document.
+
+    Parameters
+    ----------
+    text : str
+        the document.
+    ops : List[Op]
+        the edit.
+
+    Returns
+    -------
+    str
+        the edited document.
+
+    Raises
+    ------
+    ValueError
+        if an operation falls outside the document.
+
+    """
+    for op in ops:
+        pos = op['pos']
+        if op['op'] == 'ins':
+            if pos > len(text):
+                raise ValueError('Insert past the end of the document.')
+            text = text[:pos] + op['text'] + text[pos:]
+        else:
+            if pos + op['len'] > len(text):
+                raise ValueError('Delete past the end of the document.')
+            text = text[:pos] + text[pos + op['len']:]
+    return text
+
+
+def _transform_op(a: Op, b: Op, a_first: bool) -> List[Op]:
+    """
+    Transform operation a so it applies after operation b.
+
+    Both must have been made against the same document. When both insert at
+    the same position, a_first decides whose text ends up first.
+    """
+    if a['op'] == 'ins':
+        if b['op'] == 'ins':
+            if a['pos'] < b['pos'] or (a['pos'] == b['pos'] and a_first):
+                return [a]
+            return [dict(a, pos=a['pos'] + len(b['text']))]
+
+        b_end = b['pos'] + b['len']
+        if a['pos'] <= b['pos']:
+            return [a]
+        if a['pos'] >= b_end:
+            return [dict(a, pos=a['pos'] - b['len'])]
+        return [dict(a, pos=b['pos'])]
+
+    a_end = a['pos'] + a['len']
+    if b['op'] == 'ins':
+        if b['pos'] <= a['pos']:
+            return [dict(a, pos=a['pos'] + len(b['text']))]
+        if b['pos'] >= a_end:
+            return [a]
+        # The insert lands inside the deleted range, so it survives and the
+        # delete is split around it
+        before = b['pos'] - a['pos']
+        return [dict(a, len=before),
+                dict(a, pos=a['pos'] + len(b['text']), len=a['len'] - before)]
+
+    b_end = b['pos'] + b['len']
+    if a_end <= b['pos']:
+        return [a]
+    if a['pos'] >= b_end:
+        return [dict(a, pos=a['pos'] - b['len'])]
+    overlap = min(a_end, b_end) - max(a['pos'], b['pos'])
+    if a['len'] == overlap:
+        return []
+    return [dict(a, pos=min(a['pos'], b['pos']), len=a['len'] - overlap)]
+
+
+def transform(ops: List[Op], against: List[Op],
+              ops_first: bool) -> Tuple[List[Op], List[Op]]:
+    """
+    Transform two concurrent edits past each other.
+
+    Parameters
+    ----------
+    ops : List[Op]
+        one edit.
+    against : List[Op]
+        the other edit, made against the same document.
+    ops_first : bool
+        whether ops wins ties between inserts at the same position.
+
+    Returns
+    -------
+    Tuple[List[Op], List[Op]]
+        (ops to apply after against, against to apply after ops).
+
+    """
+    if not ops or not against:
+        return ops, against
+
+    if len(ops) == 1 and len(against) == 1:
+        return (_transform_op(ops[0], against[0], ops_first),
+                _transform_op(against[0], ops[0], not ops_first))
+
+    if len(against) > 1:
+        against_out = []
+        for b in against:
+            ops, b_out = transform(ops, [b], ops_first)
+            against_out.extend(b_out)
+        return ops, against_out
+
+    ops_out = []
+    for a in ops:
+        a_out, against = transform([a], against, ops_first)
+        ops_out.extend(a_out)
+    return ops_out, against
+
+
+class Document:
+
+    def __init__(self, text: str, rev: int = 0, history_size: int = 500,
+                 max_chars: int = 1000000,
+                 log: Optional[Callable[[int, List[Op]], bool]] = None
+                 ) -> None:
+        """
+        Initialize Document class.
+
+        Only the last history_size edits are kept, so memory per document is
+        bounded by max_chars plus history_size bounded edits. Clients further
+        behind than that must reload the document.
+
+        Parameters
+        ----------
+        text : str
+            the document at revision rev.
+        rev : int
+            the document's revision.
+        history_size : int
+            number of recent edits kept for transforming and catching up.
+        max_chars : int
+            longest the document may grow.
+        log : Optional[Callable[[int, List[Op]], bool]]
+            called with each new revision and its edit before the edit is
+            accepted, returning True once a snapshot is due.
+
+        Returns
+        -------
+        None
+
+        """
+        self.text = text
+        self.rev = rev
+        self.saved_rev = rev
+        self.max_chars = max_chars
+        self.history = deque(maxlen=history_size)
+        self.last_active = time.monotonic()
+        self.listeners = 0
+        self.closed = False
+        self.log = log
+        self.snapshot_due = False
+        # Edits accepted from each author since the last checkpoint
+        self.editors = Counter()
+        # Held from checkpoint until the snapshot is saved, so one flush at
+        # a time decides what was saved
+        self.flush_lock = threading.Lock()
+
+        self._cond = threading.Condition()
+
+    def snapshot(self) -> Tuple[int, str]:
+        """Get (revision, text) as of now."""
+        with self._cond:
+            return self.rev, self.text
+
+    def checkpoint(self) -> Tuple[int, str, Dict[str, int]]:
+        """
+        Get (revision, text, {author: edits, ...}) as of now, the edits
+        being those accepted since the last checkpoint.
+        """
+        with self._cond:
+            editors, self.editors = dict(self.editors), Counter()
+            return self.rev, self.text, editors
+
+    def restore_editors(self, editors: Dict[str, int]) -> None:
+        """Count edits from a checkpoint again, once saving them failed."""
+        with self._cond:
+            self.editors.update(editors)
+
+    def _since(self, rev: int) -> List[Entry]:
+        """Get history entries after rev. Caller holds the lock."""
+        if rev > self.rev or rev < self.rev - len(self.history):
+            raise ResyncRequired(f'Revision {rev} is not in the history.')
+        # Walk in from the newest end, so catching up costs only what's new
+        entries = list(islice(reversed(self.history), self.rev - rev))
+        entries.reverse()
+        return entries
+
+    def submit(self, base_rev: int, client: str, ops: List[Op],
+               author: Optional[str] = None) -> Tuple[int, List[Op]]:
+        """
+        Accept an edit made against base_rev.
+
+        Parameters
+        ----------
+        base_rev : int
+            the revision the edit was made against.
+        client : str
+            id of the client sending it, echoed to listeners.
+        ops : List[Op]
+            the edit, already validated.
+        author : Optional[str]
+            email of the user making it, counted in editors.
+
+        Returns
+        -------
+        Tuple[int, List[Op]]
+            (new revision, the edit as applied).
+
+        Raises
+        ------
+        ResyncRequired
+            if base_rev is not in the history, or the document was closed.
+        ValueError
+            if the edit does not fit the document.
+
+        """
+        with self._cond:
+            if self.closed:
+                raise ResyncRequired('The document was closed.')
+
+            for _, _, concurrent in self._since(base_rev):
+                ops, _ = transform(ops, concurrent, ops_first=False)
+
+            text = apply(self.text, ops)
+            if len(text) > self.max_chars:
+                raise ValueError('The document is too long.')
+
+            # Written ahead, so an accepted edit survives a crash
+            if self.log is not None and self.log(self.rev + 1, ops):
+                self.snapshot_due = True
+
+            self.text = text
+            self.rev += 1
+            self.history.append((self.rev, client, ops))
+            if author is not None:
+                self.editors[author] += 1
+            self.last_active = time.monotonic()
+            self._cond.notify_all()
+
+            return self.rev, ops
+
+    def changes_since(self, rev: int, timeout: float = 0) -> List[Entry]:
+        """
+        Get edits after rev, waiting up to timeout seconds for one.
+
+        Parameters
+        ----------
+        rev : int
+            the last revision the caller has.
+        timeout : float
+            seconds to wait if there is nothing new yet.
+
+        Returns
+        -------
+        List[Entry]
+            [(revision, client, edit), ...], empty on timeout.
+
+        Raises
+        ------
+        ResyncRequired
+            if rev is not in the history, or the document was closed.
+
+        """
+        with self._cond:
+            if timeout and self.rev == rev and not self.closed:
+                self.listeners += 1
+                try:
+                    self._cond.wait_for(
+                        lambda: self.rev != rev or self.closed, timeout)
+                finally:
+                    self.listeners -= 1
+                    self.last_active = time.monotonic()
+            if self.closed:
+                raise ResyncRequired('The document was closed.')
+            return self._since(rev)
+
+    def close_if_idle(self, cutoff: float) -> bool:
+        """
+        Stop accepting edits if the document is saved and unused.
+
+        Parameters
+        ----------
+        cutoff : float
+            time.monotonic() value it must have been idle since.
+
+        Returns
+        -------
+        bool
+            True if the document is now closed.
+            False otherwise.
+
+        """
+        with self._cond:
+            if self.listeners == 0 and self.last_active < cutoff \
+                    and self.rev == self.saved_rev:
+                self.closed = True
+                self._cond.notify_all()
+            return self.closed
+
+    def close(self) -> None:
+        """Stop accepting edits, sending everyone waiting to resync."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class Client:
+
+    def __init__(self, client_id: str, rev: int, text: str) -> None:
+        """
+        Initialize Client class.
+
+        The client half of the protocol, used by test harnesses and mirrored
+        by the editor's JavaScript. Local edits apply immediately; one is in
+        flight at a time and the rest wait in a buffer.
+
+        Parameters
+        ----------
+        client_id : str
+            the client's id.
+        rev : int
+            the revision text is at.
+        text : str
+            the document.
+
+        Returns
+        -------
+        None
+
+        """
+        self.client_id = client_id
+        self.rev = rev
+        self.text = text
+        self.inflight = None
+        self.buffer = []
+
+    def edit(self, ops: List[Op]) -> None:
+        """Apply a local edit and queue it for sending."""
+        self.text = apply(self.text, ops)
+        self.buffer.extend(ops)
+
+    def to_send(self) -> Optional[Tuple[int, List[Op]]]:
+        """Get (base revision, edit) to send, if one can go out now."""
+        if self.inflight is not None or not self.buffer:
+            return None
+        self.inflight, self.buffer = self.buffer, []
+        return self.rev, self.inflight
+
+    def receive(self, entry: Entry) -> None:
+        """Handle an edit broadcast by the server, including our own."""
+        rev, client, ops = entry
+        self.rev = rev
+
+        if client == self.client_id and self.inflight is not None:
+            self.inflight = None
+            return
+
+        # The server puts edits it already has first on ties, so ours lose
+        if self.inflight is not None:
+            self.inflight, ops = transform(self.inflight, ops, False)
+        if self.buffer:
+            self.buffer, ops = transform(self.buffer, ops, False)
+        self.text = apply(self.text, ops)
+
+
+class CollabHub:
+
+    def __init__(self, load: Callable[[str], Tuple[int, str]],
+                 log: Callable[[str, int, List[Op]], bool],
+                 save: Callable[[str, int, str, Dict[str, int]], bool],
+                 history_size: int = 500, max_chars: int = 1000000,
+                 idle_seconds: float = 300, max_streams: int = 1000,
+                 lock_path: Optional[str] = None) -> None:
+        """
+        Initialize CollabHub class.
+
+        Holds the documents currently being edited in this process. Every
+        edit is logged before it is accepted; a snapshot is saved whenever
+        the log says one is due, and when a document is dropped once nobody
+        has touched it for idle_seconds.
+
+        Documents and their revision numbers live in one process, and
+        nothing coordinates them across processes, so two processes editing
+        a file would log clashing revisions and lose edits. With lock_path,
+        the first process to open a document holds an exclusive lock on it
+        until it exits, and hubs in other processes refuse to open any.
+
+        Parameters
+        ----------
+        load : Callable[[str], Tuple[int, str]]
+            called with a file_id to read the file's (revision, text).
+        log : Callable[[str, int, List[Op]], bool]
+            called with a file_id, revision and edit to log the edit,
+            returning True once a snapshot is due.
+        save : Callable[[str, int, str, Dict[str, int]], bool]
+            called with a file_id, revision, text and {author: edits, ...}
+            since the last snapshot to store a snapshot, returning False if
+            it wasn't stored.
+        history_size : int
+            edits kept per document.
+        max_chars : int
+            longest a document may grow.
+        idle_seconds : float
+            seconds without activity before a document is dropped.
+        max_streams : int
+            most edit streams open at once, see open_stream.
+        lock_path : Optional[str]
+            file locked by the process serving live editing. None if only
+            this process ever edits the files.
+
+        Returns
+        -------
+        None
+
+        """
+        self.load = load
+        self.log = log
+        self.save = save
+        self.history_size = history_size
+        self.max_chars = max_chars
+        self.idle_seconds = idle_seconds
+        self.max_streams = max_streams
+        self.lock_path = lock_path
+
+        self._documents = {}
+        self._lock_file = None
+        self._streams = 0
+        # Calls to forget, so a load racing one is known to be stale
+        self._forgets = 0
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def document(self, file_id: str) -> Document:
+        """
+        Get the live document for a file, loading it if needed.
+
+        Parameters
+        ----------
+        file_id : str
+            the file id.
+
+        Returns
+        -------
+        Document
+            the document.
+
+        Raises
+        ------
+        ServedElsewhere
+            if another process is serving live editing.
+
+        """
+        with self._lock:
+            self._claim()
+            doc = self._documents.get(file_id)
+            forgets = self._forgets
+
+        while doc is None:
+            # Outside the lock, so a slow load only holds up this file
+            rev, text = self.load(file_id)
+            loaded = Document(text, rev, self.history_size, self.max_chars,
+                              functools.partial(self.log, file_id))
+
+            with self._lock:
+                # The first document inserted wins. One loaded across a
+                # forget may predate a write, so it is loaded again.
+                doc = self._documents.get(file_id)
+                if doc is None and self._forgets == forgets:
+                    doc = self._documents[file_id] = loaded
+                    if self._sweeper is None:
+                        self._sweeper = threading.Thread(
+                            target=self._sweep_forever, daemon=True)
+                        self._sweeper.start()
+                forgets = self._forgets
+
+        return doc
+
+    def _claim(self) -> None:
+        """Take the lock on lock_path if this hub doesn't hold it yet."""
+        if self.lock_path is None or self._lock_file is not None:
+            return
+
+        f = open(self.lock_path, 'a')
+        try:
+            # Released when this process exits, so another can take over
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            raise ServedElsewhere('Live editing is served by another '
+                                  'process.')
+        self._lock_file = f
+
+    def submit(self, file_id: str, base_rev: int, client: str,
+               ops: List[Op], author: Optional[str] = None
+               ) -> Tuple[int, List[Op]]:
+        """
+        Submit an edit to a file, saving a snapshot if one is due.
+
+        See Document.submit.
+
+        """
+        doc = self.document(file_id)
+        rev, ops = doc.submit(base_rev, client, ops, author)
+        if doc.snapshot_due:
+            doc.snapshot_due = False
+            self.flush(file_id, doc)
+        return rev, ops
+
+    def flush(self, file_id: str, doc: Document) -> None:
+        """
+        Save a snapshot of a document if it changed since the last one.
+
+        Parameters
+        ----------
+        file_id : str
+            the file id.
+        doc : Document
+            the document.
+
+        Returns
+        -------
+        None
+
+        """
+        with doc.flush_lock:
+            rev, text, editors = doc.checkpoint()
+            if rev <= doc.saved_rev:
+                return
+
+            # Edits not stored are counted with the next snapshot instead
+            saved = False
+            try:
+                saved = self.save(file_id, rev, text, editors)
+            finally:
+                if not saved:
+                    doc.restore_editors(editors)
+            doc.saved_rev = max(doc.saved_rev, rev)
+
+    def replace(self, file_id: str, text: str,
+                author: Optional[str] = None) -> int:
+        """
+        Replace a document's text as one edit, e.g. to restore an old
+        version, and save a snapshot of it at once. Everyone editing sees
+        the change like any other edit.
+
+        Parameters
+        ----------
+        file_id : str
+            the file id.
+        text : str
+            the new text.
+        author : Optional[str]
+            email of the user replacing it.
+
+        Returns
+        -------
+        int
+            the document's revision with the new text.
+
+        Raises
+        ------
+        ValueError
+            if the text is longer than a document may be.
+
+        """
+        while True:
+            doc = self.document(file_id)
+            rev, old = doc.snapshot()
+
+            # Only the middle that differs is replaced
+            start = len(os.path.commonprefix([old, text]))
+            end = len(os.path.commonprefix([old[start:][::-1],
+                                            text[start:][::-1]]))
+            ops = []
+            if len(old) - end > start:
+                ops.append({'op': 'del', 'pos': start,
+                            'len': len(old) - end - start})
+            if len(text) - end > start:
+                ops.append({'op': 'ins', 'pos': start,
+                            'text': text[start:len(text) - end]})
+            if not ops:
+                return rev
+
+            try:
+                rev, _ = doc.submit(rev, 'restore', ops, author)
+            except ResyncRequired:
+                # Closed by the sweeper meanwhile, so load it again
+                continue
+            doc.snapshot_due = False
+            self.flush(file_id, doc)
+            return rev
+
+    def forget(self, file_id: str) -> None:
+        """
+        Drop a document without saving it, e.g. once it is deleted or
+        rewritten. Its editors are sent to resync, so they reload the file.
+        """
+        with self._lock:
+            self._forgets += 1
+            doc = self._documents.pop(file_id, None)
+        if doc is not None:
+            doc.close()
+
+    def open_stream(self) -> None:
+        """
+        Count a stream of a document's edits as open, until close_stream.
+
+        Each stream holds a server thread while it waits, so they are
+        limited per process.
+
+        Raises
+        ------
+        HubFull
+            if max_streams are open already.
+
+        """
+        with self._lock:
+            if self._streams >= self.max_streams:
+                raise HubFull('Too many edit streams.')
+            self._streams += 1
+
+    def close_stream(self) -> None:
+        """Count a stream opened by open_stream as closed."""
+        with self._lock:
+            self._streams -= 1
+
+    def sweep(self) -> None:
+        """
+        Save and drop documents nobody is using.
+
+        Returns
+        -------
+        None
+
+        """
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [(file_id, doc) for file_id, doc in self._documents.items()
+                    if doc.listeners == 0 and doc.last_active < cutoff]
+
+        for file_id, doc in idle:
+            self.flush(file_id, doc)
+            with self._lock:
+                if self._documents.get(file_id) is doc \
+                        and doc.close_if_idle(cutoff):
+                    del self._documents[file_id]
+
+    def flush_all(self) -> None:
+        """Save every document, e.g. at shutdown."""
+        with self._lock:
+            documents = list(self._documents.items())
+        for file_id, doc in documents:
+            self.flush(file_id, doc)
+
+    def _sweep_forever(self) -> None:
+        """Run sweep periodically on a daemon thread."""
+        while True:
+            time.sleep(min(self.idle_seconds, 60))
+            self.sweep()
@@ -0,0 +1,147 @@
+"""
+PeerColab
+
+Python file facilitating reusable, tuned SQLite connections
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Union
+import os
+import threading
+
+import sqlite3
+
+
+# Pragmas applied to every new connection. WAL lets readers keep going while
+# a writer commits, and synchronous=NORMAL is durable in WAL mode except on
+# power loss. cache_size is in KiB when negative.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,
+    'mmap_size': 64 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+    'foreign_keys': 'ON',
+}
+
+
+class ConnectionManager:
+
+    def __init__(self, filename: str,
+                 pragmas: Optional[Dict[str, Union[str, int]]] = None,
+                 cached_statements: int = 256) -> None:
+        """
+        Initialize ConnectionManager class.
+
+        Connections are opened lazily, one per thread, and reused for every
+        query that thread makes. They are reopened after a fork so that a
+        child process never shares a handle with its parent.
+
+        Parameters
+        ----------
+        filename : str
+            filename for the database
+        pragmas : Optional[Dict[str, Union[str, int]]]
+            pragmas applied to each new connection, DEFAULT_PRAGMAS if None
+        cached_statements : int
+            size of each connection's prepared statement cache
+
+        Returns
+        -------
+        None
+
+        """
+        self.db_filename = filename
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.cached_statements = cached_statements
+        self.connections_opened = 0
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _open(self) -> sqlite3.Connection:
+        """
+        Open and configure a new connection.
+
+        Returns
+        -------
+        sqlite3.Connection
+            the new connection.
+
+        """
+        db = sqlite3.connect(self.db_filename,
+                             cached_statements=self.cached_statements)
+        for pragma, value in self.pragmas.items():
+            db.execute(f'PRAGMA {pragma}={value}')
+
+        with self._lock:
+            self.connections_opened += 1
+
+        return db
+
+    def get(self) -> sqlite3.Connection:
+        """
+        Get this thread's connection, opening it if needed.
+
+        Returns
+        -------
+        sqlite3.Connection
+            the connection.
+
+        """
+        if os.getpid() != self._pid:
+            # Forked since the connections were made, start fresh
+            self._local = threading.local()
+            self._pid = os.getpid()
+
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = self._open()
+        return db
+
+    @contextmanager
+    def cursor(self) -> Iterator[sqlite3.Cursor]:
+        """
+        Yield a cursor on this thread's connection.
+
+        The transaction is committed if the block finishes and rolled back if
+        it raises. The cursor is closed either way, so no early return can
+        leave a statement or transaction open.
+
+        Yields
+        ------
+        sqlite3.Cursor
+            the cursor.
+
+        """
+        db = self.get()
+        c = db.cursor()
+        try:
+            yield c
+        except BaseException:
+            if db.in_transaction:
+                db.rollback()
+            raise
+        else:
+            if db.in_transaction:
+                db.commit()
+        finally:
+            c.close()
+
+    def close(self) -> None:
+        """
+        Close this thread's connection, if it has one.
+
+        Returns
+        -------
+        None
+
+        """
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
@@ -6,17 +6,160 @@ Python file facilitating database management and authentication
 Copyright Joan Chirinos, 2021.
 """
 
-from typing import Tuple
+from typing import (IO, Any, Callable, Dict, List, Optional, Sequence,
+                    Tuple, Union)
+import base64
+import binascii
+import functools
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
 import uuid
 # import datetime
 
-import sqlite3
-from scrypt import scrypt
+from . import collab, migrations
+from .blobs import BlobStore
+from .cache import TTLCache
+from .connection import ConnectionManager
+from .editlog import EditLog
+from .hashing import Hasher, format_params, parse_params
+from .history import VersionHistory
+from .jobs import JobQueue, Progress
+from .pubsub import PubSub
+from .uploads import UploadStore
+
+EMAIL = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s]+')
+# Most of each file's contents indexed for search
+SEARCH_MAX_BYTES = 2 ** 20
+# Marks around matches in search snippets, never found in indexed text
+MATCH_START, MATCH_END = '\x02', '\x03'
+# Files removed per transaction when purging a deleted project
+PURGE_BATCH = 100
+# Times a file's chunk list is read before giving up on a missing chunk
+READ_ATTEMPTS = 3
+
+
+def quote(text: str) -> str:
+    """Quote text for an FTS5 query, so none of it is read as syntax."""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def split_snippet(snippet: str) -> Tuple[str, List[Tuple[int, int]]]:
+    """
+    Take the match marks out of a search snippet.
+
+    Parameters
+    ----------
+    snippet : str
+        a snippet from DBManager.search.
+
+    Returns
+    -------
+    Tuple[str, List[Tuple[int, int]]]
+        (text, [(start, end), ...]), the snippet without its marks and the
+        offsets of each match in it.
+
+    """
+    parts = snippet.split(MATCH_START)
+    text, matches = parts[0], []
+    for part in parts[1:]:
+        match, _, rest = part.partition(MATCH_END)
+        matches.append((len(text), len(text) + len(match)))
+        text += match + rest
+    return text, matches
+
+
+def match_query(query: str, project_ids: Sequence[str]) -> str:
+    """
+    Turn what a user typed into an FTS5 query matching every word.
+
+    Each word is quoted, so nothing typed is read as query syntax. Words
+    match whole rather than as prefixes, since a prefix has to gather every
+    matching word's postings before the project filter can skip any. Only
+    files in project_ids can match.
+
+    Parameters
+    ----------
+    query : str
+        the search box's contents.
+    project_ids : Sequence[str]
+        the projects to search.
+
+    Returns
+    -------
+    str
+        the FTS5 query, empty if there are no words or projects.
+
+    """
+    words = [quote(word) for word in query.split()]
+    if not words or not project_ids:
+        return ''
+    return ('{name body}: (' + ' '.join(words) + ') AND project_id: ('
+            + ' OR '.join(quote(x) for x in project_ids) + ')')
+
+
+def user_topic(email: str) -> str:
+    """The change feed topic of the projects a user is in."""
+    return f'user:{email}'
+
+
+def project_topic(project_id: str) -> str:
+    """The change feed topic of a project's files and members."""
+    return f'project:{project_id}'
+
+
+def encode_cursor(*key: str) -> str:
+    """Encode the sort key of the last row on a page for use in a URL."""
+    encoded = base64.urlsafe_b64encode(json.dumps(key).encode())
+    return encoded.decode().rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str], length: int
+                  ) -> Optional[Tuple[str, ...]]:
+    """
+    Decode a cursor made by encode_cursor.
+
+    Parameters
+    ----------
+    cursor : Optional[str]
+        the cursor, None for the first page.
+    length : int
+        how many values the sort key has.
+
+    Returns
+    -------
+    Optional[Tuple[str, ...]]
+        the sort key, None if there's no cursor or it isn't valid.
+
+    """
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(
+            cursor.encode() + b'=' * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+    if (not isinstance(key, list) or len(key) != length
+            or not all(isinstance(x, str) for x in key)):
+        return None
+    return tuple(key)
 
 
 class DBManager:
 
-    def __init__(self, filename: str, table_defns_filename: str) -> None:
+    def __init__(self, filename: str, table_defns_filename: str,
+                 migrations_dirname: Optional[str] = None,
+                 hasher: Optional[Hasher] = None,
+                 auth_cache: Optional[TTLCache] = None,
+                 blobs: Optional[BlobStore] = None,
+                 edit_log: Optional[EditLog] = None,
+                 uploads: Optional[UploadStore] = None,
+                 jobs: Optional[JobQueue] = None,
+                 events: Optional[PubSub] = None,
+                 history: Optional[VersionHistory] = None) -> None:
         """
         Initialize DBManager class.
 
@@ -26,6 +169,34 @@ class DBManager:
             filename for current database
         table_defns_filename : str
             filename for file containing table definition strings
+        migrations_dirname : Optional[str]
+            directory of migration scripts, defaults to the migrations
+            directory next to table_defns_filename
+        hasher : Optional[Hasher]
+            password hasher, one hashing on the calling thread with
+            py-scrypt's default cost if None
+        auth_cache : Optional[TTLCache]
+            cache for is_teacher, is_admin and is_member, a small one if None
+        blobs : Optional[BlobStore]
+            store for file contents, defaults to a blobs directory next to
+            the database
+        edit_log : Optional[EditLog]
+            log of live edits to files, defaults to an editlog directory
+            next to the database
+        uploads : Optional[UploadStore]
+            store for chunked uploads in progress, whose piece_size must be
+            the blob store's chunk_size, defaults to an uploads directory
+            next to the database
+        jobs : Optional[JobQueue]
+            queue for work done after a request returns, one on this
+            database with its defaults if None. Its workers aren't started.
+        events : Optional[PubSub]
+            hub that changes to projects, members and files are published
+            to, on the topics named by user_topic and project_topic. One
+            nobody subscribes to if None.
+        history : Optional[VersionHistory]
+            policy for the version history kept of every file's contents,
+            the defaults if None.
 
         Returns
         -------
@@ -34,27 +205,70 @@ class DBManager:
         """
         self.db_filename = filename
         self.table_defns_filename = table_defns_filename
+        if migrations_dirname is None:
+            migrations_dirname = os.path.join(
+                os.path.dirname(table_defns_filename), 'migrations')
+        self.migrations_dirname = migrations_dirname
+        self.connections = ConnectionManager(filename)
+        self.hasher = Hasher() if hasher is None else hasher
+        if auth_cache is None:
+            auth_cache = TTLCache(1024, 30)
+        self.auth_cache = auth_cache
+        if blobs is None:
+            blobs = BlobStore(os.path.join(os.path.dirname(filename), 'blobs'))
+        self.blobs = blobs
+        if edit_log is None:
+            edit_log = EditLog(os.path.join(os.path.dirname(filename),
+                                            'editlog'))
+        self.edit_log = edit_log
+        if uploads is None:
+            uploads = UploadStore(os.path.join(os.path.dirname(filename),
+                                               'uploads'),
+                                  piece_size=self.blobs.chunk_size)
+        self.uploads = uploads
+        self.jobs = JobQueue(self.connections) if jobs is None else jobs
+        self.jobs.register('purge_project', lambda args, progress:
+                           self.purge_project(args['project_id'], progress))
+        self.events = PubSub() if events is None else events
+        self.history = VersionHistory() if history is None else history
 
     def create_db(self) -> None:
         """
-        Create database.
+        Create database, then bring it up to the latest schema version.
 
         Returns
         -------
         None
 
         """
-        db = sqlite3.connect(self.db_filename)
-        c = db.cursor()
-
-        with open(self.table_defns_filename) as f:
+        with self.connections.cursor() as c, \
+                open(self.table_defns_filename) as f:
             for defn in f.readlines():
                 print(defn[:-1])
                 if defn.strip() != '':
                     c.execute(defn)
 
-        db.commit()
-        db.close()
+        self.migrate()
+
+    def migrate(self) -> List[str]:
+        """
+        Apply pending schema migrations.
+
+        Returns
+        -------
+        List[str]
+            filenames of the migrations that were applied.
+
+        """
+        # Rebuilt tables must not be read through a stale connection
+        self.connections.close()
+
+        applied = migrations.migrate(self.db_filename,
+                                     self.migrations_dirname)
+        for name in applied:
+            print(f'Applied {name}')
+
+        return applied
 
     def register_user(self, email: str, password: str,
                       first_name: str, last_name: str,
@@ -81,28 +295,117 @@ class DBManager:
             True if user got registered.
             False if user already exists.
 
-        """
-        db = sqlite3.connect(self.db_filename)
-        c = db.cursor()
+        Raises
+        ------
+        HasherBusy
+            if too many passwords are already being hashed.
 
-        # Check if email is already registered
-        if c.execute('SELECT first FROM users WHERE email=?',
-                     (email,)).fetchone():
-            print('returning false')
-            return False
+        """
+        with self.connections.cursor() as c:
+            # Check if email is already registered
+            if c.execute('SELECT first FROM users WHERE email=?',
+                         (email,)).fetchone():
+                print('returning false')
+                return False
 
         # Register user
         salt = str(uuid.uuid4())
 
-        hash = scrypt.hash(password, salt)
+        hash = self.hasher.hash(password, salt)
 
-        c.execute('INSERT INTO users VALUES(?,?,?,?,?,?)',
-                  (email, hash, salt, first_name, last_name, teacher))
+        with self.connections.cursor() as c:
+            c.execute('INSERT OR IGNORE INTO users'
+                      '(email, hash, salt, first, last, is_teacher, '
+                      ' hash_params) '
+                      'VALUES(?,?,?,?,?,?,?)',
+                      (email, hash, salt, first_name, last_name, teacher,
+                       format_params(self.hasher.params)))
 
-        db.commit()
-        db.close()
+            registered = c.rowcount == 1
 
-        return True
+        # Someone else may have registered the email while we were hashing
+        if registered:
+            self.auth_cache.discard(('teacher', email))
+
+        return registered
+
+    def register_users(self, users: Sequence[Tuple[str, str, str, str, int]],
+                       batch_size: int = 500, workers: int = 0) -> List[str]:
+        """
+        Register many users, hashing their passwords on every core.
+
+        Parameters
+        ----------
+        users : Sequence[Tuple[str, str, str, str, int]]
+            [(email, password, first name, last name, teacher), ...] as for
+            register_user.
+        batch_size : int
+            users inserted per transaction.
+        workers : int
+            number of hashing processes, one per core if 0.
+
+        Returns
+        -------
+        List[str]
+            one status per user: 'registered', 'already registered',
+            'duplicate row' or 'invalid email'.
+
+        """
+        statuses = [''] * len(users)
+        rows = {}
+        for i, (email, *_) in enumerate(users):
+            if not EMAIL.fullmatch(email):
+                statuses[i] = 'invalid email'
+            elif email in rows:
+                statuses[i] = 'duplicate row'
+            else:
+                rows[email] = i
+
+        with self.connections.cursor() as c:
+            c.execute('SELECT value FROM json_each(?) '
+                      'WHERE value IN (SELECT email FROM users)',
+                      (json.dumps(list(rows)),))
+
+            for email, in c.fetchall():
+                statuses[rows.pop(email)] = 'already registered'
+
+        pending = list(rows.values())
+        salts = [str(uuid.uuid4()) for _ in pending]
+        hashes = self.hasher.hash_many(
+            [(users[i][1], salt) for i, salt in zip(pending, salts)], workers)
+        params = format_params(self.hasher.params)
+
+        for start in range(0, len(pending), batch_size):
+            batch = [(users[i][0], next(hashes), salt, users[i][2],
+                      users[i][3], users[i][4], params)
+                     for i, salt in zip(pending[start:start + batch_size],
+                                        salts[start:start + batch_size])]
+
+            with self.connections.cursor() as c:
+                c.executemany('INSERT OR IGNORE INTO users'
+                              '(email, hash, salt, first, last, is_teacher, '
+                              ' hash_params) '
+                              'VALUES(?,?,?,?,?,?,?)', batch)
+
+                # Someone registered one of these meanwhile; salts are unique
+                if c.rowcount != len(batch):
+                    c.execute('SELECT salt FROM users WHERE salt IN '
+                              '(SELECT value FROM json_each(?))',
+                              (json.dumps([row[2] for row in batch]),))
+                    inserted = {x[0] for x in c.fetchall()}
+                else:
+                    inserted = {row[2] for row in batch}
+
+            for row, i in zip(batch, pending[start:start + batch_size]):
+                statuses[i] = 'registered' if row[2] in inserted \
+                    else 'already registered'
+
+        registered = {users[i][0] for i in pending
+                      if statuses[i] == 'registered'}
+        self.auth_cache.discard_if(
+            lambda key: key[0] == 'teacher' and key[1] in registered)
+
+        return statuses
 
     def authenticate_user(self, email: str, password: str) -> bool:
         """
@@ -121,21 +424,38 @@ class DBManager:
             True if password matches email.
             False if email doesn't exist or password doesn't match email.
 
+        Raises
+        ------
+        HasherBusy
+            if too many passwords are already being hashed.
+
         """
-        db = sqlite3.connect(self.db_filename)
-        c = db.cursor()
+        with self.connections.cursor() as c:
+            c.execute('SELECT hash, salt, hash_params FROM users '
+                      'WHERE email=?', (email,))
 
-        c.execute('SELECT hash, salt FROM users WHERE email=?', (email,))
+            vals = c.fetchone()
 
-        vals = c.fetchone()
         if not vals:
             return False
 
-        hash, salt = vals
+        hash, salt, params = vals
+        params = parse_params(params)
 
-        if hash != scrypt.hash(password, salt):
+        if not self.hasher.verify(password, salt, hash, params):
             return False
 
+        # Rehash with the configured cost now that we know the password
+        if params != self.hasher.params:
+            salt = str(uuid.uuid4())
+            hash = self.hasher.hash(password, salt)
+
+            with self.connections.cursor() as c:
+                c.execute('UPDATE users SET hash=?, salt=?, hash_params=? '
+                          'WHERE email=?',
+                          (hash, salt, format_params(self.hasher.params),
+                           email))
+
         return True
 
     def create_project(self, email: str, name: str) -> str:
@@ -155,20 +475,19 @@ class DBManager:
             the project_id of the new project
 
         """
-        db = sqlite3.connect(self.db_filename)
-        c = db.cursor()
-
         project_id = str(uuid.uuid4())
 
-        c.execute('INSERT INTO projects VALUES(?,?)',
-                  (project_id, name))
-        c.execute('INSERT INTO admins VALUES(?,?)',
-                  (project_id, email))
-        c.execute('INSERT INTO members VALUES(?,?)',
-                  (project_id, email))
+        with self.connections.cursor() as c:
+            c.execute('INSERT INTO projects(project_id, name) VALUES(?,?)',
+                      (project_id, name))
+            c.execute('INSERT INTO admins VALUES(?,?)',
+                      (project_id, email))
+            c.execute('INSERT INTO members(project_id, email) VALUES(?,?)',
+                      (project_id, email))
 
-        db.commit()
-        db.close()
+        self.forget_project(project_id)
+        self.events.publish(user_topic(email), {
+            'type': 'project_added', 'project_id': project_id, 'name': name})
 
         return project_id
 
@@ -190,25 +509,127 @@ class DBManager:
             False, 'error message' on failure.
 
         """
+        with self.connections.cursor() as c:
+            c.execute('SELECT name FROM projects '
+                      'WHERE project_id=? AND deleted_at IS NULL',
+                      (project_id,))
+
+            name = c.fetchone()
 
-        if not self.get_project_name(project_id)[0]:
-            return False, 'Project does not exist.'
+            if name is None:
+                return False, 'Project does not exist.'
 
-        db = sqlite3.connect(self.db_filename)
-        c = db.cursor()
+            c.execute('INSERT OR IGNORE INTO members(project_id, email) '
+                      'VALUES(?,?)',
+                      (project_id, email))
 
-        c.execute('INSERT INTO members VALUES(?,?)',
-                  (project_id, email))
+            added = c.rowcount
 
-        db.commit()
-        db.close()
+        self.auth_cache.discard(('member', email, project_id))
+        if added:
+            self._publish_members(project_id, name[0], [email])
 
         return True, ''
 
-    def delete_project(self, email: str, project_id: str) -> Tuple[bool, str]:
+    def add_members(self, email: str, project_id: str, emails: Sequence[str]
+                    ) -> Tuple[bool, Union[str, List[str]]]:
+        """
+        Add a roster of members to a project in one transaction.
+
+        Parameters
+        ----------
+        email : str
+            email of the project's admin.
+        project_id : str
+            the project id.
+        emails : Sequence[str]
+            the roster, one email per row.
+
+        Returns
+        -------
+        Tuple[bool, Union[str, List[str]]]
+            (True, [status, ...]) with one status per row: 'added',
+            'added, no account yet', 'already a member', 'duplicate row' or
+            'invalid email'.
+            (False, 'error_msg') on failure, with nobody added.
+
+        """
+        if not self.is_admin(email, project_id):
+            return False, 'You don\'t have permission to do that.'
+
+        statuses = [''] * len(emails)
+        rows = {}
+        for i, member in enumerate(emails):
+            member = member.strip()
+            if not EMAIL.fullmatch(member):
+                statuses[i] = 'invalid email'
+            elif member in rows:
+                statuses[i] = 'duplicate row'
+            else:
+                rows[member] = i
+
+        # The whole roster is checked with one query per table
+        roster = json.dumps(list(rows))
+
+        with self.connections.cursor() as c:
+            c.execute('BEGIN IMMEDIATE')
+            c.execute('SELECT name FROM projects '
+                      'WHERE project_id=? AND deleted_at IS NULL',
+                      (project_id,))
+
+            name = c.fetchone()
+
+            if name is None:
+                return False, 'Project does not exist.'
+
+            c.execute('SELECT value FROM json_each(?) WHERE value IN '
+                      '(SELECT email FROM members WHERE project_id=?)',
+                      (roster, project_id))
+
+            existing = {x[0] for x in c.fetchall()}
+
+            c.execute('SELECT value FROM json_each(?) '
+                      'WHERE value NOT IN (SELECT email FROM users)',
+                      (roster,))
+
+            unregistered = {x[0] for x in c.fetchall()}
+
+            added = [member for member in rows if member not in existing]
+            c.executemany('INSERT INTO members(project_id, email) VALUES(?,?)',
+                          ((project_id, member) for member in added))
+
+        for member, i in rows.items():
+            if member in existing:
+                statuses[i] = 'already a member'
+            elif member in unregistered:
+                statuses[i] = 'added, no account yet'
+            else:
+                statuses[i] = 'added'
+
+        self.forget_project(project_id)
+        self._publish_members(project_id, name[0], added)
+
+        return True, statuses
+
+    def _publish_members(self, project_id: str, name: str,
+                         emails: Sequence[str]) -> None:
+        """Tell a project and its new members that they were added."""
+        for email in emails:
+            self.events.publish(user_topic(email), {
+                'type': 'project_added', 'project_id': project_id,
+                'name': name})
+            self.events.publish(project_topic(project_id), {
+                'type': 'member_added', 'email': email})
+
+    def delete_project(self, email: str, project_id: str
+                       ) -> Tuple[bool, str]:
         """
         Attempt to delete project.
 
+        The project is tombstoned and its members removed at once, which
+        hides it from everyone. Its files are removed afterwards, in
+        batches, by a purge_project job.
+
         Parameters
         ----------
         email : str
@@ -223,35 +644,99 @@ class DBManager:
             (False, 'error_msg') otherwise.
 
         """
-        db = sqlite3.connect(self.db_filename)
-        c = db.cursor()
+        with self.connections.cursor() as c:
+            c.execute('BEGIN IMMEDIATE')
+            c.execute('SELECT email FROM admins WHERE project_id=?',
+                      (project_id,))
+
+            result = c.fetchone()
 
-        c.execute('SELECT email FROM admins WHERE project_id=?',
-                  (project_id,))
+            if result is None:
+                return False, 'Project does not exist.'
 
-        result = c.fetchone()
-        print(result)
+            if result[0] != email:
+                return False, 'You do not own that project.'
 
-        if result is None:
-            return False, 'Project does not exist.'
+            c.execute('UPDATE projects SET deleted_at=? WHERE project_id=?',
+                      (time.time(), project_id))
+            c.execute('DELETE FROM admins WHERE project_id=?',
+                      (project_id,))
+            c.execute('DELETE FROM members WHERE project_id=? '
+                      'RETURNING email',
+                      (project_id,))
 
-        if result[0] != email:
-            return False, 'You do not own that project.'
+            members = [x[0] for x in c.fetchall()]
 
-        c.execute('DELETE FROM admins WHERE project_id=?',
-                  (project_id,))
-        c.execute('DELETE FROM members WHERE project_id=?',
-                  (project_id,))
-        c.execute('DELETE FROM projects WHERE project_id=?',
-                  (project_id,))
-        c.execute('DELETE FROM files WHERE project_id=?',
-                  (project_id,))
+            self.jobs.enqueue('purge_project', {'project_id': project_id},
+                              email, f'purge_project:{project_id}', c)
 
-        db.commit()
-        db.close()
+        self.forget_project(project_id)
+        self.events.publish(project_topic(project_id),
+                            {'type': 'project_deleted'})
+        for member in members:
+            self.events.publish(user_topic(member), {
+                'type': 'project_removed', 'project_id': project_id})
 
         return True, ''
 
+    def purge_project(self, project_id: str,
+                      progress: Optional[Progress] = None) -> int:
+        """
+        Remove a deleted project's files, then the project itself.
+
+        Files are deleted PURGE_BATCH at a time, each batch in a short
+        transaction of its own, so other writers are never held up for
+        long. Safe to run again if interrupted.
+
+        Parameters
+        ----------
+        project_id : str
+            the project, which must have been deleted by delete_project.
+        progress : Optional[Progress]
+            called with (files removed, files there were) after each batch.
+
+        Returns
+        -------
+        int
+            number of files removed.
+
+        """
+        with self.connections.cursor() as c:
+            c.execute('SELECT count(*) FROM files WHERE project_id=? AND '
+                      'EXISTS (SELECT 1 FROM projects WHERE project_id=? '
+                      '        AND deleted_at IS NOT NULL)',
+                      (project_id, project_id))
+
+            total = c.fetchone()[0]
+
+        removed = 0
+        while removed < total:
+            with self.connections.cursor() as c:
+                c.execute('DELETE FROM files WHERE file_id IN ('
+                          '    SELECT file_id FROM files WHERE project_id=? '
+                          '    LIMIT ?) '
+                          'RETURNING file_id',
+                          (project_id, PURGE_BATCH))
+
+                file_ids = [x[0] for x in c.fetchall()]
+
+            if not file_ids:
+                break
+            for file_id in file_ids:
+                self.edit_log.delete(file_id)
+            removed += len(file_ids)
+            if progress is not None:
+                progress(removed, total)
+
+        with self.connections.cursor() as c:
+            c.execute('DELETE FROM projects '
+                      'WHERE project_id=? AND deleted_at IS NOT NULL',
+                      (project_id,))
+
+        self.collect_garbage()
+
+        return removed
+
     def get_projects(self, email: str) -> Tuple[str, ...]:
         """
         Get projects given an email.
@@ -267,17 +752,272 @@ class DBManager:
             [project_id, ...]
 
         """
-        db = sqlite3.connect(self.db_filename)
-        c = db.cursor()
+        with self.connections.cursor() as c:
+            c.execute('SELECT project_id FROM members WHERE email=?',
+                      (email,))
+
+            return tuple(x[0] for x in c.fetchall())
+
+    def get_project_listing(self, email: str, after: Optional[str] = None,
+                            limit: int = 50
+                            ) -> Tuple[Tuple[Tuple[str, str, bool], ...],
+                                       Optional[str]]:
+        """
+        Get a page of the projects an email is a member of, sorted by name.
+
+        Pages are read from members_email_name starting after the cursor,
+        so a page costs the same however many projects there are.
+
+        Parameters
+        ----------
+        email : str
+            the email.
+        after : Optional[str]
+            cursor from the previous page, None for the first page.
+        limit : int
+            most projects on the page.
+
+        Returns
+        -------
+        Tuple[Tuple[Tuple[str, str, bool], ...], Optional[str]]
+            ([(project name, project_id, is_admin), ...], cursor for the
+            next page or None if this is the last).
+
+        """
+        key = decode_cursor(after, 2)
+        where = ('' if key is None else
+                 'AND (members.project_name, members.project_id) > (?, ?) ')
+
+        with self.connections.cursor() as c:
+            c.execute('SELECT members.project_name, members.project_id, '
+                      '       admins.email IS NOT NULL '
+                      'FROM members '
+                      'LEFT JOIN admins '
+                      '  ON admins.project_id=members.project_id '
+                      '  AND admins.email=members.email '
+                      'WHERE members.email=? ' + where +
+                      'ORDER BY members.project_name, members.project_id '
+                      'LIMIT ?',
+                      (email, *(key or ()), limit + 1))
+
+            rows = c.fetchall()
+
+        page = tuple((name, project_id, bool(admin))
+                     for name, project_id, admin in rows[:limit])
+        more = len(rows) > limit
+        return page, encode_cursor(*page[-1][:2]) if more else None
+
+    def get_project_page(self, email: str, project_id: str,
+                         after: Optional[str] = None, limit: int = 100
+                         ) -> Tuple[bool, str, Tuple[Tuple[str, str], ...],
+                                    Optional[str]]:
+        """
+        Get everything a page of the project page shows, checking membership.
+
+        Files are read from files_project_name starting after the cursor, so
+        a page costs the same however many files there are.
+
+        Parameters
+        ----------
+        email : str
+            the email of the user viewing the page.
+        project_id : str
+            the project id.
+        after : Optional[str]
+            cursor from the previous page, None for the first page.
+        limit : int
+            most files on the page.
+
+        Returns
+        -------
+        Tuple[bool, str, Tuple[Tuple[str, str], ...], Optional[str]]
+            (True, 'project name', [(file name, file_id), ...], cursor for
+            the next page or None if this is the last) if email is a member
+            of the project.
+            (False, 'error_msg', (), None) otherwise.
+
+        """
+        with self.connections.cursor() as c:
+            c.execute('SELECT projects.name FROM members '
+                      'JOIN projects ON projects.project_id=members.project_id '
+                      'WHERE members.email=? AND members.project_id=?',
+                      (email, project_id))
+
+            name = c.fetchone()
+
+            if name is None:
+                return (False, 'You don\'t have permission to do that!', (),
+                        None)
+
+            # File names are unique within a project, so a name is a key
+            key = decode_cursor(after, 1)
+            c.execute('SELECT name, file_id FROM files WHERE project_id=? '
+                      + ('' if key is None else 'AND name>? ') +
+                      'ORDER BY name LIMIT ?',
+                      (project_id, *(key or ()), limit + 1))
+
+            rows = c.fetchall()
+
+        files = tuple(rows[:limit])
+        more = len(rows) > limit
+        return (True, name[0], files,
+                encode_cursor(files[-1][0]) if more else None)
+
+    def get_project_export(self, email: str, project_id: str
+                           ) -> Tuple[bool, str,
+                                      Tuple[Tuple[str, str, int], ...]]:
+        """
+        List a project's files for export, checking membership.
+
+        Parameters
+        ----------
+        email : str
+            the email of the user exporting.
+        project_id : str
+            the project id.
+
+        Returns
+        -------
+        Tuple[bool, str, Tuple[Tuple[str, str, int], ...]]
+            (True, 'project name', ((file name, file_id, size), ...)) if
+            email is a member of the project.
+            (False, 'error_msg', ()) otherwise.
+
+        """
+        with self.connections.cursor() as c:
+            c.execute('SELECT projects.name FROM members JOIN projects '
+                      'ON projects.project_id=members.project_id '
+                      'WHERE members.email=? AND members.project_id=?',
+                      (email, project_id))
+
+            name = c.fetchone()
+
+            if name is None:
+                return False, 'You don\'t have permission to do that!', ()
+
+            c.execute('SELECT name, file_id, size FROM files '
+                      'WHERE project_id=? ORDER BY name, file_id',
+                      (project_id,))
+
+            return True, name[0], tuple(c.fetchall())
+
+    def get_class_export(self, email: str) -> Tuple[
+            bool, str, Tuple[Tuple[str, str, str, str, int], ...]]:
+        """
+        List the files of every project a teacher runs, for export.
+
+        Parameters
+        ----------
+        email : str
+            the teacher's email.
+
+        Returns
+        -------
+        Tuple[bool, str, Tuple[Tuple[str, str, str, str, int], ...]]
+            (True, '', ((project_id, project name, file name, file_id,
+            size), ...)) if email is a teacher.
+            (False, 'error_msg', ()) otherwise.
+
+        """
+        if not self.is_teacher(email):
+            return False, 'Only teachers can do that!', ()
+
+        with self.connections.cursor() as c:
+            c.execute('SELECT projects.project_id, projects.name, files.name, '
+                      'files.file_id, files.size FROM admins '
+                      'JOIN projects ON projects.project_id=admins.project_id '
+                      'JOIN files ON files.project_id=admins.project_id '
+                      'WHERE admins.email=? '
+                      'ORDER BY projects.name, projects.project_id, '
+                      'files.name, files.file_id',
+                      (email,))
+
+            return True, '', tuple(c.fetchall())
+
+    def get_dashboard(self, email: str) -> Tuple[
+            bool, str, Tuple[Tuple[str, str, int, int, int, int,
+                                   Optional[float]], ...]]:
+        """
+        Get the activity counters of every project a teacher runs.
+
+        Reads one project_stats row per project, see migration 0012.
+
+        Parameters
+        ----------
+        email : str
+            the teacher's email.
 
-        c.execute('SELECT project_id FROM members WHERE email=?',
-                  (email,))
+        Returns
+        -------
+        Tuple[bool, str, Tuple[Tuple[str, str, int, int, int, int,
+                                     Optional[float]], ...]]
+            (True, '', ((project_id, project name, members, files, bytes,
+            edits, last active), ...)) if email is a teacher, last active
+            being None for projects nobody has edited.
+            (False, 'error_msg', ()) otherwise.
+
+        """
+        if not self.is_teacher(email):
+            return False, 'Only teachers can do that!', ()
+
+        with self.connections.cursor() as c:
+            c.execute('SELECT projects.project_id, projects.name, '
+                      '       project_stats.members, project_stats.files, '
+                      '       project_stats.bytes, project_stats.edits, '
+                      '       project_stats.last_active '
+                      'FROM admins '
+                      'JOIN projects ON projects.project_id=admins.project_id '
+                      'JOIN project_stats '
+                      '    ON project_stats.project_id=admins.project_id '
+                      'WHERE admins.email=? AND projects.deleted_at IS NULL '
+                      'ORDER BY projects.name, projects.project_id',
+                      (email,))
+
+            return True, '', tuple(c.fetchall())
+
+    def get_project_stats(self, email: str, project_id: str) -> Tuple[
+            bool, str, Tuple[Tuple[str, str, str, int, int,
+                                   Optional[float]], ...]]:
+        """
+        Get the activity counters of each student in a teacher's project.
 
-        projects = tuple(x[0] for x in c.fetchall())
+        Parameters
+        ----------
+        email : str
+            the teacher's email.
+        project_id : str
+            the project id.
 
-        db.close()
+        Returns
+        -------
+        Tuple[bool, str, Tuple[Tuple[str, str, str, int, int,
+                                     Optional[float]], ...]]
+            (True, 'project name', ((email, first name, last name, files
+            created, edits, last active), ...)) if email is a teacher
+            running the project, most recently active first. Past members
+            with files still in the project are included.
+            (False, 'error_msg', ()) otherwise.
 
-        return projects
+        """
+        if not self.is_teacher(email) or not self.is_admin(email, project_id):
+            return False, 'You don\'t have permission to do that.', ()
+
+        exists, name = self.get_project_name(project_id)
+        if not exists:
+            return False, name, ()
+
+        with self.connections.cursor() as c:
+            c.execute('SELECT member_stats.email, users.first, users.last, '
+                      '       member_stats.files, member_stats.edits, '
+                      '       member_stats.last_active '
+                      'FROM member_stats '
+                      'LEFT JOIN users ON users.email=member_stats.email '
+                      'WHERE member_stats.project_id=? '
+                      'ORDER BY member_stats.last_active DESC NULLS LAST, '
+                      '         member_stats.email',
+                      (project_id,))
+
+            return True, name, tuple(c.fetchall())
 
     def get_project_name(self, project_id: str) -> Tuple[bool, str]:
         """
@@ -295,23 +1035,20 @@ class DBManager:
             (False, 'error_msg') otherwise
 
         """
-        db = sqlite3.connect(self.db_filename)
-        c = db.cursor()
-
-        c.execute('SELECT name FROM projects WHERE project_id=?',
-                  (project_id,))
+        with self.connections.cursor() as c:
+            c.execute('SELECT name FROM projects '
+                      'WHERE project_id=? AND deleted_at IS NULL',
+                      (project_id,))
 
-        name = c.fetchone()
+            name = c.fetchone()
 
         if name is None:
             return False, 'Project doesn\'t exist!'
 
-        db.close()
-
         return True, name[0]
 
     def create_file(self, email: str, project_id: str,
-                    name: str) -> Tuple[bool, str]:
+                    name: str, contents: bytes = b'') -> Tuple[bool, str]:
         """
         Create file with given name in project.
 
@@ -323,6 +1060,8 @@ class DBManager:
             the project id.
         name : str
             the name of the file.
+        contents : bytes
+            the file's initial contents.
 
         Returns
         -------
@@ -331,183 +1070,1357 @@ class DBManager:
             (False, 'error_msg') on failure.
 
         """
-        db = sqlite3.connect(self.db_filename)
-        c = db.cursor()
+        # Before storing anything, so non-members can't fill the blob store;
+        # _insert_file checks again in its transaction
+        if not self.is_member(email, project_id):
+            return False, 'You don\'t have permission to do that.'
 
-        # Check if email is member of project
-        c.execute('SELECT email FROM members WHERE project_id=? AND email=?',
-                  (project_id, email))
+        chunks = self.blobs.put_all(contents)
 
-        member = c.fetchone()
+        created, error_msg = self._insert_file(email, project_id, name, chunks,
+                                               self._reread(contents))
 
-        if not member:
-            return False, 'You don\'t have permission to do that.'
+        return created, '' if created else error_msg
+
+    def _insert_file(self, email: str, project_id: str, name: str,
+                     chunks: List[Tuple[str, int]],
+                     reread: Callable[[int], bytes],
+                     upload_id: Optional[str] = None) -> Tuple[bool, str]:
+        """
+        Create a file from already stored chunks.
+
+        Parameters
+        ----------
+        email : str
+            email of member creating file.
+        project_id : str
+            the project id.
+        name : str
+            the name of the file.
+        chunks : List[Tuple[str, int]]
+            [(sha256 hex digest, size), ...] of the contents, in order.
+        reread : Callable[[int], bytes]
+            see _set_chunks.
+        upload_id : Optional[str]
+            upload the contents came from, removed in the same transaction.
+
+        Returns
+        -------
+        Tuple[bool, str]
+            (True, file_id) on success.
+            (False, 'error_msg') on failure.
+
+        """
+        with self.connections.cursor() as c:
+            # Check if email is member of project
+            c.execute('SELECT email FROM members '
+                      'WHERE project_id=? AND email=?',
+                      (project_id, email))
 
-        # Check if file with name already exists in project
-        c.execute('SELECT name FROM files WHERE project_id=? AND name=?',
-                  (project_id, name))
+            member = c.fetchone()
 
-        exists = c.fetchone()
+            if not member:
+                return False, 'You don\'t have permission to do that.'
 
-        if exists:
-            return False, 'File with that name already exists!'
+            # Check if file with name already exists in project
+            c.execute('SELECT name FROM files WHERE project_id=? AND name=?',
+                      (project_id, name))
 
-        # Create file
-        # TODO: Actually create the file in our filesystem
-        file_id = str(uuid.uuid1())
+            exists = c.fetchone()
 
-        c.execute('INSERT INTO files VALUES(?,?,?)',
-                  (file_id, project_id, name))
+            if exists:
+                return False, 'File with that name already exists!'
 
-    def get_files(self, email: str, project_id: str) -> Tuple[str, ...]:
+            # Create file
+            file_id = str(uuid.uuid1())
+
+            c.execute('INSERT INTO files(file_id, name, project_id, '
+                      'created_by) VALUES(?,?,?,?)',
+                      (file_id, name, project_id, email))
+
+            self._set_chunks(c, file_id, chunks, reread, email=email)
+
+            if upload_id is not None:
+                c.execute('DELETE FROM uploads WHERE upload_id=?',
+                          (upload_id,))
+
+        self.events.publish(project_topic(project_id), {
+            'type': 'file_created', 'file_id': file_id, 'name': name})
+
+        return True, file_id
+
+    def start_upload(self, email: str, project_id: str, name: str,
+                     size: int, quota: int,
+                     sha256: Optional[str] = None) -> Tuple[bool, str]:
         """
-        Get file_ids of files in project.
+        Start a chunked upload of a new file, reserving its size.
 
         Parameters
         ----------
         email : str
-            the email of the user.
+            email of member uploading the file.
         project_id : str
             the project id.
+        name : str
+            the name of the file.
+        size : int
+            the file's size in bytes.
+        quota : int
+            most bytes email's files and uploads may add up to.
+        sha256 : Optional[str]
+            the file's sha256 hex digest, checked when it is finished.
 
         Returns
         -------
-        Tuple[str, ...]
-            [file_id, ...]
+        Tuple[bool, str]
+            (True, upload_id) on success.
+            (False, 'error_msg') on failure.
 
         """
-        db = sqlite3.connect(self.db_filename)
-        c = db.cursor()
+        if size < 0:
+            return False, 'Invalid file size.'
 
-        c.execute('SELECT file_id FROM files WHERE project_id=?',
-                  (project_id,))
+        with self.connections.cursor() as c:
+            # Reserving takes the write lock, so two uploads can't both fit
+            c.execute('BEGIN IMMEDIATE')
+            c.execute('SELECT email FROM members '
+                      'WHERE project_id=? AND email=?',
+                      (project_id, email))
 
-        files = tuple(x[0] for x in c.fetchall())
+            if not c.fetchone():
+                return False, 'You don\'t have permission to do that.'
 
-        db.close()
+            c.execute('SELECT name FROM files WHERE project_id=? AND name=?',
+                      (project_id, name))
 
-        return files
+            if c.fetchone():
+                return False, 'File with that name already exists!'
 
-    def get_file_name(self, file_id: str) -> Tuple[bool, str]:
+            c.execute('SELECT (SELECT IFNULL(SUM(size), 0) FROM files '
+                      '        WHERE created_by=?) '
+                      '     + (SELECT IFNULL(SUM(size), 0) FROM uploads '
+                      '        WHERE email=?)',
+                      (email, email))
+
+            used = c.fetchone()[0]
+
+            if used + size > quota:
+                return False, (f'That would put you over your '
+                               f'{quota / 2 ** 20:,.0f} MiB upload limit.')
+
+            upload_id = str(uuid.uuid4())
+
+            c.execute('INSERT INTO uploads(upload_id, email, project_id, '
+                      'name, size, chunk_size, sha256, created_at) '
+                      'VALUES(?,?,?,?,?,?,?,?)',
+                      (upload_id, email, project_id, name, size,
+                       self.uploads.chunk_size, sha256, time.time()))
+
+        return True, upload_id
+
+    def _get_upload(self, email: str, upload_id: str
+                    ) -> Optional[Tuple[str, str, int, int, Optional[str]]]:
+        """Get (project_id, name, size, chunk_size, sha256) of an upload."""
+        with self.connections.cursor() as c:
+            c.execute('SELECT project_id, name, size, chunk_size, sha256 '
+                      'FROM uploads WHERE upload_id=? AND email=?',
+                      (upload_id, email))
+
+            return c.fetchone()
+
+    def get_upload(self, email: str, upload_id: str
+                   ) -> Tuple[bool, Union[str, Dict[str, Any]]]:
         """
-        Get name of file with given id.
+        Get the progress of an upload, so it can be resumed.
 
         Parameters
         ----------
-        file_id : str
-            the id.
+        email : str
+            email of member uploading the file.
+        upload_id : str
+            the upload id.
 
         Returns
         -------
-        Tuple[bool, str]
-            (True, 'file name') on success.
+        Tuple[bool, Union[str, Dict[str, Any]]]
+            (True, {'upload_id', 'name', 'size', 'chunk_size', 'chunks',
+            'received'}) on success, received listing the chunk numbers
+            already stored.
             (False, 'error_msg') on failure.
 
         """
-        db = sqlite3.connect(self.db_filename)
-        c = db.cursor()
+        upload = self._get_upload(email, upload_id)
+        if upload is None:
+            return False, 'Upload does not exist.'
+
+        _, name, size, chunk_size, _ = upload
+
+        return True, {'upload_id': upload_id,
+                      'name': name,
+                      'size': size,
+                      'chunk_size': chunk_size,
+                      'chunks': -(-size // chunk_size),
+                      'received': self.uploads.received(upload_id)}
+
+    def write_upload_chunk(self, email: str, upload_id: str, n: int,
+                           stream: IO[bytes], length: int,
+                           sha256: Optional[str] = None) -> Tuple[bool, str]:
+        """
+        Store one chunk of an upload, streaming it to disk.
+
+        Parameters
+        ----------
+        email : str
+            email of member uploading the file.
+        upload_id : str
+            the upload id.
+        n : int
+            the chunk's number, from 0.
+        stream : IO[bytes]
+            where to read the chunk from.
+        length : int
+            the number of bytes the sender says the chunk has.
+        sha256 : Optional[str]
+            the chunk's sha256 hex digest, if the sender gave one.
+
+        Returns
+        -------
+        Tuple[bool, str]
+            (True, sha256 hex digest of the chunk) on success.
+            (False, 'error_msg') on failure.
 
-        c.execute('SELECT name FROM files WHERE file_id=?',
-                  (file_id,))
+        """
+        upload = self._get_upload(email, upload_id)
+        if upload is None:
+            return False, 'Upload does not exist.'
 
-        name = c.fetchone()
+        _, _, size, chunk_size, _ = upload
+        expected = min(chunk_size, size - n * chunk_size)
 
-        if name is None:
-            return False, 'That file doesn\'t exist!'
+        if n < 0 or expected <= 0:
+            return False, 'No such chunk.'
 
-        db.close()
+        if length != expected:
+            return False, f'Chunk {n} must be {expected} bytes.'
 
-        return True, name[0]
+        try:
+            return True, self.uploads.write_chunk(upload_id, n, stream,
+                                                  length, sha256)
+        except ValueError as e:
+            return False, str(e)
 
-    def is_teacher(self, email: str) -> bool:
+    def finish_upload(self, email: str, upload_id: str) -> Tuple[bool, str]:
         """
-        Check if email is associated with a teacher.
+        Turn a fully received upload into a file.
+
+        The upload is read back piece by piece into the blob store, so
+        memory use doesn't depend on the file's size.
 
         Parameters
         ----------
         email : str
-            the email.
+            email of member uploading the file.
+        upload_id : str
+            the upload id.
 
         Returns
         -------
-        bool
-            True if teacher.
-            False otherwise.
+        Tuple[bool, str]
+            (True, file_id) on success.
+            (False, 'error_msg') on failure.
 
         """
+        upload = self._get_upload(email, upload_id)
+        if upload is None:
+            return False, 'Upload does not exist.'
 
-        db = sqlite3.connect(self.db_filename)
-        c = db.cursor()
+        project_id, name, size, chunk_size, sha256 = upload
+        count = -(-size // chunk_size)
 
-        c.execute('SELECT is_teacher FROM users WHERE email=?',
-                  (email,))
+        missing = sorted(set(range(count))
+                         - set(self.uploads.received(upload_id)))
+        if missing:
+            return False, ('Chunks still missing: '
+                           + ', '.join(str(n) for n in missing[:10])
+                           + (' and more.' if len(missing) > 10 else '.'))
 
-        teacher = c.fetchone()
+        digest = hashlib.sha256()
+        chunks = []
+        for piece in self.uploads.pieces(upload_id, count):
+            digest.update(piece)
+            chunks.append(self.blobs.put(piece))
 
-        if teacher is None:
-            return False
+        if sha256 is not None and digest.hexdigest() != sha256.lower():
+            return False, 'The upload doesn\'t match its checksum.'
 
-        else:
-            return bool(teacher[0])
+        created, result = self._insert_file(
+            email, project_id, name, chunks,
+            functools.partial(self.uploads.read_piece, upload_id), upload_id)
 
-    def is_admin(self, email: str, project_id: str) -> bool:
+        if created:
+            self.uploads.delete(upload_id)
+
+        return created, result
+
+    def expire_uploads(self, max_age: float) -> int:
         """
-        Check if email is admin for given project.
+        Delete uploads started more than max_age seconds ago.
+
+        Also deletes chunks left on disk by uploads that are gone, such as
+        ones whose project was deleted.
 
         Parameters
         ----------
-        email : str
-            the email.
-        project_id : str
-            the project.
+        max_age : float
+            the age in seconds.
 
         Returns
         -------
-        bool
-            True if so.
-            False otherwise.
+        int
+            number of uploads deleted.
 
         """
-        db = sqlite3.connect(self.db_filename)
-        c = db.cursor()
+        with self.connections.cursor() as c:
+            c.execute('DELETE FROM uploads WHERE created_at<?',
+                      (time.time() - max_age,))
 
-        c.execute('SELECT email FROM admins WHERE project_id=?',
-                  (project_id,))
+            expired = c.rowcount
 
-        admin = c.fetchone()
+            c.execute('SELECT upload_id FROM uploads')
 
-        if admin is None:
-            return False
+            live = {x[0] for x in c.fetchall()}
 
-        return admin[0] == email
+        for upload_id in self.uploads.all_ids() - live:
+            self.uploads.delete(upload_id)
 
-    def is_member(self, email: str, project_id: str) -> bool:
+        return expired
+
+    def write_file(self, email: str, file_id: str,
+                   contents: bytes) -> Tuple[bool, str]:
         """
-        Check if email is project member.
+        Replace the contents of a file.
 
         Parameters
         ----------
         email : str
-            the email.
-        project_id : str
-            the project.
+            email of member writing the file.
+        file_id : str
+            the file id.
+        contents : bytes
+            the new contents.
+
+        Returns
+        -------
+        Tuple[bool, str]
+            (True, '') on success.
+            (False, 'error_msg') on failure.
+
+        """
+        exists, project_id = self.get_file_project(file_id)
+        if not exists:
+            return False, project_id
+
+        if not self.is_member(email, project_id):
+            return False, 'You don\'t have permission to do that.'
+
+        self.save_file_contents(file_id, contents, email=email)
+
+        return True, ''
+
+    def save_file_contents(self, file_id: str, contents: bytes,
+                           rev: Optional[int] = None,
+                           email: Optional[str] = None,
+                           editors: Optional[Dict[str, int]] = None) -> bool:
+        """
+        Replace the contents of a file without checking permissions.
+
+        Without rev, the contents replace the file outright: its edit log is
+        dropped and its revision moves on, so a live document of the file
+        must be discarded. With rev, they are a snapshot of the live document
+        at that revision, see save_snapshot.
+
+        Parameters
+        ----------
+        file_id : str
+            the file id.
+        contents : bytes
+            the new contents.
+        rev : Optional[int]
+            the live document's revision the contents are a snapshot of.
+        email : Optional[str]
+            who wrote the contents, recorded in the file's history.
+        editors : Optional[Dict[str, int]]
+            see _set_chunks.
 
         Returns
         -------
         bool
-            True if so.
-            False otherwise.
+            True if the file was saved.
+            False if it doesn't exist, or already has a newer snapshot.
 
         """
-        db = sqlite3.connect(self.db_filename)
-        c = db.cursor()
+        if rev is None:
+            self.edit_log.delete(file_id)
 
-        c.execute('SELECT email FROM members WHERE email=? AND project_id=?',
-                  (email, project_id))
+        chunks = self.blobs.put_all(contents)
+        # Diffing can take a while, so it's done before the write lock
+        pending = self._prepare_version(file_id, contents)
 
-        member = c.fetchone()
+        with self.connections.cursor() as c:
+            c.execute('BEGIN IMMEDIATE')
+            saved = self._set_chunks(c, file_id, chunks,
+                                     self._reread(contents), rev, email,
+                                     editors, pending)
 
-        if member is None:
-            return False
+        # The old contents may have been the last reference to some chunks
+        self.collect_garbage()
+
+        return saved
 
-        return member[0] == email
+    def _reread(self, contents: bytes) -> Callable[[int], memoryview]:
+        """Get a reread for _set_chunks of contents stored with put_all."""
+        view, size = memoryview(contents), self.blobs.chunk_size
+        return lambda seq: view[seq * size:(seq + 1) * size]
+
+    def _prepare_version(self, file_id: str, contents: bytes
+                         ) -> Optional[Tuple[int, Optional[Tuple]]]:
+        """
+        Make a file's next version from the contents replacing its current
+        ones, without holding the write lock.
+
+        Parameters
+        ----------
+        file_id : str
+            the file id.
+        contents : bytes
+            the new contents.
+
+        Returns
+        -------
+        Optional[Tuple[int, Optional[Tuple]]]
+            (rev, version) for _set_chunks: the file's revision the version
+            was made against, and the version from VersionHistory.prepare.
+            None if the file doesn't exist, can't be read, or the contents
+            are too large for its history.
+
+        """
+        if len(contents) > self.history.max_bytes:
+            return None
+
+        with self.connections.cursor() as c:
+            last = self.history.last(c, file_id)
+
+        try:
+            # One statement, so the revision matches the chunks
+            rows, chunks = self._read_chunks(
+                file_id,
+                'SELECT files.rev, files.size, file_chunks.hash FROM files '
+                'LEFT JOIN file_chunks USING(file_id) '
+                'WHERE files.file_id=? ORDER BY file_chunks.seq')
+        except FileNotFoundError:
+            return None
+
+        if not rows:
+            return None
+
+        rev, size = rows[0][:2]
+        old = b''.join(chunks) if size <= self.history.max_bytes else None
+
+        return rev, self.history.prepare(last, old, contents)
+
+    def _set_chunks(self, c: sqlite3.Cursor, file_id: str,
+                    chunks: List[Tuple[str, int]],
+                    reread: Callable[[int], bytes],
+                    rev: Optional[int] = None,
+                    email: Optional[str] = None,
+                    editors: Optional[Dict[str, int]] = None,
+                    pending: Optional[Tuple[int, Optional[Tuple]]] = None
+                    ) -> bool:
+        """
+        Point a file at already stored chunks, inside the caller's transaction.
+
+        The contents are recorded as the file's next version, unless they're
+        too large for its history. The version is pending if the file is
+        still at the revision it was made against, otherwise a keyframe.
+
+        Parameters
+        ----------
+        c : sqlite3.Cursor
+            cursor in a transaction.
+        file_id : str
+            the file id.
+        chunks : List[Tuple[str, int]]
+            [(sha256 hex digest, size), ...] of the contents, in order.
+        reread : Callable[[int], bytes]
+            gets chunk number seq's data again, should it need storing again.
+        rev : Optional[int]
+            revision the contents are a snapshot of, the file's next
+            revision if None.
+        email : Optional[str]
+            who wrote the contents, None for live edits.
+        editors : Optional[Dict[str, int]]
+            {email: number of edits, ...} the contents are made of, added to
+            the activity counters. One edit by email if None.
+        pending : Optional[Tuple[int, Optional[Tuple]]]
+            see _prepare_version.
+
+        Returns
+        -------
+        bool
+            True if the file's chunks were set.
+            False if the file doesn't exist, or is already past rev.
+
+        """
+        c.execute('SELECT rev FROM files WHERE file_id=?', (file_id,))
+
+        before = c.fetchone()
+
+        # Writing first takes the database write lock, which collect_garbage
+        # holds while deleting chunks. Any chunk it deleted after it was
+        # stored is written again below.
+        size = sum(x[1] for x in chunks)
+        if rev is None:
+            c.execute('UPDATE files SET size=?, rev=rev+1 WHERE file_id=?',
+                      (size, file_id))
+        else:
+            c.execute('UPDATE files SET size=?, rev=? '
+                      'WHERE file_id=? AND rev<?',
+                      (size, rev, file_id, rev))
+        if c.rowcount == 0:
+            return False
+
+        if editors is None:
+            editors = {} if email is None else {email: 1}
+        self._count_edits(c, file_id, editors)
+
+        c.execute('DELETE FROM file_chunks WHERE file_id=?', (file_id,))
+
+        for seq, (digest, _) in enumerate(chunks):
+            if not self.blobs.exists(digest):
+                self.blobs.put(reread(seq))
+
+        c.executemany('INSERT INTO chunks(hash, size) VALUES(?,?) '
+                      'ON CONFLICT(hash) DO NOTHING', chunks)
+        c.executemany('INSERT INTO file_chunks(file_id, seq, hash) '
+                      'VALUES(?,?,?)',
+                      ((file_id, seq, digest)
+                       for seq, (digest, _) in enumerate(chunks)))
+
+        self._index_file(c, file_id, [reread(seq) for seq in range(
+            min(len(chunks), -(-SEARCH_MAX_BYTES // self.blobs.chunk_size)))])
+
+        if size > self.history.max_bytes:
+            return True
+
+        new = b''.join(reread(seq) for seq in range(len(chunks)))
+        if pending is None or pending[0] != before[0]:
+            self.history.record(c, file_id, new, email)
+        elif pending[1] is not None:
+            self.history.record(c, file_id, new, email, pending[1])
+
+        return True
+
+    def _count_edits(self, c: sqlite3.Cursor, file_id: str,
+                     editors: Dict[str, int]) -> None:
+        """
+        Add edits to a file's project's activity counters and its editors',
+        inside the caller's transaction.
+        """
+        if not editors:
+            return
+
+        now = time.time()
+        c.execute('UPDATE project_stats SET edits=edits+?, last_active=? '
+                  'WHERE project_id=('
+                  '    SELECT project_id FROM files WHERE file_id=?)',
+                  (sum(editors.values()), now, file_id))
+        c.executemany('INSERT INTO member_stats(project_id, email, edits, '
+                      '                         last_active) '
+                      'SELECT project_id, ?, ?, ? FROM files '
+                      'WHERE file_id=? '
+                      'ON CONFLICT(project_id, email) DO UPDATE SET '
+                      '    edits=edits+excluded.edits, '
+                      '    last_active=excluded.last_active',
+                      ((email, edits, now, file_id)
+                       for email, edits in editors.items()))
+
+    def _index_file(self, c: sqlite3.Cursor, file_id: str,
+                    head: List[bytes]) -> None:
+        """
+        Update a file's search text, inside the caller's transaction.
+
+        Only the first SEARCH_MAX_BYTES are indexed, and only the name of a
+        file that looks binary.
+
+        Parameters
+        ----------
+        c : sqlite3.Cursor
+            cursor in a transaction.
+        file_id : str
+            the file id.
+        head : List[bytes]
+            chunks from the start of the contents.
+
+        Returns
+        -------
+        None
+
+        """
+        data = b''.join(head)[:SEARCH_MAX_BYTES]
+        body = '' if b'\0' in data else data.decode('utf-8', 'ignore')
+        body = body.replace(MATCH_START, '').replace(MATCH_END, '')
+
+        c.execute('INSERT INTO file_text(file_id, project_id, name, body) '
+                  'SELECT file_id, project_id, name, ? FROM files '
+                  'WHERE file_id=? '
+                  'ON CONFLICT(file_id) DO UPDATE SET body=excluded.body',
+                  (body, file_id))
+
+    def search(self, email: str, query: str, limit: int = 20
+               ) -> Tuple[Tuple[str, str, str, str, str], ...]:
+        """
+        Search the names and contents of files in email's projects.
+
+        Parameters
+        ----------
+        email : str
+            the email of the user searching.
+        query : str
+            the words to look for, as typed.
+        limit : int
+            most results to return.
+
+        Returns
+        -------
+        Tuple[Tuple[str, str, str, str, str], ...]
+            ((file_id, file name, project_id, project name, snippet), ...),
+            best match first. Matches in snippets are wrapped in
+            MATCH_START and MATCH_END.
+
+        """
+        with self.connections.cursor() as c:
+            c.execute('SELECT project_id FROM members WHERE email=?',
+                      (email,))
+
+            # Narrowing the index to these is what keeps common words fast;
+            # the join below is still what enforces membership
+            match = match_query(query, [x[0] for x in c.fetchall()])
+            if not match:
+                return ()
+
+            c.execute('SELECT file_text.file_id, file_text.name, '
+                      'projects.project_id, projects.name, '
+                      'snippet(file_search, 1, ?, ?, \'…\', 12) '
+                      'FROM file_search '
+                      'JOIN file_text ON file_text.id=file_search.rowid '
+                      'JOIN members '
+                      'ON members.project_id=file_text.project_id '
+                      'AND members.email=? '
+                      'JOIN projects '
+                      'ON projects.project_id=members.project_id '
+                      'WHERE file_search MATCH ? '
+                      'ORDER BY rank LIMIT ?',
+                      (MATCH_START, MATCH_END, email, match, limit))
+
+            return tuple(c.fetchall())
+
+    def rebuild_search_index(self) -> int:
+        """
+        Index every file's stored contents from scratch.
+
+        Returns
+        -------
+        int
+            number of files indexed.
+
+        """
+        with self.connections.cursor() as c:
+            c.execute('SELECT file_id FROM files')
+
+            file_ids = [x[0] for x in c.fetchall()]
+
+        for file_id in file_ids:
+            head, size = [], 0
+            for chunk in self.get_file_contents(file_id):
+                if size >= SEARCH_MAX_BYTES:
+                    break
+                head.append(chunk)
+                size += len(chunk)
+
+            with self.connections.cursor() as c:
+                self._index_file(c, file_id, head)
+
+        return len(file_ids)
+
+    def rebuild_stats(self) -> int:
+        """
+        Recompute the dashboard's counters from the tables they count, in
+        case they drifted, e.g. from rows changed by hand.
+
+        Edits and last activity aren't recorded anywhere else, so they are
+        kept as they are.
+
+        Returns
+        -------
+        int
+            number of project and member counters that were wrong or
+            missing.
+
+        """
+        with self.connections.cursor() as c:
+            c.execute('BEGIN IMMEDIATE')
+            c.execute('INSERT INTO project_stats(project_id, members, files, '
+                      '                          bytes) '
+                      'SELECT project_id, '
+                      '       (SELECT count(*) FROM members '
+                      '        WHERE members.project_id=projects.project_id), '
+                      '       (SELECT count(*) FROM files '
+                      '        WHERE files.project_id=projects.project_id), '
+                      '       (SELECT COALESCE(SUM(size), 0) FROM files '
+                      '        WHERE files.project_id=projects.project_id) '
+                      'FROM projects WHERE true '
+                      'ON CONFLICT(project_id) DO UPDATE SET '
+                      '    members=excluded.members, files=excluded.files, '
+                      '    bytes=excluded.bytes '
+                      'WHERE members!=excluded.members '
+                      '      OR files!=excluded.files '
+                      '      OR bytes!=excluded.bytes')
+
+            repaired = c.rowcount
+
+            c.execute('INSERT INTO member_stats(project_id, email) '
+                      'SELECT project_id, email FROM members '
+                      'WHERE email IS NOT NULL '
+                      'ON CONFLICT(project_id, email) DO NOTHING')
+
+            repaired += c.rowcount
+
+            c.execute('INSERT INTO member_stats(project_id, email, files) '
+                      'SELECT project_id, created_by, count(*) FROM files '
+                      'WHERE created_by IS NOT NULL '
+                      'GROUP BY project_id, created_by '
+                      'ON CONFLICT(project_id, email) DO UPDATE SET '
+                      '    files=excluded.files '
+                      'WHERE files!=excluded.files')
+
+            repaired += c.rowcount
+
+            # Members with no files left, whom the counts above skip
+            c.execute('UPDATE member_stats SET files=0 '
+                      'WHERE files!=0 AND NOT EXISTS ('
+                      '    SELECT 1 FROM files '
+                      '    WHERE files.project_id=member_stats.project_id '
+                      '          AND files.created_by=member_stats.email)')
+
+            repaired += c.rowcount
+
+        return repaired
+
+    def read_file(self, email: str, file_id: str
+                  ) -> Tuple[bool, Union[str, Tuple[memoryview, ...]]]:
+        """
+        Read the contents of a file.
+
+        Parameters
+        ----------
+        email : str
+            email of member reading the file.
+        file_id : str
+            the file id.
+
+        Returns
+        -------
+        Tuple[bool, Union[str, Tuple[memoryview, ...]]]
+            (True, (chunk, ...)) on success, each chunk a memory-mapped view.
+            (False, 'error_msg') on failure.
+
+        """
+        exists, project_id = self.get_file_project(file_id)
+        if not exists:
+            return False, project_id
+
+        if not self.is_member(email, project_id):
+            return False, 'You don\'t have permission to do that.'
+
+        try:
+            return True, self.get_file_contents(file_id)
+        except FileNotFoundError:
+            return False, 'This file could not be read.'
+
+    def _read_chunks(self, file_id: str, sql: str
+                     ) -> Tuple[List[Tuple], Tuple[memoryview, ...]]:
+        """
+        Map a file's chunks, rereading the chunk list if the file is
+        rewritten while they are mapped.
+
+        A mapping stays readable after its chunk is deleted, so once every
+        chunk is mapped the contents are safe. A chunk can go missing if the
+        file was rewritten since the query, in which case the chunk list
+        changed and is read again. If it didn't, the chunk is lost.
+
+        Parameters
+        ----------
+        file_id : str
+            the file id.
+        sql : str
+            query taking the file id, selecting rows in order whose last
+            column is a chunk's digest, or NULL for no chunk.
+
+        Returns
+        -------
+        Tuple[List[Tuple], Tuple[memoryview, ...]]
+            (rows, (chunk, ...)).
+
+        Raises
+        ------
+        FileNotFoundError
+            if a chunk is missing though the chunk list is unchanged, or
+            the file was rewritten during each of READ_ATTEMPTS reads.
+
+        """
+        previous = None
+        for _ in range(READ_ATTEMPTS):
+            with self.connections.cursor() as c:
+                c.execute(sql, (file_id,))
+
+                rows = c.fetchall()
+
+            if rows == previous:
+                break
+            previous = rows
+
+            try:
+                return rows, tuple(self.blobs.read(x[-1] for x in rows
+                                                   if x[-1]))
+            except FileNotFoundError:
+                continue
+
+        raise FileNotFoundError(f'A chunk of file {file_id} is missing.')
+
+    def get_file_contents(self, file_id: str) -> Tuple[memoryview, ...]:
+        """
+        Read the contents of a file without checking permissions.
+
+        Parameters
+        ----------
+        file_id : str
+            the file id.
+
+        Returns
+        -------
+        Tuple[memoryview, ...]
+            (chunk, ...), each a memory-mapped view.
+
+        Raises
+        ------
+        FileNotFoundError
+            if a chunk is missing from the blob store.
+
+        """
+        return self._read_chunks(file_id,
+                                 'SELECT hash FROM file_chunks '
+                                 'WHERE file_id=? ORDER BY seq')[1]
+
+    def get_live_contents(self, file_id: str
+                          ) -> Tuple[Union[bytes, memoryview], ...]:
+        """
+        Read a file including live edits not yet in a snapshot.
+
+        Parameters
+        ----------
+        file_id : str
+            the file id.
+
+        Returns
+        -------
+        Tuple[Union[bytes, memoryview], ...]
+            (chunk, ...).
+
+        Raises
+        ------
+        FileNotFoundError
+            if a chunk is missing from the blob store.
+
+        """
+        # Only files that have been edited live have a log
+        if self.edit_log.has_log(file_id):
+            return (self.load_file(file_id)[1].encode(),)
+
+        return self.get_file_contents(file_id)
+
+    def load_file(self, file_id: str) -> Tuple[int, str]:
+        """
+        Load a file's live text: its latest snapshot plus its logged edits.
+
+        Parameters
+        ----------
+        file_id : str
+            the file id.
+
+        Returns
+        -------
+        Tuple[int, str]
+            (revision, text).
+
+        Raises
+        ------
+        UnicodeDecodeError
+            if the file is not UTF-8 text.
+        FileNotFoundError
+            if a chunk is missing from the blob store.
+
+        """
+        # One statement, so the revision matches the chunks
+        rows, chunks = self._read_chunks(
+            file_id,
+            'SELECT files.rev, file_chunks.hash FROM files '
+            'LEFT JOIN file_chunks USING(file_id) '
+            'WHERE files.file_id=? ORDER BY file_chunks.seq')
+
+        rev = rows[0][0] if rows else 0
+        text = b''.join(chunks).decode()
+
+        for rev, ops in self.edit_log.replay(file_id, rev):
+            text = collab.apply(text, ops)
+
+        return rev, text
+
+    def log_edit(self, file_id: str, rev: int,
+                 ops: List[Dict[str, Any]]) -> bool:
+        """
+        Durably record an edit to a file before it is acknowledged.
+
+        Parameters
+        ----------
+        file_id : str
+            the file id.
+        rev : int
+            the revision the edit produced.
+        ops : List[Dict[str, Any]]
+            the edit.
+
+        Returns
+        -------
+        bool
+            True if save_snapshot is now due.
+            False otherwise.
+
+        """
+        return self.edit_log.append(file_id, rev, ops)
+
+    def save_snapshot(self, file_id: str, rev: int, text: str,
+                      editors: Optional[Dict[str, int]] = None) -> bool:
+        """
+        Store a file's live text as of rev, so the log before it can go.
+
+        Parameters
+        ----------
+        file_id : str
+            the file id.
+        rev : int
+            the revision of text.
+        text : str
+            the live text.
+        editors : Optional[Dict[str, int]]
+            {email: number of edits, ...} made since the last snapshot,
+            added to the activity counters. None if unknown.
+
+        Returns
+        -------
+        bool
+            True if the snapshot was stored.
+            False if the file doesn't exist, or has a newer snapshot.
+
+        """
+        saved = self.save_file_contents(file_id, text.encode(), rev,
+                                        editors=editors)
+        if saved:
+            self.edit_log.snapshotted(file_id, rev)
+
+        return saved
+
+    def get_file_versions(self, email: str, file_id: str
+                          ) -> Tuple[bool, Union[str, List[Tuple[
+                              int, int, float, Optional[str]]]]]:
+        """
+        List the versions kept of a file.
+
+        Parameters
+        ----------
+        email : str
+            email of member reading the history.
+        file_id : str
+            the file id.
+
+        Returns
+        -------
+        Tuple[bool, Union[str, List[Tuple[int, int, float, Optional[str]]]]]
+            (True, [(version, size, created_at, created_by), ...]) on
+            success, newest first, created_by None for live edits.
+            (False, 'error_msg') on failure.
+
+        """
+        exists, project_id = self.get_file_project(file_id)
+        if not exists:
+            return False, project_id
+
+        if not self.is_member(email, project_id):
+            return False, 'You don\'t have permission to do that.'
+
+        with self.connections.cursor() as c:
+            return True, self.history.versions(c, file_id)
+
+    def get_file_version(self, email: str, file_id: str,
+                         version: int) -> Tuple[bool, Union[str, bytes]]:
+        """
+        Read a version of a file.
+
+        Parameters
+        ----------
+        email : str
+            email of member reading the version.
+        file_id : str
+            the file id.
+        version : int
+            the version.
+
+        Returns
+        -------
+        Tuple[bool, Union[str, bytes]]
+            (True, contents) on success.
+            (False, 'error_msg') on failure.
+
+        """
+        exists, project_id = self.get_file_project(file_id)
+        if not exists:
+            return False, project_id
+
+        if not self.is_member(email, project_id):
+            return False, 'You don\'t have permission to do that.'
+
+        with self.connections.cursor() as c:
+            contents = self.history.get(c, file_id, version)
+
+        if contents is None:
+            return False, 'That version is no longer kept.'
+
+        return True, contents
+
+    def prune_history(self) -> int:
+        """
+        Apply the history's retention policy to every file, e.g. after
+        making it stricter. Writing a file already prunes its history.
+
+        Returns
+        -------
+        int
+            number of versions deleted.
+
+        """
+        with self.connections.cursor() as c:
+            c.execute('SELECT DISTINCT file_id FROM file_versions')
+
+            file_ids = [x[0] for x in c.fetchall()]
+
+        pruned = 0
+        for file_id in file_ids:
+            with self.connections.cursor() as c:
+                pruned += self.history.prune(c, file_id)
+
+        return pruned
+
+    def delete_file(self, email: str, file_id: str) -> Tuple[bool, str]:
+        """
+        Attempt to delete file.
+
+        Parameters
+        ----------
+        email : str
+            email of member deleting the file.
+        file_id : str
+            the file id.
+
+        Returns
+        -------
+        Tuple[bool, str]
+            (True, '') upon successful deletion.
+            (False, 'error_msg') otherwise.
+
+        """
+        exists, project_id = self.get_file_project(file_id)
+        if not exists:
+            return False, project_id
+
+        if not self.is_member(email, project_id):
+            return False, 'You don\'t have permission to do that.'
+
+        with self.connections.cursor() as c:
+            # Its chunk list and version history go with it by cascade
+            c.execute('DELETE FROM files WHERE file_id=?', (file_id,))
+
+        self.edit_log.delete(file_id)
+        self.events.publish(project_topic(project_id),
+                            {'type': 'file_deleted', 'file_id': file_id})
+        self.collect_garbage()
+
+        return True, ''
+
+    def collect_garbage(self, sweep: bool = False) -> int:
+        """
+        Delete chunks no file references any more.
+
+        Parameters
+        ----------
+        sweep : bool
+            also delete chunk files with no chunks row at all, such as ones
+            left behind by a crash between storing and committing.
+
+        Returns
+        -------
+        int
+            number of chunks deleted.
+
+        """
+        on_disk = self.blobs.all_digests() if sweep else set()
+
+        with self.connections.cursor() as c:
+            c.execute('BEGIN IMMEDIATE')
+            c.execute('DELETE FROM chunks WHERE refcount <= 0 RETURNING hash')
+
+            digests = {x[0] for x in c.fetchall()}
+
+            if sweep:
+                c.execute('SELECT hash FROM chunks')
+                digests |= on_disk - {x[0] for x in c.fetchall()}
+
+            self.blobs.remove(digests)
+
+        return len(digests)
+
+    def get_files(self, email: str, project_id: str) -> Tuple[str, ...]:
+        """
+        Get file_ids of files in project.
+
+        Parameters
+        ----------
+        email : str
+            the email of the user.
+        project_id : str
+            the project id.
+
+        Returns
+        -------
+        Tuple[str, ...]
+            [file_id, ...]
+
+        """
+        with self.connections.cursor() as c:
+            c.execute('SELECT file_id FROM files WHERE project_id=?',
+                      (project_id,))
+
+            return tuple(x[0] for x in c.fetchall())
+
+    def get_file_project(self, file_id: str) -> Tuple[bool, str]:
+        """
+        Get the project a file belongs to.
+
+        Parameters
+        ----------
+        file_id : str
+            the id.
+
+        Returns
+        -------
+        Tuple[bool, str]
+            (True, 'project_id') on success.
+            (False, 'error_msg') on failure.
+
+        """
+        with self.connections.cursor() as c:
+            c.execute('SELECT project_id FROM files WHERE file_id=?',
+                      (file_id,))
+
+            project_id = c.fetchone()
+
+        if project_id is None:
+            return False, 'That file doesn\'t exist!'
+
+        return True, project_id[0]
+
+    def get_file_name(self, file_id: str) -> Tuple[bool, str]:
+        """
+        Get name of file with given id.
+
+        Parameters
+        ----------
+        file_id : str
+            the id.
+
+        Returns
+        -------
+        Tuple[bool, str]
+            (True, 'file name') on success.
+            (False, 'error_msg') on failure.
+
+        """
+        with self.connections.cursor() as c:
+            c.execute('SELECT name FROM files WHERE file_id=?',
+                      (file_id,))
+
+            name = c.fetchone()
+
+        if name is None:
+            return False, 'That file doesn\'t exist!'
+
+        return True, name[0]
+
+    def is_teacher(self, email: str) -> bool:
+        """
+        Check if email is associated with a teacher.
+
+        Parameters
+        ----------
+        email : str
+            the email.
+
+        Returns
+        -------
+        bool
+            True if teacher.
+            False otherwise.
+
+        """
+        # Read first, so a revocation during the query isn't undone
+        generation = self.auth_cache.generation
+        hit, teacher = self.auth_cache.get(('teacher', email))
+        if hit:
+            return teacher
+
+        with self.connections.cursor() as c:
+            c.execute('SELECT is_teacher FROM users WHERE email=?',
+                      (email,))
+
+            row = c.fetchone()
+
+        teacher = row is not None and bool(row[0])
+        self.auth_cache.set(('teacher', email), teacher, generation)
+
+        return teacher
+
+    def is_admin(self, email: str, project_id: str) -> bool:
+        """
+        Check if email is admin for given project.
+
+        Parameters
+        ----------
+        email : str
+            the email.
+        project_id : str
+            the project.
+
+        Returns
+        -------
+        bool
+            True if so.
+            False otherwise.
+
+        """
+        generation = self.auth_cache.generation
+        hit, admin = self.auth_cache.get(('admin', email, project_id))
+        if hit:
+            return admin
+
+        with self.connections.cursor() as c:
+            c.execute('SELECT email FROM admins WHERE project_id=?',
+                      (project_id,))
+
+            row = c.fetchone()
+
+        admin = row is not None and row[0] == email
+        self.auth_cache.set(('admin', email, project_id), admin, generation)
+
+        return admin
+
+    def is_member(self, email: str, project_id: str) -> bool:
+        """
+        Check if email is project member.
+
+        Parameters
+        ----------
+        email : str
+            the email.
+        project_id : str
+            the project.
+
+        Returns
+        -------
+        bool
+            True if so.
+            False otherwise.
+
+        """
+        generation = self.auth_cache.generation
+        hit, member = self.auth_cache.get(('member', email, project_id))
+        if hit:
+            return member
+
+        with self.connections.cursor() as c:
+            c.execute('SELECT email FROM members '
+                      'WHERE email=? AND project_id=?',
+                      (email, project_id))
+
+            row = c.fetchone()
+
+        member = row is not None and row[0] == email
+        self.auth_cache.set(('member', email, project_id), member, generation)
+
+        return member
+
+    def get_versions(self, email: str, project_id: Optional[str] = None
+                     ) -> Tuple[int, int]:
+        """
+        Get the version counters of a user and a project.
+
+        Each goes up whenever what the projects page or the project page
+        shows changes; the triggers from migration 0009 bump them. Reading
+        them never touches the tables they describe.
+
+        Parameters
+        ----------
+        email : str
+            the email.
+        project_id : Optional[str]
+            the project, None for just the user's.
+
+        Returns
+        -------
+        Tuple[int, int]
+            (user version, project version), 0 for either that has none.
+
+        """
+        with self.connections.cursor() as c:
+            c.execute('SELECT '
+                      '(SELECT version FROM user_versions WHERE email=?), '
+                      '(SELECT version FROM project_versions '
+                      ' WHERE project_id=?)',
+                      (email, project_id))
+
+            user, project = c.fetchone()
+
+        return user or 0, project or 0
+
+    def forget_project(self, project_id: str) -> None:
+        """
+        Drop every cached authorization check for a project.
+
+        Parameters
+        ----------
+        project_id : str
+            the project.
+
+        Returns
+        -------
+        None
+
+        """
+        self.auth_cache.discard_if(lambda key: key[-1] == project_id)
@@ -0,0 +1,282 @@
+"""
+PeerColab
+
+Python file facilitating append-only edit logs for live files
+
+Each file's edits are appended to log segments under root/<file_id>/, named
+log-<first revision>. A record is a 4-byte length, a 4-byte CRC32 and a JSON
+[revision, edit] payload, so a torn write at the end of a segment is detected
+and cut off on the next load. Snapshots of the full text are stored by the
+caller; once one covers a segment, the compactor deletes it.
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from typing import Any, Dict, Iterator, List, Tuple
+import json
+import os
+import shutil
+import struct
+import threading
+import time
+import zlib
+
+HEADER = struct.Struct('<II')
+PREFIX = 'log-'
+
+
+class EditLog:
+
+    def __init__(self, root: str, snapshot_ops: int = 500,
+                 snapshot_bytes: int = 256 * 1024, fsync: bool = True,
+                 compact_seconds: float = 30) -> None:
+        """
+        Initialize EditLog class.
+
+        Parameters
+        ----------
+        root : str
+            directory holding every file's log.
+        snapshot_ops : int
+            edits logged since the last snapshot before another is due.
+        snapshot_bytes : int
+            bytes logged since the last snapshot before another is due.
+        fsync : bool
+            whether each append is flushed to disk before returning.
+        compact_seconds : float
+            how often the background compactor runs.
+
+        Returns
+        -------
+        None
+
+        """
+        self.root = root
+        self.snapshot_ops = snapshot_ops
+        self.snapshot_bytes = snapshot_bytes
+        self.fsync = fsync
+        self.compact_seconds = compact_seconds
+
+        # file_id -> [edits, bytes] logged since the last snapshot
+        self._pending = {}
+        # file_id -> revision of the newest snapshot not yet compacted
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._compactor = None
+
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, file_id: str) -> str:
+        """Get the directory of a file's log."""
+        return os.path.join(self.root, file_id)
+
+    def _segments(self, file_id: str) -> List[Tuple[int, str]]:
+        """Get [(first revision, path), ...] of a file's segments, in order."""
+        directory = self._dir(file_id)
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        return sorted((int(name[len(PREFIX):]), os.path.join(directory, name))
+                      for name in names if name.startswith(PREFIX))
+
+    def append(self, file_id: str, rev: int, ops: List[Dict[str, Any]]) -> bool:
+        """
+        Append an edit to a file's log.
+
+        Calls for a file must come in revision order. After a snapshot the
+        next append starts a new segment, so the old ones can be compacted.
+
+        Parameters
+        ----------
+        file_id : str
+            the file id.
+        rev : int
+            the revision the edit produced.
+        ops : List[Dict[str, Any]]
+            the edit.
+
+        Returns
+        -------
+        bool
+            True if a snapshot is now due.
+            False otherwise.
+
+        """
+        payload = json.dumps([rev, ops], separators=(',', ':')).encode()
+        record = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self._lock:
+            pending = self._pending.setdefault(file_id, [0, 0])
+            segments = self._segments(file_id)
+            if pending[0] == 0 or not segments:
+                os.makedirs(self._dir(file_id), exist_ok=True)
+                path = os.path.join(self._dir(file_id), f'{PREFIX}{rev:012d}')
+            else:
+                path = segments[-1][1]
+            pending[0] += 1
+            pending[1] += len(record)
+            due = pending[0] >= self.snapshot_ops \
+                or pending[1] >= self.snapshot_bytes
+
+        with open(path, 'ab') as f:
+            f.write(record)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+        return due
+
+    def _records(self, path: str) -> Iterator[Tuple[int, list]]:
+        """
+        Read a segment's records, cutting off a torn or corrupt tail.
+
+        Yields
+        ------
+        Tuple[int, list]
+            (revision, edit) for each intact record.
+
+        """
+        with open(path, 'r+b') as f:
+            data = f.read()
+            offset = 0
+            while offset + HEADER.size <= len(data):
+                length, crc = HEADER.unpack_from(data, offset)
+                payload = data[offset + HEADER.size:
+                               offset + HEADER.size + length]
+                if len(payload) != length or zlib.crc32(payload) != crc:
+                    break
+                rev, ops = json.loads(payload)
+                yield rev, ops
+                offset += HEADER.size + length
+
+            if offset != len(data):
+                # Left by a crash mid-append; nothing after it was acked
+                f.truncate(offset)
+
+    def replay(self, file_id: str, rev: int) -> List[Tuple[int, list]]:
+        """
+        Get the edits logged after a snapshot.
+
+        Parameters
+        ----------
+        file_id : str
+            the file id.
+        rev : int
+            the snapshot's revision.
+
+        Returns
+        -------
+        List[Tuple[int, list]]
+            [(revision, edit), ...] for revisions rev + 1 onwards, stopping
+            at the first gap.
+
+        """
+        edits, size = [], 0
+        with self._lock:
+            for _, path in self._segments(file_id):
+                for logged_rev, ops in self._records(path):
+                    if logged_rev <= rev:
+                        continue
+                    if logged_rev != rev + len(edits) + 1:
+                        break
+                    edits.append((logged_rev, ops))
+                    size += len(json.dumps(ops))
+
+            self._pending[file_id] = [len(edits), size]
+            self._snapshots[file_id] = rev
+
+        return edits
+
+    def snapshotted(self, file_id: str, rev: int) -> None:
+        """
+        Record that a snapshot now covers every edit up to rev.
+
+        The next append starts a new segment, and the compactor deletes the
+        segments the snapshot covers.
+
+        Parameters
+        ----------
+        file_id : str
+            the file id.
+        rev : int
+            the snapshot's revision.
+
+        Returns
+        -------
+        None
+
+        """
+        with self._lock:
+            self._pending[file_id] = [0, 0]
+            self._snapshots[file_id] = max(rev,
+                                           self._snapshots.get(file_id, rev))
+            if self._compactor is None:
+                self._compactor = threading.Thread(
+                    target=self._compact_forever, daemon=True)
+                self._compactor.start()
+
+    def compact(self) -> int:
+        """
+        Delete segments covered by snapshots.
+
+        A segment is covered once the segment after it starts at or before
+        the revision after the snapshot.
+
+        Returns
+        -------
+        int
+            number of segments deleted.
+
+        """
+        with self._lock:
+            snapshots, self._snapshots = self._snapshots, {}
+
+            deleted = 0
+            for file_id, rev in snapshots.items():
+                segments = self._segments(file_id)
+                for (_, path), (next_first, _) in zip(segments, segments[1:]):
+                    if next_first > rev + 1:
+                        break
+                    os.unlink(path)
+                    deleted += 1
+                # An unfinished newest segment may also be fully covered
+                if segments and self._pending.get(file_id) == [0, 0] \
+                        and self._covered(segments[-1][1], rev):
+                    os.unlink(segments[-1][1])
+                    deleted += 1
+
+        return deleted
+
+    def _covered(self, path: str, rev: int) -> bool:
+        """Check if every record in a segment is at or before rev."""
+        return all(logged_rev <= rev for logged_rev, _ in self._records(path))
+
+    def has_log(self, file_id: str) -> bool:
+        """Check if a file has any log segments."""
+        return bool(self._segments(file_id))
+
+    def delete(self, file_id: str) -> None:
+        """
+        Delete a file's whole log.
+
+        Parameters
+        ----------
+        file_id : str
+            the file id.
+
+        Returns
+        -------
+        None
+
+        """
+        with self._lock:
+            self._pending.pop(file_id, None)
+            self._snapshots.pop(file_id, None)
+            shutil.rmtree(self._dir(file_id), ignore_errors=True)
+
+    def _compact_forever(self) -> None:
+        """Run compact periodically on a daemon thread."""
+        while True:
+            time.sleep(self.compact_seconds)
+            self.compact()
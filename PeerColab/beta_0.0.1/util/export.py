@@ -0,0 +1,92 @@
+"""
+PeerColab
+
+Python file facilitating streaming ZIP archives of projects
+
+The archive is written by zipfile into a sink that can't seek, so each
+entry's sizes and CRC go in a data descriptor after its contents, and
+whatever zipfile has written so far is handed on after every chunk. Nothing
+bigger than one chunk plus zipfile's compression buffer is held at once.
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from typing import Iterable, Iterator, List, Tuple
+import io
+import time
+import zipfile
+
+
+class _Sink(io.RawIOBase):
+    """A write-only stream that keeps what was written until drained."""
+
+    def __init__(self) -> None:
+        self._parts = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> List[bytes]:
+        """Take everything written since the last drain."""
+        parts, self._parts = self._parts, []
+        return parts
+
+
+def entry_name(*parts: str) -> str:
+    """
+    Join names into a path inside an archive, so none can escape it.
+
+    Parameters
+    ----------
+    *parts : str
+        folder and file names, as users typed them.
+
+    Returns
+    -------
+    str
+        the path.
+
+    """
+    cleaned = []
+    for part in parts:
+        part = part.replace('/', '_').replace('\\', '_').strip()
+        cleaned.append('_' if part in ('', '.', '..') else part)
+    return '/'.join(cleaned)
+
+
+def stream_zip(entries: Iterable[Tuple[str, int, Iterable[bytes]]]
+               ) -> Iterator[bytes]:
+    """
+    Build a ZIP archive, yielding it piece by piece as it is written.
+
+    Parameters
+    ----------
+    entries : Iterable[Tuple[str, int, Iterable[bytes]]]
+        (path in the archive, size in bytes, chunks), consumed lazily.
+
+    Yields
+    ------
+    bytes
+        the archive, in order.
+
+    """
+    sink = _Sink()
+    now = time.localtime()[:6]
+
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, size, chunks in entries:
+            info = zipfile.ZipInfo(name, now)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(info, 'w',
+                              force_zip64=size >= zipfile.ZIP64_LIMIT) as f:
+                yield from sink.drain()
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+
+    yield from sink.drain()
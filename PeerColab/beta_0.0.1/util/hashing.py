@@ -0,0 +1,211 @@
+"""
+PeerColab
+
+Python file facilitating password hashing off the request thread
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Iterator, Optional, Sequence, Tuple
+import atexit
+import hmac
+import os
+import threading
+
+from scrypt import scrypt
+
+# py-scrypt's defaults, used for hashes stored before parameters were tracked
+LEGACY_PARAMS = (2 ** 14, 8, 1)
+
+
+class HasherBusy(Exception):
+    """Raised when too many hashes are already running or waiting."""
+
+
+def _scrypt(password: str, salt: str, n: int, r: int, p: int) -> bytes:
+    """Hash in a worker process. Module level so it can be pickled."""
+    return scrypt.hash(password, salt, N=n, r=r, p=p)
+
+
+def format_params(params: Tuple[int, int, int]) -> str:
+    """Format (N, r, p) the way it is stored in users.hash_params."""
+    return ':'.join(str(x) for x in params)
+
+
+def parse_params(params: Optional[str]) -> Tuple[int, int, int]:
+    """Parse users.hash_params, where NULL means LEGACY_PARAMS."""
+    if params is None:
+        return LEGACY_PARAMS
+    n, r, p = (int(x) for x in params.split(':'))
+    return n, r, p
+
+
+class Hasher:
+
+    def __init__(self, n: int = LEGACY_PARAMS[0], r: int = LEGACY_PARAMS[1],
+                 p: int = LEGACY_PARAMS[2], workers: int = 0,
+                 queue_size: int = 0, timeout: float = 10) -> None:
+        """
+        Initialize Hasher class.
+
+        Hashes run on a pool of worker processes so that CPU-bound scrypt
+        work never holds up the threads serving other requests. At most
+        workers + queue_size hashes may be running or waiting at once; past
+        that, callers wait up to timeout seconds for a slot and then get
+        HasherBusy.
+
+        Parameters
+        ----------
+        n : int
+            scrypt CPU/memory cost.
+        r : int
+            scrypt block size.
+        p : int
+            scrypt parallelization.
+        workers : int
+            number of hashing processes, 0 to hash on the calling thread.
+        queue_size : int
+            number of extra hashes allowed to wait for a worker.
+        timeout : float
+            seconds to wait for a slot before raising HasherBusy.
+
+        Returns
+        -------
+        None
+
+        """
+        self.params = (n, r, p)
+        self.workers = workers
+        self.timeout = timeout
+
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_size)
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """
+        Get the worker pool, starting it on first use in this process.
+
+        Returns
+        -------
+        ProcessPoolExecutor
+            the pool.
+
+        """
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pool_pid = os.getpid()
+                atexit.register(self.shutdown)
+            return self._pool
+
+    def hash(self, password: str, salt: str,
+             params: Optional[Tuple[int, int, int]] = None) -> bytes:
+        """
+        Hash a password.
+
+        Parameters
+        ----------
+        password : str
+            the password.
+        salt : str
+            the salt.
+        params : Optional[Tuple[int, int, int]]
+            (N, r, p) to hash with, the configured parameters if None.
+
+        Returns
+        -------
+        bytes
+            the hash.
+
+        Raises
+        ------
+        HasherBusy
+            if no slot frees up within the timeout.
+
+        """
+        n, r, p = self.params if params is None else params
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HasherBusy('Too many passwords are being hashed.')
+
+        try:
+            if self.workers == 0:
+                return _scrypt(password, salt, n, r, p)
+            return self._get_pool().submit(_scrypt, password, salt,
+                                           n, r, p).result()
+        finally:
+            self._slots.release()
+
+    def hash_many(self, items: Sequence[Tuple[str, str]],
+                  workers: int = 0) -> Iterator[bytes]:
+        """
+        Hash many passwords with the configured parameters, in parallel.
+
+        Runs on a pool of its own, so a bulk job neither waits for nor
+        takes the slots that logins use.
+
+        Parameters
+        ----------
+        items : Sequence[Tuple[str, str]]
+            [(password, salt), ...].
+        workers : int
+            number of hashing processes, one per core if 0.
+
+        Yields
+        ------
+        bytes
+            each hash, in order.
+
+        """
+        if not items:
+            return
+        n, r, p = self.params
+        workers = min(workers or os.cpu_count() or 1, len(items))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            yield from pool.map(_scrypt, (x[0] for x in items),
+                                (x[1] for x in items),
+                                repeat(n), repeat(r), repeat(p),
+                                chunksize=max(1, len(items) // (workers * 4)))
+
+    def verify(self, password: str, salt: str, hash: bytes,
+               params: Optional[Tuple[int, int, int]] = None) -> bool:
+        """
+        Check a password against a stored hash in constant time.
+
+        Parameters
+        ----------
+        password : str
+            the password.
+        salt : str
+            the salt the hash was made with.
+        hash : bytes
+            the stored hash.
+        params : Optional[Tuple[int, int, int]]
+            (N, r, p) the hash was made with.
+
+        Returns
+        -------
+        bool
+            True if the password matches.
+            False otherwise.
+
+        """
+        return hmac.compare_digest(self.hash(password, salt, params), hash)
+
+    def shutdown(self) -> None:
+        """
+        Stop the worker pool, if it was started.
+
+        Returns
+        -------
+        None
+
+        """
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown()
+            self._pool = None
@@ -6,6 +6,11 @@ Helper functions for the main Flask file
 Copyright Joan Chirinos, 2021.
 """
 
+from typing import IO, List, Tuple
+import csv
+import io
+import secrets
+
 
 def verify_auth_args(*args: str) -> bool:
     """
@@ -30,3 +35,78 @@ def verify_auth_args(*args: str) -> bool:
         if len(arg.strip()) == 0 or arg.strip() != arg:
             return False
     return True
+
+
+def parse_roster(stream: IO[bytes]) -> List[Tuple[int, str]]:
+    """
+    Read the emails out of an uploaded CSV roster
+
+    Emails come from the column headed "email", or the first column if no
+    column has that header. Blank rows are skipped.
+
+    Parameters
+    ----------
+    stream : IO[bytes]
+        The uploaded file
+
+    Returns
+    -------
+    List[Tuple[int, str]]
+        [(line number, email), ...] in file order
+
+    Raises
+    ------
+    UnicodeDecodeError
+        If the file is not UTF-8
+    csv.Error
+        If the file is not valid CSV
+
+    """
+    reader = csv.reader(io.TextIOWrapper(stream, 'utf-8-sig', newline=''))
+    column = 0
+    roster = []
+    for row in reader:
+        if reader.line_num == 1:
+            header = [cell.strip().lower() for cell in row]
+            if 'email' in header:
+                column = header.index('email')
+                continue
+        if len(row) > column and row[column].strip():
+            roster.append((reader.line_num, row[column]))
+    return roster
+
+
+def parse_accounts(f: IO[str]) -> List[Tuple[str, str, str, str, int]]:
+    """
+    Read the accounts out of a CSV file for bulk registration
+
+    The file needs "email", "first" and "last" columns, and may have
+    "password" and "teacher" columns. A blank password is replaced with a
+    random one; teacher is 1 for "1", "yes" or "true".
+
+    Parameters
+    ----------
+    f : IO[str]
+        The open CSV file
+
+    Returns
+    -------
+    List[Tuple[str, str, str, str, int]]
+        [(email, password, first, last, teacher), ...] in file order
+
+    Raises
+    ------
+    KeyError
+        If a required column is missing
+
+    """
+    accounts = []
+    for row in csv.DictReader(f):
+        row = {key.strip().lower(): (value or '').strip()
+               for key, value in row.items() if key}
+        accounts.append((row['email'],
+                         row.get('password') or secrets.token_urlsafe(9),
+                         row['first'], row['last'],
+                         int(row.get('teacher', '').lower()
+                             in ('1', 'yes', 'true'))))
+    return accounts
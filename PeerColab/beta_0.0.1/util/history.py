@@ -0,0 +1,385 @@
+"""
+PeerColab
+
+Python file facilitating compressed version history of file contents
+
+A version is stored either as a keyframe, the whole contents compressed, or
+as a delta against the version before it. A delta is a zlib-compressed run
+of operations building the new contents line by line:
+
+    copy:   COPY header (0, offset, length), bytes taken from the old contents
+    insert: INSERT header (1, length), followed by that many new bytes
+
+Deltas are made before the database write lock is taken, see
+VersionHistory.prepare, and in time linear in the size of the contents.
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from typing import List, Optional, Tuple
+import bisect
+import sqlite3
+import struct
+import time
+import zlib
+
+COPY = struct.Struct('<BII')
+INSERT = struct.Struct('<BI')
+# zlib level for keyframes and deltas
+LEVEL = 6
+
+
+def diff(old: bytes, new: bytes) -> bytes:
+    """
+    Make a delta that turns old into new.
+
+    Each run of new lines is copied from the first place in old it matches
+    at or after the end of the last copy, or failing that anywhere in old,
+    so every line is looked at once. Runs shorter than a copy header are
+    inserted instead.
+
+    Parameters
+    ----------
+    old : bytes
+        the old contents.
+    new : bytes
+        the new contents.
+
+    Returns
+    -------
+    bytes
+        the compressed delta.
+
+    """
+    a, b = old.splitlines(True), new.splitlines(True)
+    starts, positions = [0], {}
+    for i, line in enumerate(a):
+        starts.append(starts[-1] + len(line))
+        positions.setdefault(line, []).append(i)
+
+    ops, inserted = bytearray(), []
+
+    def insert() -> None:
+        if inserted:
+            data = b''.join(inserted)
+            ops.extend(INSERT.pack(1, len(data)))
+            ops.extend(data)
+            inserted.clear()
+
+    i = j = 0
+    while j < len(b):
+        if i < len(a) and a[i] == b[j]:
+            start = i
+        else:
+            candidates = positions.get(b[j])
+            if not candidates:
+                inserted.append(b[j])
+                j += 1
+                continue
+            k = bisect.bisect_left(candidates, i)
+            start = candidates[k] if k < len(candidates) else candidates[0]
+
+        end, first = start, j
+        while end < len(a) and j < len(b) and a[end] == b[j]:
+            end += 1
+            j += 1
+
+        length = starts[end] - starts[start]
+        if length < COPY.size:
+            inserted.extend(b[first:j])
+        else:
+            insert()
+            ops += COPY.pack(0, starts[start], length)
+            i = end
+    insert()
+
+    return zlib.compress(ops, LEVEL)
+
+
+def patch(old: bytes, delta: bytes) -> bytes:
+    """
+    Apply a delta made by diff.
+
+    Parameters
+    ----------
+    old : bytes
+        the contents the delta was made against.
+    delta : bytes
+        the compressed delta.
+
+    Returns
+    -------
+    bytes
+        the new contents.
+
+    """
+    ops, old = zlib.decompress(delta), memoryview(old)
+    parts, pos = [], 0
+    while pos < len(ops):
+        if ops[pos] == 0:
+            _, offset, length = COPY.unpack_from(ops, pos)
+            parts.append(old[offset:offset + length])
+            pos += COPY.size
+        else:
+            _, length = INSERT.unpack_from(ops, pos)
+            pos += INSERT.size
+            parts.append(ops[pos:pos + length])
+            pos += length
+    return b''.join(parts)
+
+
+class VersionHistory:
+
+    def __init__(self, keyframe_interval: int = 20,
+                 max_bytes: int = 2 ** 20, keep_versions: int = 50,
+                 keep_seconds: float = 30 * 24 * 60 * 60) -> None:
+        """
+        Initialize VersionHistory class, the policy for the file_versions
+        table.
+
+        Every keyframe_interval-th version is a keyframe, so restoring any
+        version decompresses one keyframe and applies fewer than
+        keyframe_interval deltas. A delta that comes out no smaller than a
+        keyframe is stored as one instead. Methods work inside the
+        caller's transaction, so a version commits with the change it
+        records. The version itself is made beforehand with prepare, so
+        the write lock isn't held while diffing.
+
+        Parameters
+        ----------
+        keyframe_interval : int
+            most versions per keyframe, counting the keyframe.
+        max_bytes : int
+            largest contents kept. Versions past it are skipped, and the
+            next version kept is a keyframe.
+        keep_versions : int
+            versions always kept per file, newest first.
+        keep_seconds : float
+            how long versions are kept even past keep_versions.
+
+        Returns
+        -------
+        None
+
+        """
+        self.keyframe_interval = keyframe_interval
+        self.max_bytes = max_bytes
+        self.keep_versions = keep_versions
+        self.keep_seconds = keep_seconds
+
+    def last(self, c: sqlite3.Cursor,
+             file_id: str) -> Optional[Tuple[int, int]]:
+        """
+        Get a file's last version.
+
+        Parameters
+        ----------
+        c : sqlite3.Cursor
+            cursor on the database.
+        file_id : str
+            the file id.
+
+        Returns
+        -------
+        Optional[Tuple[int, int]]
+            (version, keyframe). None if the file has no versions.
+
+        """
+        c.execute('SELECT version, keyframe FROM file_versions '
+                  'WHERE file_id=? ORDER BY version DESC LIMIT 1',
+                  (file_id,))
+
+        return c.fetchone()
+
+    def prepare(self, last: Optional[Tuple[int, int]],
+                old: Optional[bytes],
+                new: bytes) -> Optional[Tuple[int, int, bytes]]:
+        """
+        Make the version following last, without touching the database.
+
+        Parameters
+        ----------
+        last : Optional[Tuple[int, int]]
+            the file's last version, see last.
+        old : Optional[bytes]
+            the contents of last. None if they weren't kept, for being too
+            large, which makes the new version a keyframe.
+        new : bytes
+            the new contents.
+
+        Returns
+        -------
+        Optional[Tuple[int, int, bytes]]
+            (version, keyframe, data) for record. None if new is too large
+            to keep, or the same as old.
+
+        """
+        if len(new) > self.max_bytes:
+            return None
+
+        if last is not None and old is not None and old == new:
+            return None
+
+        version = 1 if last is None else last[0] + 1
+        if last is not None and old is not None \
+                and version - last[1] < self.keyframe_interval:
+            delta = diff(old, new)
+            # Worth checking only when the change rewrote most of the file
+            if len(delta) * 4 < len(new) \
+                    or len(delta) < len(zlib.compress(new, LEVEL)):
+                return version, last[1], delta
+
+        return version, version, zlib.compress(new, LEVEL)
+
+    def record(self, c: sqlite3.Cursor, file_id: str, new: bytes,
+               email: Optional[str] = None,
+               prepared: Optional[Tuple[int, int, bytes]] = None
+               ) -> Optional[int]:
+        """
+        Record a file's new contents as its next version, then apply the
+        retention policy to the file.
+
+        Parameters
+        ----------
+        c : sqlite3.Cursor
+            cursor in a transaction holding the write lock.
+        file_id : str
+            the file id.
+        new : bytes
+            the new contents.
+        email : Optional[str]
+            who made the change, None for live edits by anyone.
+        prepared : Optional[Tuple[int, int, bytes]]
+            the version from prepare, made against the contents being
+            replaced. If another version was recorded since, or there is
+            none, a keyframe is made instead.
+
+        Returns
+        -------
+        Optional[int]
+            the new version. None if new is too large to keep.
+
+        """
+        last = self.last(c, file_id)
+
+        if prepared is None \
+                or prepared[0] != (1 if last is None else last[0] + 1):
+            prepared = self.prepare(last, None, new)
+            if prepared is None:
+                return None
+        version, keyframe, data = prepared
+
+        c.execute('INSERT INTO file_versions(file_id, version, keyframe, '
+                  '                          size, data, created_at, '
+                  '                          created_by) '
+                  'VALUES(?,?,?,?,?,?,?)',
+                  (file_id, version, keyframe, len(new), data, time.time(),
+                   email))
+
+        self.prune(c, file_id)
+
+        return version
+
+    def get(self, c: sqlite3.Cursor, file_id: str,
+            version: int) -> Optional[bytes]:
+        """
+        Rebuild a version of a file.
+
+        Parameters
+        ----------
+        c : sqlite3.Cursor
+            cursor on the database.
+        file_id : str
+            the file id.
+        version : int
+            the version.
+
+        Returns
+        -------
+        Optional[bytes]
+            the contents. None if there is no such version.
+
+        """
+        # One statement, so the chain can't be pruned halfway through
+        c.execute('SELECT version, keyframe, data FROM file_versions '
+                  'WHERE file_id=:file_id AND version BETWEEN ('
+                  '    SELECT keyframe FROM file_versions '
+                  '    WHERE file_id=:file_id AND version=:version'
+                  ') AND :version '
+                  'ORDER BY version',
+                  {'file_id': file_id, 'version': version})
+
+        rows = c.fetchall()
+
+        if not rows or rows[0][0] != rows[0][1] or rows[-1][0] != version:
+            return None
+
+        contents = zlib.decompress(rows[0][2])
+        for _, _, delta in rows[1:]:
+            contents = patch(contents, delta)
+
+        return contents
+
+    def versions(self, c: sqlite3.Cursor, file_id: str
+                 ) -> List[Tuple[int, int, float, Optional[str]]]:
+        """
+        List the versions kept of a file.
+
+        Parameters
+        ----------
+        c : sqlite3.Cursor
+            cursor on the database.
+        file_id : str
+            the file id.
+
+        Returns
+        -------
+        List[Tuple[int, int, float, Optional[str]]]
+            [(version, size, created_at, created_by), ...], newest first.
+
+        """
+        c.execute('SELECT version, size, created_at, created_by '
+                  'FROM file_versions WHERE file_id=? '
+                  'ORDER BY version DESC',
+                  (file_id,))
+
+        return c.fetchall()
+
+    def prune(self, c: sqlite3.Cursor, file_id: str) -> int:
+        """
+        Delete a file's versions that are past both keep_versions and
+        keep_seconds, except those a kept version's chain starts from.
+
+        Parameters
+        ----------
+        c : sqlite3.Cursor
+            cursor in a transaction.
+        file_id : str
+            the file id.
+
+        Returns
+        -------
+        int
+            number of versions deleted.
+
+        """
+        c.execute('SELECT keyframe FROM file_versions '
+                  'WHERE file_id=:file_id AND version=('
+                  '    SELECT MIN(version) FROM file_versions '
+                  '    WHERE file_id=:file_id AND ('
+                  '        version > (SELECT MAX(version) '
+                  '                   FROM file_versions '
+                  '                   WHERE file_id=:file_id) - :keep '
+                  '        OR created_at >= :since))',
+                  {'file_id': file_id, 'keep': self.keep_versions,
+                   'since': time.time() - self.keep_seconds})
+
+        row = c.fetchone()
+
+        if row is None:
+            return 0
+
+        c.execute('DELETE FROM file_versions WHERE file_id=? AND version<?',
+                  (file_id, row[0]))
+
+        return c.rowcount
@@ -0,0 +1,335 @@
+"""
+PeerColab
+
+Python file facilitating a durable background job queue in SQLite
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from typing import Any, Callable, Dict, Optional, Tuple
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .connection import ConnectionManager
+
+# What a handler is given to report progress with: (done, total)
+Progress = Callable[[int, Optional[int]], None]
+Handler = Callable[[Dict[str, Any], Progress], None]
+# Longest wait before retrying a failed job, in seconds
+MAX_BACKOFF = 300
+
+logger = logging.getLogger('peercolab.jobs')
+
+
+class JobQueue:
+
+    def __init__(self, connections: ConnectionManager, lease: float = 60,
+                 max_attempts: int = 5, poll_seconds: float = 1,
+                 keep_seconds: float = 7 * 24 * 60 * 60) -> None:
+        """
+        Initialize JobQueue class.
+
+        Jobs are rows of the jobs table, so they survive restarts and are
+        shared by every process using the database. Workers claim a job
+        by leasing it; a job whose worker dies is run again once its lease
+        runs out, so handlers must be safe to run more than once. A job
+        that raises is retried with exponential backoff until it has been
+        tried max_attempts times.
+
+        Parameters
+        ----------
+        connections : ConnectionManager
+            connections to the database holding the jobs table.
+        lease : float
+            seconds a worker holds a job for without reporting progress.
+        max_attempts : int
+            most times a job is tried.
+        poll_seconds : float
+            how often idle workers look for jobs enqueued by other
+            processes. Jobs enqueued by this one wake them at once.
+        keep_seconds : float
+            how long finished jobs are kept for their status to be read.
+
+        Returns
+        -------
+        None
+
+        """
+        self.connections = connections
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.keep_seconds = keep_seconds
+
+        self._handlers = {}
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def register(self, kind: str, handler: Handler) -> None:
+        """
+        Register the handler running jobs of a kind.
+
+        Parameters
+        ----------
+        kind : str
+            the kind of job.
+        handler : Handler
+            called with the job's arguments and a progress callback. The
+            callback also renews the job's lease, and must not be called
+            inside a transaction of the handler's own.
+
+        Returns
+        -------
+        None
+
+        """
+        self._handlers[kind] = handler
+
+    def enqueue(self, kind: str, args: Dict[str, Any],
+                owner: Optional[str] = None, key: Optional[str] = None,
+                c: Optional[sqlite3.Cursor] = None) -> int:
+        """
+        Add a job to the queue.
+
+        Parameters
+        ----------
+        kind : str
+            the kind of job.
+        args : Dict[str, Any]
+            the handler's arguments, which must be JSON serializable.
+        owner : Optional[str]
+            email of the user allowed to read the job's status.
+        key : Optional[str]
+            idempotency key. If a job with it exists, no job is added and
+            that job's id is returned.
+        c : Optional[sqlite3.Cursor]
+            cursor to enqueue with, so the job commits or rolls back with
+            the caller's transaction. A transaction of its own if None.
+
+        Returns
+        -------
+        int
+            the job id.
+
+        """
+        if c is None:
+            with self.connections.cursor() as c:
+                job_id = self.enqueue(kind, args, owner, key, c)
+        else:
+            now = time.time()
+            c.execute('INSERT INTO jobs(kind, args, owner, idempotency_key, '
+                      '                 max_attempts, run_after, '
+                      '                 created_at, updated_at) '
+                      'VALUES(?,?,?,?,?,?,?,?) '
+                      'ON CONFLICT(idempotency_key) DO NOTHING',
+                      (kind, json.dumps(args), owner, key, self.max_attempts,
+                       now, now, now))
+            if c.rowcount:
+                job_id = c.lastrowid
+            else:
+                c.execute('SELECT job_id FROM jobs WHERE idempotency_key=?',
+                          (key,))
+                job_id = c.fetchone()[0]
+
+        self._wake.set()
+        return job_id
+
+    def status(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Get a job's status.
+
+        Parameters
+        ----------
+        job_id : int
+            the job id.
+
+        Returns
+        -------
+        Optional[Dict[str, Any]]
+            {kind, owner, state, attempts, done, total, error}, state being
+            queued, running, done or failed. None if there is no such job.
+
+        """
+        with self.connections.cursor() as c:
+            c.execute('SELECT kind, owner, state, attempts, done, total, '
+                      '       error '
+                      'FROM jobs WHERE job_id=?', (job_id,))
+
+            row = c.fetchone()
+
+        if row is None:
+            return None
+        return dict(zip(('kind', 'owner', 'state', 'attempts', 'done',
+                         'total', 'error'), row))
+
+    def _claim(self) -> Optional[Tuple[int, str, str, int, int]]:
+        """Lease the job due longest ago, if any."""
+        now = time.time()
+        with self.connections.cursor() as c:
+            c.execute('BEGIN IMMEDIATE')
+            c.execute('UPDATE jobs SET state=\'running\', '
+                      '                attempts=attempts + 1, '
+                      '                run_after=?, updated_at=? '
+                      'WHERE job_id=('
+                      '    SELECT job_id FROM jobs '
+                      '    WHERE state IN (\'queued\', \'running\') '
+                      '          AND run_after<=? '
+                      '    ORDER BY run_after LIMIT 1) '
+                      'RETURNING job_id, kind, args, attempts, max_attempts',
+                      (now + self.lease, now, now))
+
+            return c.fetchone()
+
+    def _finish(self, job_id: int, state: str, error: Optional[str],
+                run_after: float) -> None:
+        """Record how an attempt at a job ended."""
+        with self.connections.cursor() as c:
+            c.execute('UPDATE jobs SET state=?, error=?, run_after=?, '
+                      '                updated_at=? '
+                      'WHERE job_id=?',
+                      (state, error, run_after, time.time(), job_id))
+
+    def run_one(self) -> bool:
+        """
+        Run the job due longest ago, if any, on this thread.
+
+        Returns
+        -------
+        bool
+            True if a job was run, whether or not it succeeded.
+            False if none was due.
+
+        """
+        claimed = self._claim()
+        if claimed is None:
+            return False
+        job_id, kind, args, attempts, max_attempts = claimed
+
+        if attempts > max_attempts:
+            # Its worker died holding it on the last attempt
+            self._finish(job_id, 'failed', 'The job stopped responding.',
+                         time.time())
+            return True
+
+        def progress(done: int, total: Optional[int] = None) -> None:
+            now = time.time()
+            with self.connections.cursor() as c:
+                c.execute('UPDATE jobs SET done=?, total=COALESCE(?, total), '
+                          '                run_after=?, updated_at=? '
+                          'WHERE job_id=?',
+                          (done, total, now + self.lease, now, job_id))
+
+        try:
+            self._handlers[kind](json.loads(args), progress)
+        except Exception as e:
+            logger.exception('Job %d (%s) failed on attempt %d of %d.',
+                             job_id, kind, attempts, max_attempts)
+            if attempts < max_attempts:
+                self._finish(job_id, 'queued', repr(e), time.time()
+                             + min(MAX_BACKOFF, 2 ** attempts))
+            else:
+                self._finish(job_id, 'failed', repr(e), time.time())
+        else:
+            self._finish(job_id, 'done', None, time.time())
+
+        return True
+
+    def run_all(self) -> int:
+        """
+        Run jobs on this thread until none is due.
+
+        Returns
+        -------
+        int
+            number of jobs run.
+
+        """
+        count = 0
+        while self.run_one():
+            count += 1
+        return count
+
+    def prune(self) -> int:
+        """
+        Delete jobs that finished more than keep_seconds ago.
+
+        Returns
+        -------
+        int
+            number of jobs deleted.
+
+        """
+        with self.connections.cursor() as c:
+            c.execute('DELETE FROM jobs '
+                      'WHERE state IN (\'done\', \'failed\') '
+                      '      AND updated_at<?',
+                      (time.time() - self.keep_seconds,))
+
+            return c.rowcount
+
+    def start(self, workers: int) -> None:
+        """
+        Start worker threads in this process, unless they're running.
+
+        Parameters
+        ----------
+        workers : int
+            number of threads.
+
+        Returns
+        -------
+        None
+
+        """
+        with self._lock:
+            if os.getpid() != self._pid:
+                # Forked, the parent's threads didn't come along
+                self._workers = []
+                self._pid = os.getpid()
+            if self._workers:
+                return
+            self._stopping.clear()
+            for _ in range(workers):
+                worker = threading.Thread(target=self._work_forever,
+                                          daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def stop(self) -> None:
+        """
+        Stop the worker threads once their current jobs finish.
+
+        Returns
+        -------
+        None
+
+        """
+        with self._lock:
+            self._stopping.set()
+            self._wake.set()
+            for worker in self._workers:
+                worker.join()
+            self._workers = []
+
+    def _work_forever(self) -> None:
+        """Run jobs as they come due, on a worker thread."""
+        next_prune = time.time()
+        while not self._stopping.is_set():
+            try:
+                if self.run_one():
+                    continue
+                if time.time() >= next_prune:
+                    self.prune()
+                    next_prune = time.time() + 60 * 60
+            except sqlite3.Error:
+                logger.exception('Job queue error.')
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+        self.connections.close()
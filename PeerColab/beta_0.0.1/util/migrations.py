@@ -0,0 +1,130 @@
+"""
+PeerColab
+
+Python file facilitating versioned schema migrations
+
+Migrations are SQL scripts named `<version>_<description>.sql` in the
+migrations directory. Each one runs in its own transaction together with the
+row recording it in the schema_version table, so a failed migration leaves
+the database exactly as it was.
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from typing import List, Tuple
+import os
+import re
+
+import sqlite3
+
+MIGRATION_RE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+
+def load_migrations(dirname: str) -> List[Tuple[int, str, str]]:
+    """
+    Load migration scripts from a directory.
+
+    Parameters
+    ----------
+    dirname : str
+        the migrations directory.
+
+    Returns
+    -------
+    List[Tuple[int, str, str]]
+        [(version, filename, sql), ...] sorted by version.
+
+    """
+    migrations = []
+    for filename in os.listdir(dirname):
+        match = MIGRATION_RE.match(filename)
+        if match is None:
+            continue
+        with open(os.path.join(dirname, filename)) as f:
+            migrations.append((int(match.group(1)), filename, f.read()))
+
+    migrations.sort()
+
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f'Duplicate migration versions in {dirname}')
+
+    return migrations
+
+
+def current_version(db: sqlite3.Connection) -> int:
+    """
+    Get the schema version of a database.
+
+    Parameters
+    ----------
+    db : sqlite3.Connection
+        the database connection.
+
+    Returns
+    -------
+    int
+        the highest applied migration, 0 if none have been applied.
+
+    """
+    db.execute('CREATE TABLE IF NOT EXISTS schema_version('
+               'version INTEGER PRIMARY KEY, name TEXT NOT NULL, '
+               'applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)')
+    version = db.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return version[0] or 0
+
+
+def migrate(filename: str, dirname: str) -> List[str]:
+    """
+    Apply every pending migration to a database.
+
+    Foreign key enforcement is switched off while migrations run so tables
+    can be rebuilt, and each migration must leave no foreign key violations
+    behind before it is committed.
+
+    Parameters
+    ----------
+    filename : str
+        the database filename.
+    dirname : str
+        the migrations directory.
+
+    Returns
+    -------
+    List[str]
+        filenames of the migrations that were applied, in order.
+
+    """
+    db = sqlite3.connect(filename, isolation_level=None)
+    applied = []
+
+    try:
+        db.execute('PRAGMA foreign_keys=OFF')
+        version = current_version(db)
+
+        for number, name, sql in load_migrations(dirname):
+            if number <= version:
+                continue
+
+            try:
+                db.executescript('BEGIN IMMEDIATE;\n' + sql)
+
+                violation = db.execute('PRAGMA foreign_key_check').fetchone()
+                if violation is not None:
+                    raise sqlite3.IntegrityError(
+                        f'{name} leaves a foreign key violation in '
+                        f'table {violation[0]}')
+
+                db.execute('INSERT INTO schema_version(version, name) '
+                           'VALUES(?,?)', (number, name))
+                db.execute('COMMIT')
+            except BaseException:
+                if db.in_transaction:
+                    db.execute('ROLLBACK')
+                raise
+
+            applied.append(name)
+    finally:
+        db.close()
+
+    return applied
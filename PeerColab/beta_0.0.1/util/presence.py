@@ -0,0 +1,243 @@
+"""
+PeerColab
+
+Python file facilitating an in-memory registry of who is on which file
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from typing import Callable, Dict, List, Tuple
+import math
+import threading
+import time
+
+# What a user can be doing on a file, stored as the index into STATES
+STATES = ('viewing', 'editing')
+
+
+class PresenceRegistry:
+
+    def __init__(self, ttl: float = 30, tick: float = 1,
+                 coalesce: float = 10,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        Initialize PresenceRegistry class.
+
+        Each user on a file is one [state, deadline] entry in that file's
+        dict, deadline counting ticks. Entries are expired by a timer wheel
+        with a slot per tick of the TTL: an entry's key goes in the slot of
+        its deadline, and each slot is emptied as time passes it, so expiry
+        costs nothing per entry that stays alive. The wheel is advanced by
+        whichever call comes next, with no thread of its own.
+
+        A heartbeat arriving within coalesce seconds of the last one that
+        moved the deadline, without a change of state, is absorbed without
+        touching the wheel, so an entry expires between ttl - coalesce and
+        ttl seconds after its last heartbeat. Clients should heartbeat at
+        least every ttl - coalesce seconds.
+
+        Parameters
+        ----------
+        ttl : float
+            seconds an entry lives after a heartbeat.
+        tick : float
+            resolution of the wheel, in seconds.
+        coalesce : float
+            seconds within which heartbeats are absorbed.
+        clock : Callable[[], float]
+            the time in seconds, monotonic.
+
+        Returns
+        -------
+        None
+
+        """
+        self.ttl = ttl
+        self.tick = tick
+        self.heartbeats = 0
+        self.renewals = 0
+        self.expired = 0
+
+        self._clock = clock
+        self._ttl_ticks = max(1, math.ceil(ttl / tick))
+        self._coalesce_ticks = min(self._ttl_ticks - 1,
+                                   math.floor(coalesce / tick))
+        self._wheel = [[] for _ in range(self._ttl_ticks + 1)]
+        self._now = self._ticks()
+        # file_id -> {email: [state, deadline]}
+        self._files = {}
+        # file_id -> project_id, and project_id -> {file_id, ...}
+        self._file_projects = {}
+        self._projects = {}
+        self._lock = threading.Lock()
+
+    def _ticks(self) -> int:
+        """The clock in ticks."""
+        return int(self._clock() / self.tick)
+
+    def _advance(self) -> int:
+        """Expire entries in the slots passed since last time."""
+        now = self._ticks()
+        size = len(self._wheel)
+        passed = now - self._now
+        for t in range(now - min(passed, size) + 1, now + 1):
+            slot = t % size
+            keys, self._wheel[slot] = self._wheel[slot], []
+            for file_id, email in keys:
+                users = self._files.get(file_id)
+                entry = users.get(email) if users is not None else None
+                # Renewed entries stay behind in their old slots
+                if entry is not None and entry[1] <= now:
+                    self._remove(file_id, email)
+                    self.expired += 1
+        self._now = now
+        return now
+
+    def _remove(self, file_id: str, email: str) -> None:
+        """Remove an entry, and its file and project once they're empty."""
+        users = self._files[file_id]
+        del users[email]
+        if not users:
+            del self._files[file_id]
+            project_id = self._file_projects.pop(file_id)
+            files = self._projects[project_id]
+            files.discard(file_id)
+            if not files:
+                del self._projects[project_id]
+
+    def heartbeat(self, project_id: str, file_id: str, email: str,
+                  state: str) -> bool:
+        """
+        Record that a user is on a file.
+
+        Parameters
+        ----------
+        project_id : str
+            the file's project.
+        file_id : str
+            the file.
+        email : str
+            the user.
+        state : str
+            one of STATES.
+
+        Returns
+        -------
+        bool
+            True if the user just arrived or changed state.
+            False if only their entry's life was extended, or not even that.
+
+        """
+        code = STATES.index(state)
+        with self._lock:
+            now = self._advance()
+            self.heartbeats += 1
+            deadline = now + self._ttl_ticks
+
+            users = self._files.get(file_id)
+            if users is None:
+                users = self._files[file_id] = {}
+                self._file_projects[file_id] = project_id
+                self._projects.setdefault(project_id, set()).add(file_id)
+
+            entry = users.get(email)
+            if entry is None:
+                users[email] = [code, deadline]
+                changed = True
+            else:
+                changed = entry[0] != code
+                entry[0] = code
+                if not changed \
+                        and deadline - entry[1] <= self._coalesce_ticks:
+                    return False
+                entry[1] = deadline
+
+            self.renewals += 1
+            self._wheel[deadline % len(self._wheel)].append((file_id, email))
+            return changed
+
+    def leave(self, file_id: str, email: str) -> bool:
+        """
+        Remove a user from a file at once.
+
+        Parameters
+        ----------
+        file_id : str
+            the file.
+        email : str
+            the user.
+
+        Returns
+        -------
+        bool
+            True if they were on it.
+
+        """
+        with self._lock:
+            self._advance()
+            users = self._files.get(file_id)
+            if users is None or email not in users:
+                return False
+            self._remove(file_id, email)
+            return True
+
+    def file(self, file_id: str) -> List[Tuple[str, str]]:
+        """
+        Get who is on a file.
+
+        Parameters
+        ----------
+        file_id : str
+            the file.
+
+        Returns
+        -------
+        List[Tuple[str, str]]
+            [(email, state), ...] sorted by email.
+
+        """
+        with self._lock:
+            self._advance()
+            users = self._files.get(file_id, {})
+            return sorted((email, STATES[entry[0]])
+                          for email, entry in users.items())
+
+    def project(self, project_id: str) -> Dict[str, List[Tuple[str, str]]]:
+        """
+        Get who is on each file of a project.
+
+        Parameters
+        ----------
+        project_id : str
+            the project.
+
+        Returns
+        -------
+        Dict[str, List[Tuple[str, str]]]
+            {file_id: [(email, state), ...], ...} for files anyone is on.
+
+        """
+        with self._lock:
+            self._advance()
+            return {file_id: sorted((email, STATES[entry[0]])
+                                    for email, entry
+                                    in self._files[file_id].items())
+                    for file_id in self._projects.get(project_id, ())}
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the registry's counters.
+
+        Returns
+        -------
+        Dict[str, int]
+            {files, users, heartbeats, renewals, expired}, renewals being
+            the heartbeats that weren't absorbed.
+
+        """
+        with self._lock:
+            self._advance()
+            return {'files': len(self._files),
+                    'users': sum(len(x) for x in self._files.values()),
+                    'heartbeats': self.heartbeats,
+                    'renewals': self.renewals, 'expired': self.expired}
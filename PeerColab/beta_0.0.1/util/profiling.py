@@ -0,0 +1,476 @@
+"""
+PeerColab
+
+Python file facilitating opt-in per-request profiling and metrics
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+import bisect
+import functools
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+
+from flask import Flask, Response, request
+from flask.logging import default_handler
+from jinja2 import Template
+
+# Upper bounds, in seconds, of the request duration histogram's buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Addresses allowed to read /_metrics
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+logger = logging.getLogger('peercolab.profile')
+
+
+class Profile:
+
+    def __init__(self) -> None:
+        """
+        Initialize Profile class, what one request spent its time on.
+
+        Returns
+        -------
+        None
+
+        """
+        self.start = time.perf_counter()
+        self.connections = 0
+        self.statements = 0
+        self.sql = 0.0
+        self.scrypt = 0.0
+        self.templates = 0.0
+        self.db = 0.0
+        self.db_depth = 0
+        self.calls = Counter()
+        self.call_seconds = Counter()
+
+
+# The profile of the request this thread is handling, if any
+_local = threading.local()
+
+
+def current() -> Optional[Profile]:
+    """The profile of this thread's request, None outside of one."""
+    return getattr(_local, 'profile', None)
+
+
+class Metrics:
+
+    def __init__(self) -> None:
+        """
+        Initialize Metrics class, this process's totals over all requests.
+
+        Returns
+        -------
+        None
+
+        """
+        self.requests = Counter()
+        self.buckets = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+        self.durations = Counter()
+        self.totals = Counter()
+        self.calls = Counter()
+        self.call_seconds = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, method: str, status: int,
+               seconds: float, profile: Profile) -> None:
+        """Add one finished request."""
+        with self._lock:
+            self.requests[endpoint, method, status] += 1
+            self.buckets[endpoint][bisect.bisect_left(BUCKETS,
+                                                      seconds)] += 1
+            self.durations[endpoint] += seconds
+            self.totals['connections'] += profile.connections
+            self.totals['statements'] += profile.statements
+            self.totals['sql'] += profile.sql
+            self.totals['scrypt'] += profile.scrypt
+            self.totals['templates'] += profile.templates
+            self.calls.update(profile.calls)
+            self.call_seconds.update(profile.call_seconds)
+
+    def render(self, caches: Optional[Dict[str, Dict[str, int]]] = None
+               ) -> str:
+        """
+        Render the totals in the Prometheus text format.
+
+        Parameters
+        ----------
+        caches : Optional[Dict[str, Dict[str, int]]]
+            {name: TTLCache.stats(), ...}, the caches to report along with
+            the totals.
+
+        Returns
+        -------
+        str
+            the exposition, one sample per line.
+
+        """
+        def labels(**values: Any) -> str:
+            return '{' + ','.join(f'{k}="{_escape(str(v))}"'
+                                  for k, v in values.items()) + '}'
+
+        lines = []
+
+        def metric(name: str, kind: str, help: str) -> None:
+            lines.append(f'# HELP peercolab_{name} {help}')
+            lines.append(f'# TYPE peercolab_{name} {kind}')
+
+        with self._lock:
+            metric('requests_total', 'counter', 'Requests answered.')
+            for (endpoint, method, status), n in sorted(
+                    self.requests.items()):
+                lines.append('peercolab_requests_total' + labels(
+                    endpoint=endpoint, method=method, status=status)
+                    + f' {n}')
+
+            metric('request_duration_seconds', 'histogram',
+                   'Seconds taken to answer requests.')
+            for endpoint, counts in sorted(self.buckets.items()):
+                cumulative = 0
+                for bound, n in zip(BUCKETS + ('+Inf',), counts):
+                    cumulative += n
+                    lines.append('peercolab_request_duration_seconds_bucket'
+                                 + labels(endpoint=endpoint, le=bound)
+                                 + f' {cumulative}')
+                lines.append('peercolab_request_duration_seconds_sum'
+                             + labels(endpoint=endpoint)
+                             + f' {self.durations[endpoint]}')
+                lines.append('peercolab_request_duration_seconds_count'
+                             + labels(endpoint=endpoint) + f' {cumulative}')
+
+            for key, name, kind, help in (
+                    ('connections', 'db_connections_opened_total', 'counter',
+                     'SQLite connections opened while answering requests.'),
+                    ('statements', 'sql_statements_total', 'counter',
+                     'SQL statements executed while answering requests.'),
+                    ('sql', 'sql_seconds_total', 'counter',
+                     'Seconds spent executing SQL and fetching rows.'),
+                    ('scrypt', 'scrypt_seconds_total', 'counter',
+                     'Seconds spent waiting for password hashes.'),
+                    ('templates', 'template_seconds_total', 'counter',
+                     'Seconds spent rendering templates.')):
+                metric(name, kind, help)
+                lines.append(f'peercolab_{name} {self.totals[key]}')
+
+            metric('dbm_calls_total', 'counter', 'DBManager calls made.')
+            for method, n in sorted(self.calls.items()):
+                lines.append('peercolab_dbm_calls_total'
+                             + labels(method=method) + f' {n}')
+            metric('dbm_seconds_total', 'counter',
+                   'Seconds spent in DBManager calls, nested calls included.')
+            for method, seconds in sorted(self.call_seconds.items()):
+                lines.append('peercolab_dbm_seconds_total'
+                             + labels(method=method) + f' {seconds}')
+
+        for key, name, kind, help in (
+                ('hits', 'cache_hits_total', 'counter',
+                 'Cache lookups answered from the cache.'),
+                ('misses', 'cache_misses_total', 'counter',
+                 'Cache lookups that missed or found an expired entry.'),
+                ('evictions', 'cache_evictions_total', 'counter',
+                 'Cache entries evicted to make room.'),
+                ('size', 'cache_entries', 'gauge', 'Cache entries held.'),
+                ('maxsize', 'cache_max_entries', 'gauge',
+                 'Most cache entries held before evicting.')):
+            if caches:
+                metric(name, kind, help)
+            for cache, stats in sorted((caches or {}).items()):
+                lines.append(f'peercolab_{name}' + labels(cache=cache)
+                             + f' {stats[key]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    """Escape a label value for the Prometheus text format."""
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+class _TimedCursor:
+    """A cursor adding the time spent executing and fetching to a profile."""
+
+    def __init__(self, cursor: sqlite3.Cursor) -> None:
+        self._cursor = cursor
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.fetchall())
+
+    def _timed(name: str) -> Callable:
+        def method(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = getattr(self._cursor, name)(*args, **kwargs)
+            finally:
+                profile = current()
+                if profile is not None:
+                    profile.sql += time.perf_counter() - start
+            return self if result is self._cursor else result
+        method.__name__ = name
+        return method
+
+    execute = _timed('execute')
+    executemany = _timed('executemany')
+    executescript = _timed('executescript')
+    fetchone = _timed('fetchone')
+    fetchmany = _timed('fetchmany')
+    fetchall = _timed('fetchall')
+    del _timed
+
+
+class _TimedTemplate(Template):
+    """A template adding the time spent rendering it to a profile."""
+
+    def render(self, *args, **kwargs) -> str:
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            profile = current()
+            if profile is not None:
+                profile.templates += time.perf_counter() - start
+
+
+def _trace(statement: str) -> None:
+    """Count a statement SQLite runs, leaving out trigger bodies."""
+    profile = current()
+    if profile is not None and not statement.startswith('--'):
+        profile.statements += 1
+
+
+def _instrument_connections(connections) -> None:
+    """Count and trace the connections, and time their cursors."""
+    open_connection = connections._open
+    cursor = connections.cursor
+
+    @functools.wraps(open_connection)
+    def _open() -> sqlite3.Connection:
+        db = open_connection()
+        db.set_trace_callback(_trace)
+        profile = current()
+        if profile is not None:
+            profile.connections += 1
+        return db
+
+    @functools.wraps(cursor)
+    @contextmanager
+    def timed_cursor() -> Iterator[_TimedCursor]:
+        manager = cursor()
+        c = manager.__enter__()
+        try:
+            yield _TimedCursor(c)
+        except BaseException:
+            if not manager.__exit__(*sys.exc_info()):
+                raise
+        else:
+            # Committing is time in SQL too
+            start = time.perf_counter()
+            try:
+                manager.__exit__(None, None, None)
+            finally:
+                profile = current()
+                if profile is not None:
+                    profile.sql += time.perf_counter() - start
+
+    connections._open = _open
+    connections.cursor = timed_cursor
+    # Connections opened before profiling was installed
+    db = getattr(connections._local, 'db', None)
+    if db is not None:
+        db.set_trace_callback(_trace)
+
+
+def _instrument_hasher(hasher) -> None:
+    """Time the hashes. verify goes through hash, so it's timed too."""
+    hash = hasher.hash
+    hash_many = hasher.hash_many
+
+    @functools.wraps(hash)
+    def timed_hash(*args, **kwargs) -> bytes:
+        start = time.perf_counter()
+        try:
+            return hash(*args, **kwargs)
+        finally:
+            profile = current()
+            if profile is not None:
+                profile.scrypt += time.perf_counter() - start
+
+    @functools.wraps(hash_many)
+    def timed_hash_many(*args, **kwargs) -> Iterator[bytes]:
+        hashes = hash_many(*args, **kwargs)
+        while True:
+            start = time.perf_counter()
+            try:
+                result = next(hashes)
+            except StopIteration:
+                return
+            finally:
+                profile = current()
+                if profile is not None:
+                    profile.scrypt += time.perf_counter() - start
+            yield result
+
+    hasher.hash = timed_hash
+    hasher.hash_many = timed_hash_many
+
+
+def _instrument_dbm(dbm) -> None:
+    """Count and time every public DBManager method."""
+
+    def timed(name: str, method: Callable) -> Callable:
+        @functools.wraps(method)
+        def call(*args, **kwargs):
+            profile = current()
+            if profile is None:
+                return method(*args, **kwargs)
+            profile.db_depth += 1
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                profile.db_depth -= 1
+                profile.calls[name] += 1
+                profile.call_seconds[name] += elapsed
+                if not profile.db_depth:
+                    profile.db += elapsed
+        return call
+
+    for name in dir(type(dbm)):
+        method = getattr(dbm, name)
+        if not name.startswith('_') and callable(method):
+            setattr(dbm, name, timed(name, method))
+
+
+def server_timing(profile: Profile, total: float) -> str:
+    """The Server-Timing header value for a profile, in milliseconds."""
+    return ', '.join((
+        f'db;dur={profile.db * 1000:.2f};desc="{sum(profile.calls.values())}'
+        ' calls"',
+        f'sql;dur={profile.sql * 1000:.2f};desc="{profile.statements}'
+        f' statements, {profile.connections} connections opened"',
+        f'scrypt;dur={profile.scrypt * 1000:.2f}',
+        f'tpl;dur={profile.templates * 1000:.2f}',
+        f'total;dur={total * 1000:.2f}'))
+
+
+def instrument(dbm) -> None:
+    """
+    Record what dbm does in the profile of the request calling it.
+
+    Wraps dbm's methods, connections and hasher, so each request records
+    how many connections it opened, how many SQL statements it ran, and how
+    long it spent in SQL, scrypt and DBManager calls.
+
+    Parameters
+    ----------
+    dbm : DBManager
+        the app's database manager.
+
+    Returns
+    -------
+    None
+
+    """
+    _instrument_connections(dbm.connections)
+    _instrument_hasher(dbm.hasher)
+    _instrument_dbm(dbm)
+
+
+def install(app: Flask,
+            caches: Optional[Callable[[], Dict[str, Dict[str, int]]]] = None
+            ) -> Metrics:
+    """
+    Profile every request the app answers.
+
+    Times the app's templates and starts a profile for each request, which
+    an instrumented DBManager adds to. Each response gets a Server-Timing
+    header, each request a JSON line on the peercolab.profile logger, and
+    the process's totals are served in the Prometheus text format at
+    /_metrics to local clients, along with the stats of caches.
+
+    Nothing is wrapped unless this and instrument are called, so an app not
+    profiling pays nothing for it. Must be called before the app's first
+    request.
+
+    Parameters
+    ----------
+    app : Flask
+        the app.
+    caches : Optional[Callable[[], Dict[str, Dict[str, int]]]]
+        called on each read of /_metrics for {name: TTLCache.stats(), ...},
+        the caches of the process answering it.
+
+    Returns
+    -------
+    Metrics
+        the totals, added to as requests finish.
+
+    """
+    totals = Metrics()
+
+    app.jinja_env.template_class = _TimedTemplate
+
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        logger.addHandler(default_handler)
+
+    @app.before_request
+    def start_profile() -> None:
+        _local.profile = Profile()
+
+    @app.after_request
+    def finish_profile(response: Response) -> Response:
+        profile = current()
+        _local.profile = None
+        if profile is None or request.endpoint == 'metrics':
+            return response
+
+        total = time.perf_counter() - profile.start
+        endpoint = request.endpoint or 'none'
+        response.headers['Server-Timing'] = server_timing(profile, total)
+        totals.record(endpoint, request.method, response.status_code,
+                       total, profile)
+        logger.info(json.dumps({
+            'endpoint': endpoint, 'method': request.method,
+            'path': request.path, 'status': response.status_code,
+            'ms': round(total * 1000, 3),
+            'db_ms': round(profile.db * 1000, 3),
+            'sql_ms': round(profile.sql * 1000, 3),
+            'scrypt_ms': round(profile.scrypt * 1000, 3),
+            'template_ms': round(profile.templates * 1000, 3),
+            'connections': profile.connections,
+            'statements': profile.statements,
+            'calls': dict(profile.calls)}))
+        return response
+
+    @app.teardown_request
+    def drop_profile(e: Optional[BaseException]) -> None:
+        # A request that raised never reached finish_profile
+        _local.profile = None
+
+    @app.route('/_metrics')
+    def metrics() -> Tuple[str, int, Dict[str, str]]:
+        '''
+        Serve this process's request totals and cache stats to Prometheus
+        on this machine.
+        '''
+        if request.remote_addr not in LOCAL_ADDRESSES:
+            return 'Not found', 404, {}
+        return (totals.render(caches() if caches else None), 200,
+                {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    return totals
@@ -0,0 +1,305 @@
+"""
+PeerColab
+
+Python file facilitating an in-process publish/subscribe hub for change feeds
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import json
+import threading
+
+# (event id, JSON data), the data being serialized once for every subscriber
+Entry = Tuple[int, str]
+# Sent to a subscriber that has missed entries and must reload
+RESYNC = json.dumps({'type': 'resync'})
+
+
+class HubFull(Exception):
+    """Raised when a hub already has as many subscribers as it allows."""
+
+
+class Dropped(Exception):
+    """Raised when a subscription fell too far behind and was dropped."""
+
+
+class Subscription:
+
+    def __init__(self, hub: 'PubSub', topics: Tuple[str, ...],
+                 size: int) -> None:
+        """
+        Initialize Subscription class, one subscriber's queue.
+
+        Waiting blocks on a threading.Event, so each feed being served holds
+        a server thread, idle or not. Nothing here serves feeds without
+        threads; EVENT_MAX_STREAMS bounds how many a process holds.
+
+        Parameters
+        ----------
+        hub : PubSub
+            the hub it's subscribed to.
+        topics : Tuple[str, ...]
+            the topics it gets entries from.
+        size : int
+            most entries it may have waiting before it's dropped.
+
+        Returns
+        -------
+        None
+
+        """
+        self.hub = hub
+        self.topics = topics
+        self.size = size
+        self.subscribed = True
+        self.dropped = False
+        self._queue = deque()
+        self._ready = threading.Event()
+
+    def _put(self, entry: Entry) -> bool:
+        """Queue an entry, or return False if the queue is full."""
+        if len(self._queue) >= self.size:
+            return False
+        self._queue.append(entry)
+        self._ready.set()
+        return True
+
+    def _drop(self) -> None:
+        """Mark it dropped and wake its reader to find out."""
+        self.dropped = True
+        self._ready.set()
+
+    def get(self, timeout: float) -> List[Entry]:
+        """
+        Take every waiting entry, waiting up to timeout for one.
+
+        Parameters
+        ----------
+        timeout : float
+            most seconds to wait.
+
+        Returns
+        -------
+        List[Entry]
+            the entries, oldest first, none if the wait timed out.
+
+        Raises
+        ------
+        Dropped
+            if entries were missed because the queue filled up.
+
+        """
+        if not self._queue and not self.dropped:
+            self._ready.wait(timeout)
+        self._ready.clear()
+        if self.dropped:
+            raise Dropped('The subscriber fell behind.')
+
+        entries = []
+        while self._queue:
+            entries.append(self._queue.popleft())
+        return entries
+
+    def close(self) -> None:
+        """
+        Unsubscribe.
+
+        Returns
+        -------
+        None
+
+        """
+        self.hub._unsubscribe(self)
+
+
+class PubSub:
+
+    def __init__(self, queue_size: int = 256, history_size: int = 64,
+                 max_topics: int = 10000,
+                 max_subscribers: int = 1000) -> None:
+        """
+        Initialize PubSub class.
+
+        Publishing appends the entry to every subscriber's queue without
+        waiting for any of them. A subscriber whose queue is full is
+        dropped rather than slowing the publisher or growing without bound.
+        The last history_size entries of each topic are kept so that a
+        subscriber reconnecting after an event id can be caught up.
+
+        Only subscribers in this process are reached, so each process
+        serving the app has a hub of its own.
+
+        Parameters
+        ----------
+        queue_size : int
+            most entries waiting per subscriber.
+        history_size : int
+            entries kept per topic for reconnecting subscribers.
+        max_topics : int
+            most topics with history kept, least recently published to
+            forgotten first.
+        max_subscribers : int
+            most subscribers at once.
+
+        Returns
+        -------
+        None
+
+        """
+        self.queue_size = queue_size
+        self.history_size = history_size
+        self.max_topics = max_topics
+        self.max_subscribers = max_subscribers
+        self.published = 0
+        self.dropped = 0
+
+        self._seq = 0
+        # Entries up to this id may have been forgotten with their topic
+        self._forgotten = 0
+        self._subscribers = {}
+        self._count = 0
+        self._history = OrderedDict()
+        self._lock = threading.Lock()
+
+    def publish(self, topic: str, data: Dict[str, Any]) -> int:
+        """
+        Publish to a topic.
+
+        Parameters
+        ----------
+        topic : str
+            the topic.
+        data : Dict[str, Any]
+            the entry, which must be JSON serializable.
+
+        Returns
+        -------
+        int
+            number of subscribers it was queued for.
+
+        """
+        data = json.dumps(data)
+        with self._lock:
+            self._seq += 1
+            entry = (self._seq, data)
+            self.published += 1
+
+            history = self._history.get(topic)
+            if history is None:
+                history = self._history[topic] = deque(
+                    maxlen=self.history_size)
+                if len(self._history) > self.max_topics:
+                    _, forgotten = self._history.popitem(last=False)
+                    if forgotten:
+                        self._forgotten = max(self._forgotten,
+                                              forgotten[-1][0])
+            else:
+                self._history.move_to_end(topic)
+            history.append(entry)
+
+            delivered = 0
+            for subscription in list(self._subscribers.get(topic, ())):
+                if subscription._put(entry):
+                    delivered += 1
+                else:
+                    self._remove(subscription)
+                    subscription._drop()
+                    self.dropped += 1
+
+        return delivered
+
+    def subscribe(self, topics: Iterable[str],
+                  last_id: Optional[int] = None) -> Subscription:
+        """
+        Subscribe to topics.
+
+        Parameters
+        ----------
+        topics : Iterable[str]
+            the topics.
+        last_id : Optional[int]
+            id of the last entry the subscriber saw. Entries after it are
+            queued at once, or a resync entry if some were forgotten.
+
+        Returns
+        -------
+        Subscription
+            the subscription, to be closed when done with.
+
+        Raises
+        ------
+        HubFull
+            if the hub has max_subscribers already.
+
+        """
+        subscription = Subscription(self, tuple(topics), self.queue_size)
+
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise HubFull('Too many subscribers.')
+            self._count += 1
+            for topic in subscription.topics:
+                self._subscribers.setdefault(topic, set()).add(subscription)
+
+            if last_id is not None:
+                missed = self._missed(subscription.topics, last_id)
+                if missed is None or len(missed) > self.queue_size:
+                    subscription._put((self._seq, RESYNC))
+                else:
+                    for entry in missed:
+                        subscription._put(entry)
+
+        return subscription
+
+    def _missed(self, topics: Tuple[str, ...], last_id: int
+                ) -> Optional[List[Entry]]:
+        """Entries after last_id in topics, None if any were forgotten."""
+        if last_id > self._seq:
+            # From before this process started
+            return None
+        if last_id < self._forgotten:
+            return None
+
+        missed = []
+        for topic in topics:
+            history = self._history.get(topic, ())
+            if len(history) == self.history_size \
+                    and history[0][0] > last_id + 1:
+                return None
+            missed.extend(x for x in history if x[0] > last_id)
+        return sorted(missed)
+
+    def _remove(self, subscription: Subscription) -> None:
+        """Unsubscribe, with the lock held. Safe to repeat."""
+        if not subscription.subscribed:
+            return
+        subscription.subscribed = False
+        self._count -= 1
+        for topic in subscription.topics:
+            subscribers = self._subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[topic]
+
+    def _unsubscribe(self, subscription: Subscription) -> None:
+        """Unsubscribe."""
+        with self._lock:
+            self._remove(subscription)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the hub's counters.
+
+        Returns
+        -------
+        Dict[str, int]
+            {subscribers, topics, published, dropped}.
+
+        """
+        with self._lock:
+            return {'subscribers': self._count,
+                    'topics': len(self._subscribers),
+                    'published': self.published, 'dropped': self.dropped}
@@ -0,0 +1,184 @@
+"""
+PeerColab
+
+Python file facilitating chunked, resumable uploads
+
+Each upload is a directory of numbered chunk files. A chunk is streamed to
+a temporary file, hashed as it goes, and renamed into place once complete,
+so a chunk file that exists is whole and a dropped connection only loses
+the chunk being sent.
+
+Copyright Joan Chirinos, 2021.
+"""
+
+from typing import IO, Iterator, List, Optional, Set
+import hashlib
+import os
+import shutil
+import tempfile
+
+
+class UploadStore:
+
+    def __init__(self, root: str, chunk_size: int = 8 * 1024 * 1024,
+                 piece_size: int = 64 * 1024) -> None:
+        """
+        Initialize UploadStore class.
+
+        Parameters
+        ----------
+        root : str
+            directory holding uploads in progress.
+        chunk_size : int
+            bytes per uploaded chunk, a multiple of piece_size.
+        piece_size : int
+            bytes read or written at a time, and the size of the pieces
+            the finished upload is read back in.
+
+        Returns
+        -------
+        None
+
+        """
+        if chunk_size % piece_size:
+            raise ValueError('chunk_size must be a multiple of piece_size.')
+
+        self.root = root
+        self.chunk_size = chunk_size
+        self.piece_size = piece_size
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, upload_id: str, n: int) -> str:
+        """Get the path of chunk number n of an upload."""
+        return os.path.join(self.root, upload_id, str(n))
+
+    def write_chunk(self, upload_id: str, n: int, stream: IO[bytes],
+                    length: int, sha256: Optional[str] = None) -> str:
+        """
+        Stream a chunk to disk, replacing any earlier copy of it.
+
+        Parameters
+        ----------
+        upload_id : str
+            the upload id.
+        n : int
+            the chunk's number, from 0.
+        stream : IO[bytes]
+            where to read the chunk from.
+        length : int
+            the chunk's length.
+        sha256 : Optional[str]
+            the chunk's expected sha256 hex digest.
+
+        Returns
+        -------
+        str
+            the chunk's sha256 hex digest.
+
+        Raises
+        ------
+        ValueError
+            if stream ends before length bytes, or doesn't match sha256.
+
+        """
+        directory = os.path.join(self.root, upload_id)
+        os.makedirs(directory, exist_ok=True)
+
+        digest = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                remaining = length
+                while remaining:
+                    piece = stream.read(min(self.piece_size, remaining))
+                    if not piece:
+                        raise ValueError('The chunk ended early.')
+                    digest.update(piece)
+                    f.write(piece)
+                    remaining -= len(piece)
+                f.flush()
+                os.fsync(f.fileno())
+            if sha256 is not None and sha256.lower() != digest.hexdigest():
+                raise ValueError('The chunk doesn\'t match its checksum.')
+            os.replace(tmp, self.path(upload_id, n))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        return digest.hexdigest()
+
+    def received(self, upload_id: str) -> List[int]:
+        """
+        Get the numbers of the chunks received so far.
+
+        Parameters
+        ----------
+        upload_id : str
+            the upload id.
+
+        Returns
+        -------
+        List[int]
+            the chunk numbers, in order.
+
+        """
+        try:
+            names = os.listdir(os.path.join(self.root, upload_id))
+        except FileNotFoundError:
+            return []
+        return sorted(int(name) for name in names if name.isdigit())
+
+    def pieces(self, upload_id: str, chunks: int) -> Iterator[bytes]:
+        """
+        Read an upload back in order, piece_size bytes at a time.
+
+        Parameters
+        ----------
+        upload_id : str
+            the upload id.
+        chunks : int
+            number of chunks in the upload.
+
+        Yields
+        ------
+        bytes
+            each piece.
+
+        """
+        for n in range(chunks):
+            with open(self.path(upload_id, n), 'rb') as f:
+                while True:
+                    piece = f.read(self.piece_size)
+                    if not piece:
+                        break
+                    yield piece
+
+    def read_piece(self, upload_id: str, seq: int) -> bytes:
+        """
+        Read piece number seq of an upload again.
+
+        Parameters
+        ----------
+        upload_id : str
+            the upload id.
+        seq : int
+            the piece's number, as counted by pieces.
+
+        Returns
+        -------
+        bytes
+            the piece.
+
+        """
+        offset = seq * self.piece_size
+        with open(self.path(upload_id, offset // self.chunk_size), 'rb') as f:
+            f.seek(offset % self.chunk_size)
+            return f.read(self.piece_size)
+
+    def delete(self, upload_id: str) -> None:
+        """Delete everything received for an upload."""
+        shutil.rmtree(os.path.join(self.root, upload_id), ignore_errors=True)
+
+    def all_ids(self) -> Set[str]:
+        """Get the ids of every upload with anything on disk."""
+        return set(os.listdir(self.root))